@@ -0,0 +1,73 @@
+"""Aho-Corasick multi-pattern string matching for SmugMug Tagger.
+
+Finds every occurrence of every pattern in a text in one pass, however
+many patterns there are, instead of one substring search per pattern.
+"""
+import collections
+
+
+class Automaton:
+    """
+    A keyword automaton built once from a vocabulary.
+
+    Args:
+        patterns: Iterable of pattern strings, or of (pattern, value) pairs
+            where value is reported for each match instead of the pattern
+    """
+
+    def __init__(self, patterns=()):
+        # Per state: transitions, failure link and (length, value) outputs
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self.size = 0
+        for pattern in patterns:
+            pattern, value = pattern if isinstance(pattern, tuple) else (pattern, pattern)
+            if pattern:
+                self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = following
+        self._out[state].append((len(pattern), value))
+        self.size += 1
+
+    def _build(self):
+        # Breadth-first, so each state's failure link is finished before its children's
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                # A match ending here also ends every pattern on the failure path
+                self._out[following] = self._out[following] + self._out[self._fail[following]]
+
+    def finditer(self, text):
+        """
+        Yield (start, end, value) for every pattern occurrence in text,
+        in order of where they end
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in out[state]:
+                yield position + 1 - length, position + 1, value
+
+    def __len__(self):
+        return self.size
@@ -9,11 +9,37 @@ from requests_oauthlib import OAuth1Session
 from google.cloud import vision
 from urllib.parse import urlparse
 import time
-import re
 import hashlib
+import itertools
 import datetime
 import threading
 
+from batch_controller import AdaptiveBatchController
+import budget
+from budget import VISION_BUDGET, BudgetExceeded
+from bursts import BurstShare, group_bursts, image_coordinates, BURST_SAMPLES
+from checkpoint import ProcessedBitmap, save_checkpoint, load_checkpoint, delete_checkpoint
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from deadline import Deadline, DeadlineExpired, NO_DEADLINE, SMUGMUG_TIMEOUT, VISION_TIMEOUT
+from feature_cascade import FeatureCascade, load_rules
+from gazetteer import GAZETTEER, GAZETTEER_SKIPS_LOCATION
+from hedging import Hedger
+from job_engine import JOB_ENGINE
+import ledger
+from location_clusters import LocationShare, cluster_images, LOCATION_SAMPLES
+from near_duplicates import NearDuplicateIndex, hash_url, DUPLICATE_MAX_DISTANCE
+from pipeline import Pipeline, Stage, get_pipeline_stats
+from preview import (
+    stratified_sample, project_tags, shared_savings, estimate_units,
+    PREVIEW_SAMPLE_SIZE, PREVIEW_DEADLINE_SECONDS
+)
+from regions import REGION_INDEX
+from result_log import get_result_log, delete_result_log
+import retry
+from singleflight import SingleFlight, FileLock
+from solar import album_lighting, SOLAR_TAGS
+from tag_rules import TAG_RULES
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -28,9 +54,82 @@ app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev_secret_key')
 
 # In-memory state cache - will be lost on app restart
 # For demonstration purposes - in production, use Redis or database
+# Jobs and their state belong to one process, so the app runs as a single
+# gunicorn worker with several threads (see Procfile)
 PROCESS_STATE = {}
-# Background processing tasks
-BACKGROUND_TASKS = {}
+# Held while a session's state is saved or cleared, so a save never revives a cleared session
+STATE_LOCK = threading.Lock()
+
+# Overall time budget for one album job, in seconds (0 for no limit)
+JOB_DEADLINE_SECONDS = float(os.environ.get('JOB_DEADLINE_SECONDS', 6 * 3600))
+# Time budget for web requests that call SmugMug or Vision themselves
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', 20))
+
+# Duplicate slow Vision calls once they pass a percentile of recent latency
+VISION_HEDGER = Hedger(
+    'vision',
+    enabled=os.environ.get('VISION_HEDGING', 'false').lower() in ('1', 'true', 'yes'),
+    percentile=float(os.environ.get('VISION_HEDGE_PERCENTILE', 95)),
+    max_fraction=float(os.environ.get('VISION_HEDGE_MAX_FRACTION', 0.05))
+)
+
+def _is_outage(error):
+    """Only network, quota and server errors count towards opening a breaker"""
+    return retry.classify_failure(error) == retry.TRANSIENT
+
+# Fail fast while Vision or SmugMug is down; jobs pause until a probe succeeds
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 60))
+VISION_BREAKER = CircuitBreaker(
+    'Vision', BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS, is_failure=_is_outage
+)
+SMUGMUG_BREAKER = CircuitBreaker(
+    'SmugMug', BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS, is_failure=_is_outage,
+    is_failure_result=lambda response: retry.classify_failure(status_code=response.status_code) == retry.TRANSIENT
+)
+
+# Errors that stop work on an image without it being the image's fault
+ABORT_ERRORS = (DeadlineExpired, CircuitOpenError, BudgetExceeded)
+
+# Run expensive Vision features only when labels or hit rates say they'll add tags
+VISION_CASCADE = FeatureCascade(
+    enabled=os.environ.get('VISION_CASCADE', 'true').lower() in ('1', 'true', 'yes'),
+    rules=load_rules(os.environ.get('VISION_CASCADE_RULES'))
+)
+
+# Preview ID -> preview status and projections, in memory like PROCESS_STATE
+PREVIEWS = {}
+
+# Numbers each batch's pipeline, so batches starting at the same index keep separate stats
+BATCH_NUMBERS = itertools.count()
+
+# Album URL -> session ID of the job processing it, so duplicate submissions attach
+ALBUM_JOBS = {}
+ALBUM_JOBS_LOCK = threading.Lock()
+# Concurrent analyses and writes of the same image share one call
+VISION_FLIGHT = SingleFlight('vision')
+WRITE_FLIGHT = SingleFlight('write')
+
+# Worker count and queue depth for each pipeline stage. Vision and SmugMug
+# calls are network bound, so those stages get more than one worker.
+PIPELINE_CONFIG = {
+    'fetch': {
+        'workers': int(os.environ.get('PIPELINE_FETCH_WORKERS', 2)),
+        'queue_size': int(os.environ.get('PIPELINE_FETCH_QUEUE', 8))
+    },
+    'analyze': {
+        'workers': int(os.environ.get('PIPELINE_ANALYZE_WORKERS', 4)),
+        'queue_size': int(os.environ.get('PIPELINE_ANALYZE_QUEUE', 8))
+    },
+    'merge': {
+        'workers': int(os.environ.get('PIPELINE_MERGE_WORKERS', 1)),
+        'queue_size': int(os.environ.get('PIPELINE_MERGE_QUEUE', 8))
+    },
+    'write': {
+        'workers': int(os.environ.get('PIPELINE_WRITE_WORKERS', 2)),
+        'queue_size': int(os.environ.get('PIPELINE_WRITE_QUEUE', 4))
+    }
+}
 
 def get_path_from_url(url):
     """Extract path from SmugMug URL"""
@@ -73,216 +172,312 @@ def extract_album_info_from_url(url):
     
     return username, album_path
 
+def album_job_key(album_url):
+    """Normalise an album URL so different spellings of it map to one job"""
+    parsed = urlparse(album_url)
+    return f"{parsed.netloc.lower()}{get_path_from_url(album_url).lower()}"
+
 def generate_session_id(album_url, threshold):
     """Generate a unique session ID based on album URL and threshold"""
     source = f"{album_url}:{threshold}:{datetime.datetime.now().strftime('%Y-%m-%d')}"
     return hashlib.md5(source.encode()).hexdigest()
 
 def save_progress(session_id, album_key, album_name, album_url, total_images, 
-                 processed_indices, processed_images, failed_images, next_index, is_processing=False):
-    """Save processing progress to state cache"""
-    PROCESS_STATE[session_id] = {
-        'album_key': album_key,
-        'album_name': album_name,
-        'album_url': album_url,
-        'total_images': total_images,
-        'processed_indices': list(processed_indices),
-        'processed_images': processed_images,
-        'failed_images': failed_images,
-        'next_index': next_index,
-        'last_updated': datetime.datetime.now().isoformat(),
-        'is_processing': is_processing  # Flag to indicate if background processing is active
-    }
-    return PROCESS_STATE[session_id]
+                 processed_indices, new_images, failed_images, next_index, is_processing=False,
+                 create=False):
+    """
+    Save processing progress to state cache
+    
+    Newly processed images are appended to the session's on-disk result log;
+    the state itself only keeps the count and the most recent few. The
+    processed bitmap and position are checkpointed to disk, so the session
+    can be resumed after a restart.
+    
+    Only a new submission passes create. Otherwise nothing is saved for a
+    session that has no state - it was cleared - and None is returned, so a
+    job still running for a cleared session can't bring it back.
+    """
+    with STATE_LOCK:
+        # Other keys (dead letters, errors) carry over from the previous save
+        state = PROCESS_STATE.get(session_id)
+        if state is None:
+            if not create:
+                logger.debug(f"Session {session_id} was cleared, not saving its progress")
+                return None
+            state = PROCESS_STATE[session_id] = {}
+        
+        result_log = get_result_log(session_id)
+        result_log.extend(new_images)
+        
+        # Keep the bitmap itself rather than copying the indices on every save
+        processed_indices = ProcessedBitmap.from_value(processed_indices, total_images)
+        state.update({
+            'album_key': album_key,
+            'album_name': album_name,
+            'album_url': album_url,
+            'total_images': total_images,
+            'processed_indices': processed_indices,
+            'processed_count': result_log.count,
+            'recent_images': list(result_log.recent),
+            'failed_images': failed_images,
+            'next_index': next_index,
+            'last_updated': datetime.datetime.now().isoformat(),
+            'is_processing': is_processing  # Flag to indicate if background processing is active
+        })
+        save_checkpoint(session_id, state)
+    return state
 
 def load_progress(session_id):
-    """Load processing progress from state cache"""
-    return PROCESS_STATE.get(session_id)
+    """Load processing progress from state cache, or from the session's checkpoint after a restart"""
+    state = PROCESS_STATE.get(session_id)
+    if state is not None:
+        return state
+    with STATE_LOCK:
+        checkpoint = load_checkpoint(session_id)
+        if checkpoint is None:
+            return None
+        result_log = get_result_log(session_id)
+        checkpoint.update({
+            'processed_count': result_log.count,
+            'recent_images': list(result_log.recent),
+            'is_processing': False
+        })
+        logger.info(f"Resuming session {session_id} from its checkpoint at index {checkpoint.get('next_index')}")
+        return PROCESS_STATE.setdefault(session_id, checkpoint)
 
-def get_vision_tags(vision_client, image_url, threshold=20):
-    """Get comprehensive tags using multiple Vision API features with enhanced sensitivity"""
+def call_vision(vision_client, feature, vision_image, deadline=NO_DEADLINE, session_id=None):
+    """Charge one Vision feature to the budget and run it through the circuit breaker and hedger"""
+    VISION_BUDGET.charge(session_id, feature)
+    detect = getattr(vision_client, feature)
+    requests_sent = itertools.count()
+    
+    def send(**kwargs):
+        # The first request is charged above; a hedged duplicate is billed by Vision too
+        if next(requests_sent):
+            VISION_BUDGET.charge(session_id, feature)
+        return detect(**kwargs)
+    
+    return VISION_BREAKER.call(
+        VISION_HEDGER.call, feature, send,
+        image=vision_image, timeout=deadline.timeout(VISION_TIMEOUT)
+    )
+
+def get_vision_tags(vision_client, image_url, threshold=20, deadline=NO_DEADLINE, session_id=None,
+                    location=None, position=None):
+    """
+    Get comprehensive tags using multiple Vision API features with enhanced sensitivity
+    
+    Each Vision call's timeout comes from the deadline; DeadlineExpired is
+    raised rather than returning partial tags once the budget runs out,
+    CircuitOpenError while Vision is down and BudgetExceeded once the
+    session's or the day's Vision quota is used up. A network, quota or
+    server error is raised at once instead of trying the image's other
+    features, so one image can't open the breaker on its own. If every
+    feature fails the last error is raised, so an outage never turns into
+    generic tags.
+    
+    Labels run first; VISION_CASCADE then decides from them, the tags found
+    so far and each feature's recent hit rate whether the more expensive
+    landmark, web, face and object features are worth calling.
+    
+    location is an optional LocationClaim for the image's GPS cluster: if
+    another image in the cluster already ran landmark and web detection
+    their tags are reused instead, otherwise this image's are shared.
+    
+    position is the image's optional (latitude, longitude): the names of
+    places near it come from the local gazetteer, and when one of them
+    pins down the spot (a glen, loch, summit...) landmark and web
+    detection are skipped.
+    """
     logger.debug(f"Starting Vision analysis on: {image_url}")
     vision_image = vision.Image()
     vision_image.source.image_uri = image_url
     
     all_tags = set()
     confidence_scores = {}
+    features_run = []
+    feature_errors = []
+    # Labels from label detection; None until it has run successfully
+    labels = None
+    decisions = {}
+    succeeded = []
+    
+    def detect(feature):
+        features_run.append(feature)
+        return call_vision(vision_client, feature, vision_image, deadline, session_id)
+    
+    def should_run(feature):
+        run, reason = VISION_CASCADE.decide(feature, labels, len(all_tags))
+        if not run:
+            logger.debug(f"Skipping {feature} ({reason})")
+        decisions[feature] = (reason, len(all_tags))
+        return run
+    
+    def record(feature):
+        reason, tags_before = decisions[feature]
+        VISION_CASCADE.record(feature, len(all_tags) - tags_before, reason)
+        succeeded.append(feature)
+    
+    def failed(name, error):
+        # An outage or rate limit would fail the image's other features too, each
+        # counting towards the breaker - give up on the image so it is retried later
+        if _is_outage(error):
+            raise error
+        feature_errors.append(error)
+        logger.error(f"Error in {name}: {str(error)}")
     
     try:
         # Use multiple Vision API services in sequence to maximize tag generation
         
-        # 1. Landmark Detection with lower threshold
-        logger.debug("Detecting landmarks (with higher sensitivity)...")
-        try:
-            landmark_response = vision_client.landmark_detection(image=vision_image)
-            for landmark in landmark_response.landmark_annotations:
-                # 15% threshold for landmarks - lower to catch more
-                if landmark.score * 100 >= 15:
-                    landmark_name = landmark.description.lower()
-                    all_tags.add(landmark_name)
-                    confidence_scores[landmark_name] = f"{landmark.score * 100:.1f}%"
-                    
-                    # Extract country and region info
-                    parts = landmark_name.split(',')
-                    if len(parts) > 1:
-                        for part in parts:
-                            part = part.strip().lower()
-                            if part and len(part) > 3:  # Avoid too short names
-                                all_tags.add(part)
-                    
-                    # Add location data if available
-                    for location in landmark.locations:
-                        if location.lat_lng:
-                            lat = location.lat_lng.latitude
-                            lng = location.lat_lng.longitude
-                            # Add Scotland-specific location tags
-                            if 56 < lat < 59:  # Scotland
-                                all_tags.add('scotland')
-                                if lat > 58:  # Northern Scotland
-                                    all_tags.add('northern scotland')
-                                    if lng < -4:  # Northwest
-                                        all_tags.add('northwest highlands')
-                                        all_tags.add('west coast scotland')
-                                    elif lng > -3:  # Northeast
-                                        all_tags.add('northeast scotland')
-                                        all_tags.add('east coast scotland')
-                                elif 57 < lat < 58:  # Central Scotland
-                                    all_tags.add('central scotland')
-                                    if lng < -5:
-                                        all_tags.add('western scotland')
-                                    elif lng > -3:
-                                        all_tags.add('eastern scotland')
-                                elif lat < 57:  # Southern Scotland
-                                    all_tags.add('southern scotland')
-        except Exception as e:
-            logger.error(f"Error in landmark detection: {str(e)}")
-        
-        # 2. Web Detection for better landmark recognition - most effective for landmarks
-        logger.debug("Running web detection for better landmark recognition...")
-        try:
-            web_response = vision_client.web_detection(image=vision_image)
-            
-            if web_response.web_detection:
-                # Best guess labels often identify landmarks better
-                for label in web_response.web_detection.best_guess_labels:
-                    label_lower = label.label.lower()
-                    all_tags.add(label_lower)
-                    confidence_scores[f"web_{label_lower}"] = "web match"
-                    
-                    # Break compound labels into components
-                    words = re.findall(r'\b[a-zA-Z]{3,}\b', label_lower)
-                    for word in words:
-                        if word not in ['and', 'the', 'with', 'from']:
-                            all_tags.add(word)
-                
-                # Web entities with 15% threshold
-                for entity in web_response.web_detection.web_entities:
-                    if entity.score >= 0.15:  # 15% threshold for web entities
-                        entity_lower = entity.description.lower()
-                        all_tags.add(entity_lower)
-                        confidence_scores[f"web_{entity_lower}"] = f"{entity.score * 100:.1f}%"
-                
-                # Check page titles and descriptions for Scotland-specific keywords
-                scotland_keywords = [
-                    'scotland', 'scottish', 'highland', 'hebrides', 'isle', 'skye', 
-                    'glen', 'loch', 'ben', 'munro', 'cairn', 'cuillin', 'torridon',
-                    'glencoe', 'nevis', 'cairngorm', 'edinburgh', 'glasgow', 'inverness'
-                ]
-                
-                for page in web_response.web_detection.pages_with_matching_images:
-                    if page.page_title:
-                        for keyword in scotland_keywords:
-                            if keyword in page.page_title.lower():
-                                all_tags.add(keyword)
-                                # Try to extract meaningful phrases around keyword
-                                title_lower = page.page_title.lower()
-                                index = title_lower.find(keyword)
-                                if index >= 0:
-                                    start = max(0, index - 15)
-                                    end = min(len(title_lower), index + len(keyword) + 15)
-                                    context = title_lower[start:end]
-                                    # Extract words
-                                    words = re.findall(r'\b[a-zA-Z]{3,}\b', context)
-                                    if len(words) >= 2:
-                                        if keyword in words:
-                                            words.remove(keyword)
-                                        for word in words[:3]:  # Limit to 3 words
-                                            if word not in ['and', 'the', 'with', 'from', 'this', 'that']:
-                                                all_tags.add(word)
-                                                all_tags.add(f"{keyword} {word}")
-        except Exception as e:
-            logger.error(f"Error in web detection: {str(e)}")
-     
-        # 3. Label Detection - essential for scene context
+        # 1. Label Detection - cheap, and its labels decide which other features run
         logger.debug("Analyzing general content...")
         try:
-            label_response = vision_client.label_detection(image=vision_image)
+            label_response = detect('label_detection')
+            labels = {label.description.lower() for label in label_response.label_annotations}
+            confident = set()
             for label in label_response.label_annotations:
                 if label.score * 100 >= threshold:
                     label_lower = label.description.lower()
-                    all_tags.add(label_lower)
+                    confident.add(label_lower)
                     confidence_scores[label_lower] = f"{label.score * 100:.1f}%"
-                    
-                    # Add some generic categories based on labels
-                    if label_lower in ['mountain', 'hill', 'valley', 'landscape']:
-                        all_tags.add('landscape')
-                        all_tags.add('nature')
-                        all_tags.add('outdoors')
-                    
-                    if label_lower in ['tree', 'forest', 'woodland']:
-                        all_tags.add('forest')
-                        all_tags.add('trees')
-                        all_tags.add('nature')
-                    
-                    if label_lower in ['sea', 'ocean', 'coast', 'beach', 'shore']:
-                        all_tags.add('coastal')
-                        all_tags.add('seascape')
-                    
-                    if label_lower in ['snow', 'winter', 'ice']:
-                        all_tags.add('winter')
-                        all_tags.add('snow')
-                    
-                    if label_lower in ['hiking', 'trekking', 'walking', 'trail']:
-                        all_tags.add('hiking')
-                        all_tags.add('trekking')
-                        all_tags.add('outdoor activity')
+            all_tags |= confident
+            # Add some generic categories based on labels
+            all_tags |= TAG_RULES.label_tags(confident)
+        except ABORT_ERRORS:
+            raise
         except Exception as e:
-            logger.error(f"Error in label detection: {str(e)}")
+            failed('label detection', e)
         
-        # 4. People Detection via Face Detection (lightweight)
-        logger.debug("Detecting people...")
-        try:
-            face_response = vision_client.face_detection(image=vision_image)
-            if face_response.face_annotations:
-                all_tags.add('people')
-                if len(face_response.face_annotations) > 1:
-                    all_tags.add('group photo')
-                    if len(face_response.face_annotations) > 3:
-                        all_tags.add('group')
-                
-                # Add activity context if applicable
-                if any(tag in all_tags for tag in ['kayak', 'boat', 'canoe']):
-                    all_tags.add('kayaking')
-                    all_tags.add('water activity')
+        # Place names near the image's GPS position, from the local gazetteer
+        places = GAZETTEER.lookup(*position) if position else []
+        for place in places:
+            place_name = place['name'].lower()
+            all_tags.add(place_name)
+            confidence_scores[place_name] = f"gazetteer {place['distance']}m"
+        skip_location = GAZETTEER_SKIPS_LOCATION and GAZETTEER.names_spot(places)
+        if skip_location:
+            logger.debug(f"Gazetteer named {places[0]['name']}, skipping landmark and web detection")
+        
+        # Landmark and web tags from an image taken nearby, if there is one
+        shared_location = location.shared() if location and not skip_location else None
+        if shared_location is not None:
+            logger.debug("Using landmark and web tags from the image's location cluster")
+            all_tags.update(shared_location[0])
+            confidence_scores.update(shared_location[1])
+        location_tags_before = set(all_tags)
+        location_scores_before = set(confidence_scores)
+        
+        # 2. Landmark Detection with lower threshold
+        if shared_location is None and not skip_location and should_run('landmark_detection'):
+            logger.debug("Detecting landmarks (with higher sensitivity)...")
+            try:
+                landmark_response = detect('landmark_detection')
+                for landmark in landmark_response.landmark_annotations:
+                    # 15% threshold for landmarks - lower to catch more
+                    if landmark.score * 100 >= 15:
+                        landmark_name = landmark.description.lower()
+                        all_tags.add(landmark_name)
+                        confidence_scores[landmark_name] = f"{landmark.score * 100:.1f}%"
+                        
+                        # Extract country and region info
+                        parts = landmark_name.split(',')
+                        if len(parts) > 1:
+                            for part in parts:
+                                part = part.strip().lower()
+                                if part and len(part) > 3:  # Avoid too short names
+                                    all_tags.add(part)
+                        
+                        # Add region tags for the landmark's location, if available
+                        for landmark_location in landmark.locations:
+                            if landmark_location.lat_lng:
+                                lat_lng = (landmark_location.lat_lng.latitude, landmark_location.lat_lng.longitude)
+                                all_tags.update(REGION_INDEX.region_tags(*lat_lng))
+                                all_tags.update(GAZETTEER.place_tags(*lat_lng))
+                record('landmark_detection')
+            except ABORT_ERRORS:
+                raise
+            except Exception as e:
+                failed('landmark detection', e)
+        
+        # 3. Web Detection for better landmark recognition - most effective for landmarks
+        if shared_location is None and not skip_location and should_run('web_detection'):
+            logger.debug("Running web detection for better landmark recognition...")
+            try:
+                web_response = detect('web_detection')
                 
-                if any(tag in all_tags for tag in ['mountain', 'hill', 'hiking', 'trail']):
-                    all_tags.add('hiking')
-                    all_tags.add('trekking')
+                if web_response.web_detection:
+                    # Best guess labels often identify landmarks better
+                    for label in web_response.web_detection.best_guess_labels:
+                        label_lower = label.label.lower()
+                        all_tags.add(label_lower)
+                        confidence_scores[f"web_{label_lower}"] = "web match"
+                        
+                        # Break compound labels into components
+                        all_tags.update(TAG_RULES.words(label_lower))
                     
-            # If we still don't have enough tags, try object detection
-            if len(all_tags) < 5:
-                logger.debug("Trying object detection as fallback...")
-                try:
-                    object_response = vision_client.object_localization(image=vision_image)
-                    for obj in object_response.localized_object_annotations:
-                        if obj.score >= 0.3:
-                            all_tags.add(obj.name.lower())
-                            if obj.name.lower() == 'person':
-                                all_tags.add('people')
-                except Exception as obj_error:
-                    logger.error(f"Error in object detection: {str(obj_error)}")
-        except Exception as e:
-            logger.error(f"Error in face detection: {str(e)}")
+                    # Web entities with 15% threshold
+                    for entity in web_response.web_detection.web_entities:
+                        if entity.score >= 0.15:  # 15% threshold for web entities
+                            entity_lower = entity.description.lower()
+                            all_tags.add(entity_lower)
+                            confidence_scores[f"web_{entity_lower}"] = f"{entity.score * 100:.1f}%"
+                    
+                    # Check page titles for regional keywords (see TAG_RULES title_keywords)
+                    for page in web_response.web_detection.pages_with_matching_images:
+                        if page.page_title:
+                            all_tags |= TAG_RULES.title_tags(page.page_title)
+                record('web_detection')
+            except ABORT_ERRORS:
+                raise
+            except Exception as e:
+                failed('web detection', e)
+        
+        # Share what the location features found with the rest of the cluster
+        location_calls = len([f for f in succeeded if f in ('landmark_detection', 'web_detection')])
+        if location and location_calls:
+            location.resolve(
+                all_tags - location_tags_before,
+                {key: value for key, value in confidence_scores.items() if key not in location_scores_before},
+                location_calls
+            )
+        
+        # 4. People Detection via Face Detection (lightweight)
+        if should_run('face_detection'):
+            logger.debug("Detecting people...")
+            try:
+                face_response = detect('face_detection')
+                if face_response.face_annotations:
+                    all_tags.add('people')
+                    if len(face_response.face_annotations) > 1:
+                        all_tags.add('group photo')
+                        if len(face_response.face_annotations) > 3:
+                            all_tags.add('group')
+                record('face_detection')
+            except ABORT_ERRORS:
+                raise
+            except Exception as e:
+                failed('face detection', e)
+        
+        # 5. If we still don't have enough tags, try object detection
+        if should_run('object_localization'):
+            logger.debug("Trying object detection as fallback...")
+            try:
+                object_response = detect('object_localization')
+                for obj in object_response.localized_object_annotations:
+                    if obj.score >= 0.3:
+                        all_tags.add(obj.name.lower())
+                        if obj.name.lower() == 'person':
+                            all_tags.add('people')
+                record('object_localization')
+            except ABORT_ERRORS:
+                raise
+            except Exception as obj_error:
+                failed('object detection', obj_error)
+        
+        # Nothing succeeded - Vision is failing, not the image, so fail it
+        # (transient errors are retried) rather than write generic tags
+        if feature_errors and len(feature_errors) == len(features_run):
+            raise feature_errors[-1]
         
         # Add default tags if still empty
         if len(all_tags) <= 1:  # Only AutoTagged or empty
@@ -292,10 +487,8 @@ def get_vision_tags(vision_client, image_url, threshold=20):
                 'landscape', 'travel', 'adventure'
             ])
         
-        # Add wilderness scotland specific tags
-        if 'scotland' in all_tags:
-            all_tags.add('wilderness scotland')
-            all_tags.add('scottish highlands')
+        # Activity and region context (people kayaking, wilderness scotland...)
+        all_tags |= TAG_RULES.context_tags(all_tags)
         
         # Add AutoTagged marker
         all_tags.add('AutoTagged')
@@ -303,15 +496,35 @@ def get_vision_tags(vision_client, image_url, threshold=20):
         logger.debug(f"Vision analysis complete. Found {len(all_tags)} tags.")
         return list(all_tags), confidence_scores
         
+    except ABORT_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"Error in Vision API detection: {str(e)}")
         logger.error(traceback.format_exc())
-        return ['AutoTagged'], {}
+        raise
+    finally:
+        # Let another image in the cluster run the location features instead
+        if location:
+            location.release()
+
+def _image_size(image):
+    """Return the image size in bytes from the listing, or 0 if unknown"""
+    try:
+        if 'ArchivedSize' in image:
+            return int(image['ArchivedSize'])
+        if 'OriginalSize' in image:
+            return int(image['OriginalSize'])
+    except Exception as size_error:
+        # Continue even if we can't determine size
+        logger.debug(f"Could not determine image size: {str(size_error)}")
+    return 0
 
 def process_images_batch(smugmug, vision_client, album_key, images, 
-                       start_index, max_count, threshold=20, process_state=None):
+                       start_index, max_count, threshold=20, process_state=None, indices=None,
+                       controller=None, deadline=NO_DEADLINE, session_id=None, duplicates=None,
+                       bursts=None, locations=None, lighting=None, dry_run=False, cancelled=None):
     """
-    Process a batch of images with robust error handling and resumability
+    Process a batch of images through the list -> fetch -> analyze -> merge -> write pipeline
     
     Args:
         smugmug: OAuth1Session for SmugMug
@@ -322,19 +535,44 @@ def process_images_batch(smugmug, vision_client, album_key, images,
         max_count: Maximum number of images to process
         threshold: Vision API threshold
         process_state: Optional state for resumption
+        indices: Optional explicit image indices to process instead of the range
+        controller: Optional AdaptiveBatchController fed with latencies and outcomes
+        deadline: Deadline shared by every call in the batch; images not started
+            before it expires are left for a later run
+        session_id: Session the batch's Vision calls are charged to
+        duplicates: Optional NearDuplicateIndex - images whose thumbnail hash
+            is close to an analysed image's reuse its Vision tags
+        bursts: Optional BurstShare - images in a capture-time burst inherit
+            the tags of the burst's analysed sample
+        locations: Optional LocationShare - images in a GPS cluster reuse the
+            landmark and web tags of the cluster's samples
+        lighting: Optional dict of listing index to lighting tags (golden
+            hour, night...) computed from capture time and GPS
+        dry_run: Tag the images without writing them to SmugMug or the
+            ledger - processed_images holds the tags they would get
+        cancelled: Optional callable that returns True once the job has been
+            cancelled - no image is started or written after that
         
     Returns:
-        Tuple of (processed_images, failed_images, processed_indices, next_index)
+        Tuple of (processed_images, failures, processed_indices, next_index)
+        containing only the images handled by this batch. Each failure is a
+        dict with the image index, ImageKey, filename, reason, kind
+        (retry.TRANSIENT or retry.PERMANENT) and last response.
     """
     processed_images = []
-    failed_images = []
+    failures = []
     processed_indices = set()
+    results_lock = threading.Lock()
+    # Set when images are left for a later run (deadline, open circuit or budget)
+    abandoned = threading.Event()
     
-    # Use existing state if provided
+    # Indices finished by earlier batches
+    already_processed = ProcessedBitmap()
     if process_state:
-        processed_images = process_state.get('processed_images', [])
-        failed_images = process_state.get('failed_images', [])
-        processed_indices = process_state.get('processed_indices', [])
+        already_processed = ProcessedBitmap.from_value(process_state.get('processed_indices'))
+    
+    # Outcomes recorded by any earlier session for this album
+    album_ledger = ledger.get_ledger(album_key)
     
     # Calculate upper bound based on available images
     end_index = min(start_index + max_count, len(images))
@@ -342,126 +580,452 @@ def process_images_batch(smugmug, vision_client, album_key, images,
     # Debug
     logger.debug(f"Processing batch from {start_index} to {end_index-1} (total: {len(images)} images)")
     
-    # Process one image at a time for stability
-    for i in range(start_index, end_index):
-        # Skip large images that might cause timeouts
-        try:
+    def fail(item, reason, kind=retry.PERMANENT, last_response=None):
+        image = item['image']
+        if controller:
+            controller.record_result(False)
+        if not dry_run:
+            album_ledger.record(image.get('ImageKey'), ledger.FAILED, reason=reason, threshold=threshold)
+        with results_lock:
+            failures.append({
+                'index': item['index'],
+                'imageKey': image.get('ImageKey'),
+                'filename': image.get('FileName', 'Unknown'),
+                'reason': reason,
+                'kind': kind,
+                'lastResponse': last_response
+            })
+    
+    def list_images():
+        """Stage 1: walk the listing and yield the images that still need work"""
+        for i in (indices if indices is not None else range(start_index, end_index)):
+            if deadline.expired:
+                logger.debug(f"Deadline expired, leaving images from index {i} for a later run")
+                abandoned.set()
+                return
+            if cancelled and cancelled():
+                logger.debug(f"Job cancelled, not starting images from index {i}")
+                abandoned.set()
+                return
+            if VISION_BREAKER.is_open or SMUGMUG_BREAKER.is_open:
+                logger.debug(f"Circuit open, leaving images from index {i} for a later run")
+                abandoned.set()
+                return
+            try:
+                VISION_BUDGET.check(session_id)
+            except BudgetExceeded as e:
+                logger.debug(f"{str(e)}, leaving images from index {i} for a later run")
+                abandoned.set()
+                return
             image = images[i]
-            image_size = 0
-            if 'ArchivedSize' in image:
-                image_size = int(image['ArchivedSize'])
-            elif 'OriginalSize' in image:
-                image_size = int(image['OriginalSize'])
             
-            # Skip images larger than 10MB
+            # Skip large images that might cause timeouts
+            image_size = _image_size(image)
             if image_size > 10 * 1024 * 1024:
                 logger.warning(f"Skipping large image {image.get('FileName', 'Unknown')} ({image_size/1024/1024:.1f}MB)")
-                failed_images.append(f"{image.get('FileName', 'Unknown')} (too large)")
-                continue
-        except Exception as size_error:
-            # Continue even if we can't determine size
-            logger.debug(f"Could not determine image size: {str(size_error)}")
-        
-        # Skip already processed
-        if i in processed_indices:
-            logger.debug(f"Skipping already processed image at index {i}")
-            continue
-        
-        image = images[i]
-        try:
-            # Check if already tagged
-            current_keywords = image.get('KeywordArray', [])
-            if current_keywords and 'AutoTagged' in current_keywords:
-                logger.debug(f"Image {image.get('FileName', 'Unknown')} already tagged, skipping")
-                processed_indices.add(i)
-                # Force garbage collection after each image to manage memory
-                if i % 2 == 0:  # Run GC every 2 images
-                    import gc
-                    gc.collect()
+                fail({'index': i, 'image': image}, 'too large')
                 continue
             
-            # Get image URLs
-            image_key = f"{image['ImageKey']}-0"
-            image_url = image.get('ArchivedUri') or image.get('WebUri')
-            thumbnail_url = image.get('ThumbnailUrl')
-            
-            if not image_url:
-                logger.debug(f"No image URL found for {image.get('FileName', 'Unknown')}, skipping")
-                failed_images.append(image.get('FileName', 'Unknown'))
+            # Skip already processed
+            if i in already_processed:
+                logger.debug(f"Skipping already processed image at index {i}")
                 continue
             
-            # Get Vision AI tags
-            logger.debug(f"Getting Vision AI tags for {image.get('FileName', 'Unknown')}")
-            vision_tags, confidence_scores = get_vision_tags(vision_client, image_url, threshold)
-            
-            if not vision_tags or len(vision_tags) <= 1:  # Only "AutoTagged" tag
-                logger.debug(f"No useful tags returned from Vision API for {image.get('FileName', 'Unknown')}, trying again with default tags")
-                vision_tags = ['scotland', 'wilderness', 'outdoors', 'nature', 'landscape', 'AutoTagged']
-            
-            # Ensure current_keywords is a list
-            if current_keywords is None:
-                current_keywords = []
-            elif isinstance(current_keywords, str):
-                current_keywords = [current_keywords]
-            
-            # Filter out empty tags
-            vision_tags = [tag for tag in vision_tags if tag.strip()]
-            
-            # Combine with existing tags
-            all_tags = list(dict.fromkeys(current_keywords + vision_tags))
-            logger.debug(f"Combined {len(all_tags)} tags for {image.get('FileName', 'Unknown')}")
-            
-            # Update the image
-            logger.debug(f"Updating image {image_key}")
-            update_data = {
-                'KeywordArray': all_tags,
-                'ShowKeywords': True
-            }
-            
-            # Update base image
-            base_response = smugmug.patch(
-                f'https://api.smugmug.com/api/v2/image/{image_key}',
-                headers={
-                    'Accept': 'application/json',
-                    'Content-Type': 'application/json'
-                },
-                json=update_data
-            )
-            
-            if base_response.status_code != 200:
-                logger.debug(f"Error updating base image: {base_response.status_code}")
-                error_text = base_response.text
-                if len(error_text) > 500:
-                    error_text = error_text[:500] + "..."
-                logger.debug(f"Response: {error_text}")
-                failed_images.append(image.get('FileName', 'Unknown'))
+            # Skip images finished by any session for this album
+            if album_ledger.is_finished(image.get('ImageKey'), threshold):
+                logger.debug(f"Image {image.get('FileName', 'Unknown')} finished in an earlier session, skipping")
+                with results_lock:
+                    processed_indices.add(i)
                 continue
             
-            # Success
-            logger.debug(f"Successfully tagged image {image.get('FileName', 'Unknown')}")
+            yield {'index': i, 'image': image}
+    
+    def fetch(item):
+        """Stage 2: resolve image URLs and current keywords"""
+        image = item['image']
+        
+        # Check if already tagged
+        current_keywords = image.get('KeywordArray', [])
+        if current_keywords and 'AutoTagged' in current_keywords:
+            logger.debug(f"Image {image.get('FileName', 'Unknown')} already tagged, skipping")
+            if not dry_run:
+                album_ledger.record(image.get('ImageKey'), ledger.SKIPPED, current_keywords, threshold=threshold)
+            with results_lock:
+                processed_indices.add(item['index'])
+            return None
+        
+        # Ensure current_keywords is a list
+        if current_keywords is None:
+            current_keywords = []
+        elif isinstance(current_keywords, str):
+            current_keywords = [current_keywords]
+        
+        item['current_keywords'] = current_keywords
+        item['image_key'] = f"{image['ImageKey']}-0"
+        item['image_url'] = image.get('ArchivedUri') or image.get('WebUri')
+        item['thumbnail_url'] = image.get('ThumbnailUrl')
+        
+        if not item['image_url']:
+            logger.debug(f"No image URL found for {image.get('FileName', 'Unknown')}, skipping")
+            fail(item, 'no image URL')
+            return None
+        
+        # Perceptual hash of the thumbnail, for reusing a near-duplicate's tags
+        item['dhash'] = None
+        if duplicates and item['thumbnail_url']:
+            try:
+                item['dhash'] = hash_url(item['thumbnail_url'], timeout=deadline.timeout(SMUGMUG_TIMEOUT))
+            except DeadlineExpired:
+                raise
+            except Exception as e:
+                logger.debug(f"Could not hash thumbnail for {image.get('FileName', 'Unknown')}: {str(e)}")
+        return item
+    
+    def analyze(item):
+        """Stage 3: get Vision AI tags"""
+        logger.debug(f"Getting Vision AI tags for {item['image'].get('FileName', 'Unknown')}")
+        started = time.time()
+        
+        def tag_image():
+            # Claimed only when Vision actually runs, so every claim is resolved or released
+            location = locations.claim(item['index']) if locations else None
+            return get_vision_tags(
+                vision_client, item['image_url'], threshold, deadline, session_id, location,
+                image_coordinates(item['image'])
+            )
+        
+        def run_vision():
+            return VISION_FLIGHT.do((item['image']['ImageKey'], threshold), tag_image)
+        
+        def analyze_image():
+            if item['dhash'] is not None:
+                # Burst and bracketed frames share the first analysed frame's tags
+                return duplicates.do(item['dhash'], run_vision)
+            return run_vision()
+        
+        if bursts:
+            item['vision_tags'], item['confidence_scores'] = bursts.do(item['index'], analyze_image)
+        else:
+            item['vision_tags'], item['confidence_scores'] = analyze_image()
+        if controller:
+            controller.record_vision(time.time() - started)
+        return item
+    
+    def merge(item):
+        """Stage 4: combine Vision tags with the existing keywords"""
+        vision_tags = item['vision_tags']
+        if not vision_tags or len(vision_tags) <= 1:  # Only "AutoTagged" tag
+            logger.debug(f"No useful tags returned from Vision API for {item['image'].get('FileName', 'Unknown')}, trying again with default tags")
+            vision_tags = ['scotland', 'wilderness', 'outdoors', 'nature', 'landscape', 'AutoTagged']
+        
+        # Filter out empty tags
+        vision_tags = [tag for tag in vision_tags if tag.strip()]
+        
+        # Sun position tags need no Vision call, so burst and duplicate images get their own
+        if lighting:
+            vision_tags += lighting.get(item['index'], [])
+        
+        # Combine with existing tags
+        item['all_tags'] = list(dict.fromkeys(item['current_keywords'] + vision_tags))
+        logger.debug(f"Combined {len(item['all_tags'])} tags for {item['image'].get('FileName', 'Unknown')}")
+        return item
+    
+    def write(item):
+        """Stage 5: PATCH the keywords back to SmugMug"""
+        image = item['image']
+        if dry_run:
+            with results_lock:
+                processed_images.append({
+                    'index': item['index'],
+                    'filename': image.get('FileName', 'Unknown'),
+                    'keywords': item['all_tags'],
+                    'addedTags': [tag for tag in item['all_tags'] if tag not in item['current_keywords']]
+                })
+                processed_indices.add(item['index'])
+            return None
+        
+        if cancelled and cancelled():
+            logger.debug(f"Job cancelled, not writing {image.get('FileName', 'Unknown')}")
+            abandoned.set()
+            return None
+        
+        logger.debug(f"Updating image {item['image_key']}")
+        update_data = {
+            'KeywordArray': item['all_tags'],
+            'ShowKeywords': True
+        }
+        
+        # Update base image - identical concurrent updates share one PATCH
+        started = time.time()
+        base_response = WRITE_FLIGHT.do(
+            (item['image_key'], ledger.keywords_hash(item['all_tags'])),
+            SMUGMUG_BREAKER.call, smugmug.patch,
+            f'https://api.smugmug.com/api/v2/image/{item["image_key"]}',
+            headers={
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'
+            },
+            json=update_data,
+            timeout=deadline.timeout(SMUGMUG_TIMEOUT)
+        )
+        if controller:
+            controller.record_smugmug(time.time() - started)
+        
+        if base_response.status_code != 200:
+            logger.debug(f"Error updating base image: {base_response.status_code}")
+            error_text = base_response.text
+            if len(error_text) > 500:
+                error_text = error_text[:500] + "..."
+            logger.debug(f"Response: {error_text}")
+            fail(
+                item, f"SmugMug update failed ({base_response.status_code})",
+                retry.classify_failure(status_code=base_response.status_code), error_text
+            )
+            return None
+        
+        # Success
+        logger.debug(f"Successfully tagged image {image.get('FileName', 'Unknown')}")
+        album_ledger.record(image.get('ImageKey'), ledger.TAGGED, item['all_tags'], threshold=threshold)
+        if controller:
+            controller.record_result(True)
+        with results_lock:
             processed_images.append({
                 'filename': image.get('FileName', 'Unknown'),
-                'keywords': all_tags,
-                'thumbnailUrl': thumbnail_url
+                'keywords': item['all_tags'],
+                'thumbnailUrl': item['thumbnail_url']
             })
-            processed_indices.add(i)
-            
-        except Exception as e:
-            error_trace = traceback.format_exc()
-            logger.debug(f"Error processing image: {str(e)}")
-            logger.debug(f"Error trace: {error_trace}")
-            failed_images.append(image.get('FileName', 'Unknown'))
+            processed_indices.add(item['index'])
+        return None
+    
+    def on_error(stage_name, item, error):
+        if isinstance(error, ABORT_ERRORS):
+            # Not the image's fault - it is picked up again by the next run
+            abandoned.set()
+            logger.debug(f"Abandoned {item['image'].get('FileName', 'Unknown')} in {stage_name} stage: {str(error)}")
+            return
+        logger.debug(f"Error processing image in {stage_name} stage: {str(error)}")
+        logger.debug(f"Error trace: {traceback.format_exc()}")
+        fail(item, f"{stage_name} failed: {str(error)}", retry.classify_failure(error), str(error)[:500])
+    
+    first_index = min(indices) if indices else start_index
+    batch_pipeline = Pipeline(
+        f"{album_key}:{first_index}:{next(BATCH_NUMBERS)}",
+        [
+            Stage('fetch', fetch, **PIPELINE_CONFIG['fetch']),
+            Stage('analyze', analyze, **PIPELINE_CONFIG['analyze']),
+            Stage('merge', merge, **PIPELINE_CONFIG['merge']),
+            Stage('write', write, **PIPELINE_CONFIG['write'])
+        ],
+        on_error=on_error
+    )
+    batch_pipeline.run(list_images())
+    
+    # Set next index - end of current batch, or -1 if we've finished all images.
+    # If the deadline, an open circuit or the budget cut the batch short, redo it;
+    # finished images are skipped.
+    if abandoned.is_set():
+        next_index = start_index
+    else:
+        next_index = end_index if end_index < len(images) else -1
+    
+    return processed_images, failures, processed_indices, next_index
+
+def create_clients():
+    """
+    Create the SmugMug and Vision clients from the configured credentials
+    
+    Returns:
+        Tuple of (smugmug, vision_client, temp_file_path) - the caller removes
+        temp_file_path, if set, once the Vision client is no longer needed
+    """
+    # Load SmugMug credentials from environment
+    if os.environ.get('SMUGMUG_TOKENS'):
+        tokens = json.loads(os.environ.get('SMUGMUG_TOKENS'))
+    else:
+        # Fallback to file for local development
+        config_file = Path.home() / "Desktop" / "SmugMugTagger" / "config" / "smugmug_tokens.json"
+        with open(config_file) as f:
+            tokens = json.load(f)
+    
+    api_key = os.environ.get('SMUGMUG_API_KEY', 'jFhhPG4GQcm7VRRqs7m3ndXjHMxgp9Dq')
+    api_secret = os.environ.get('SMUGMUG_API_SECRET', 'C2Z7nFsXBMvMpvzq5NhRp9DqsJN7kDThP744WCr34cmPk4b24NdPB3sz6gNBPzjR')
+    
+    smugmug = OAuth1Session(
+        api_key,
+        client_secret=api_secret,
+        resource_owner_key=tokens['access_token'],
+        resource_owner_secret=tokens['access_token_secret']
+    )
+    
+    # Setup Google Cloud Vision client
+    temp_file_path = None
+    if os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON'):
+        # Create a persistent file for the entire process
+        temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
+        temp_file.write(os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON'))
+        temp_file.close()
+        temp_file_path = temp_file.name
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_file_path
+    else:
+        # Fallback to file for local development
+        creds_file = Path.home() / "Desktop" / "SmugMugTagger" / "credentials" / "google_credentials.json"
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = str(creds_file)
+    
+    vision_client = vision.ImageAnnotatorClient()
+    return smugmug, vision_client, temp_file_path
+
+def lookup_album(smugmug, url, deadline=NO_DEADLINE):
+    """
+    Find the album for a SmugMug URL
+    
+    Returns:
+        Tuple of (album_key, album_name, album_url)
         
-        # Pause between images - important for stability
-        time.sleep(3)
+    Raises:
+        ValueError: If the user or album cannot be found
+    """
+    # Get user info
+    response = SMUGMUG_BREAKER.call(
+        smugmug.get,
+        'https://api.smugmug.com/api/v2!authuser',
+        headers={'Accept': 'application/json'},
+        timeout=deadline.timeout(SMUGMUG_TIMEOUT)
+    )
+    
+    if response.status_code != 200:
+        raise ValueError(f"Failed to authenticate with SmugMug (status {response.status_code})")
+    
+    auth_nickname = response.json()['Response']['User']['NickName']
+    logger.debug(f"Authenticated as: {auth_nickname}")
+    
+    # Extract album path and username from URL
+    username, album_path = extract_album_info_from_url(url)
+    
+    if not username or not album_path:
+        logger.debug("Failed to parse URL - Using fallback method")
+        album_path = get_path_from_url(url)
+        username = auth_nickname  # Fall back to authenticated user
+    
+    logger.debug(f"Looking up album {album_path} owned by {username}")
+    response = SMUGMUG_BREAKER.call(
+        smugmug.get,
+        f'https://api.smugmug.com/api/v2/user/{username}!urlpathlookup',
+        params={'urlpath': album_path},
+        headers={'Accept': 'application/json'},
+        timeout=deadline.timeout(SMUGMUG_TIMEOUT)
+    )
+    
+    if response.status_code != 200:
+        raise ValueError(f"Failed to find album (status {response.status_code})")
+    
+    response_data = response.json()['Response']
+    if 'Album' not in response_data:
+        raise ValueError("Album not found")
+    
+    album_data = response_data['Album']
+    return album_data['AlbumKey'], album_data.get('Name') or "Unknown Album", album_data['WebUri']
+
+def list_album_images(smugmug, album_key, deadline=NO_DEADLINE):
+    """
+    Get the album's image listing, with the fields tagging and grouping use
+    
+    Raises:
+        ValueError: If SmugMug does not return the listing
+    """
+    response = SMUGMUG_BREAKER.call(
+        smugmug.get,
+        f'https://api.smugmug.com/api/v2/album/{album_key}!images',
+        params={
+            '_filter': 'ImageKey,FileName,ThumbnailUrl,ArchivedUri,WebUri,KeywordArray,DateTimeOriginal,Latitude,Longitude'
+        },
+        headers={'Accept': 'application/json'},
+        timeout=deadline.timeout(SMUGMUG_TIMEOUT)
+    )
+    
+    if response.status_code != 200:
+        raise ValueError(f"Failed to get album images (status {response.status_code})")
+    
+    return response.json()['Response'].get('AlbumImage', [])
+
+def pause_album_job(session_id, url, threshold, retry_queue, delay, message):
+    """
+    Re-queue a running album job to resume after a delay
     
-    # Set next index - end of current batch, or -1 if we've finished all images
-    next_index = end_index if end_index < len(images) else -1
+    Used when a circuit breaker is open or the daily Vision quota is used up.
     
-    return processed_images, failed_images, processed_indices, next_index
+    Args:
+        session_id: Session ID, which is also the job ID
+        url: Album URL the job was submitted with
+        threshold: Vision API threshold
+        retry_queue: The job's RetryQueue, or None - pending retries go with the job
+        delay: Seconds until the job should resume
+        message: Why the job is paused, shown to the user
+    """
+    state = load_progress(session_id)
+    if not state:
+        return
+    pending = retry_queue.pop_due(now=float('inf')) if retry_queue else []
+    JOB_ENGINE.submit(
+        session_id, process_album_job,
+        args=(session_id, url, threshold, state['next_index'], pending),
+        delay=delay, requeue=True
+    )
+    state.update({
+        'is_processing': True,
+        'retry_pending': len(pending),
+        'last_error': message
+    })
+    logger.warning(f"Session {session_id} paused for {delay:.0f}s: {message}")
 
-def process_album_background(session_id, start_index, batch_size=2):
-    """Background thread function to process an entire album automatically"""
+def settle_dead_letter(state, image_keys):
+    """
+    Drop the dead-letter entries, and their failed_images lines, of images
+    that have since been tagged or have failed for good again
+    """
+    dead_letter = state.get('dead_letter', [])
+    if not image_keys or not dead_letter:
+        return
+    kept = []
+    for entry in dead_letter:
+        if entry.get('imageKey') in image_keys:
+            line = f"{entry['filename']} ({entry['reason']})"
+            if line in state['failed_images']:
+                state['failed_images'].remove(line)
+        else:
+            kept.append(entry)
+    dead_letter[:] = kept
+
+def quota_delay():
+    """Seconds a new job should wait for the daily Vision quota to reset, or 0"""
+    try:
+        VISION_BUDGET.check()
+    except BudgetExceeded as e:
+        return e.retry_after
+    return 0
+
+def process_album_job(session_id, url, threshold, start_index, retry_entries=None):
+    """
+    Background job that looks up an album and processes all of its images
+    
+    Transient failures are retried with exponential backoff; permanent ones,
+    and transient ones that run out of attempts, go to the session's
+    dead-letter list. When retry_entries is given only those images are run.
+    Batch sizes adapt to the observed Vision and SmugMug latency and error rate.
+    If a circuit breaker opens or the daily Vision quota runs out the job
+    pauses and is re-queued to resume later; it stops at its own Vision cap.
+    
+    retry_entries keep their attempt counts, so retries carried over a pause
+    still run out; /retry-failed resets them. A retried image's old
+    dead-letter entry stays until it succeeds or is dead-lettered again.
+    """
+    temp_file_path = None
+    album_lock = None
+    retry_queue = None
+    
+    def cancelled():
+        # Cleared sessions cancel their job; the engine tracks that for running jobs too
+        return not JOB_ENGINE.is_active(session_id)
+    
     try:
         # Load session state
         state = load_progress(session_id)
@@ -469,140 +1033,340 @@ def process_album_background(session_id, start_index, batch_size=2):
             logger.error(f"No session state found for {session_id}")
             return
         
-        # Mark session as processing
-        save_progress(
-            session_id, 
-            state['album_key'], 
-            state['album_name'], 
-            state['album_url'], 
-            state['total_images'], 
-            state['processed_indices'], 
-            state['processed_images'], 
-            state['failed_images'], 
-            state['next_index'],
-            is_processing=True
-        )
-        
         logger.debug(f"Starting background processing for session {session_id} from index {start_index}")
         
-        # Setup SmugMug client
-        tokens = json.loads(os.environ.get('SMUGMUG_TOKENS'))
-        api_key = os.environ.get('SMUGMUG_API_KEY', 'jFhhPG4GQcm7VRRqs7m3ndXjHMxgp9Dq')
-        api_secret = os.environ.get('SMUGMUG_API_SECRET', 'C2Z7nFsXBMvMpvzq5NhRp9DqsJN7kDThP744WCr34cmPk4b24NdPB3sz6gNBPzjR')
+        # Every SmugMug and Vision call in the job draws its timeout from this
+        deadline = Deadline(JOB_DEADLINE_SECONDS)
         
-        smugmug = OAuth1Session(
-            api_key,
-            client_secret=api_secret,
-            resource_owner_key=tokens['access_token'],
-            resource_owner_secret=tokens['access_token_secret']
-        )
+        smugmug, vision_client, temp_file_path = create_clients()
         
-        # Setup Google Cloud Vision client
-        credentials_json = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
+        # Look the album up unless an earlier run already did
+        album_key = state['album_key']
+        album_name = state['album_name']
+        album_url = state['album_url']
+        if not album_key:
+            album_key, album_name, album_url = lookup_album(smugmug, url, deadline)
+            logger.debug(f"Found album: '{album_name}' with key: {album_key}")
         
-        # Create a persistent file for the entire process
-        temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
-        temp_file.write(credentials_json)
-        temp_file.close()
-        temp_file_path = temp_file.name
-        
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_file_path
-        vision_client = vision.ImageAnnotatorClient()
+        # Only one job per album at a time, across threads and gunicorn workers
+        album_lock = FileLock(f"album:{album_key}")
+        if not album_lock.acquire():
+            album_lock = None
+            logger.debug(f"Album {album_key} is already being processed, not starting session {session_id}")
+            # The job holding the lock owns the checkpoint - don't save this copy over it
+            state.update({
+                'is_processing': False,
+                'last_error': "This album is already being processed by another job"
+            })
+            return
         
         # Get album images
-        response = smugmug.get(
-            f'https://api.smugmug.com/api/v2/album/{state["album_key"]}!images',
-            params={
-                '_filter': 'ImageKey,FileName,ThumbnailUrl,ArchivedUri,WebUri,KeywordArray'
-            },
-            headers={'Accept': 'application/json'}
+        images = list_album_images(smugmug, album_key, deadline)
+        total_images = len(images)
+        logger.debug(f"Found {total_images} images in the album")
+        
+        current_index = start_index
+        if current_index >= total_images:
+            current_index = 0
+        
+        # Sizes each batch from the latencies seen so far
+        controller = AdaptiveBatchController(
+            vision_workers=PIPELINE_CONFIG['analyze']['workers'],
+            write_workers=PIPELINE_CONFIG['write']['workers']
         )
         
-        if response.status_code != 200:
-            logger.error(f"Failed to get images: {response.status_code}")
-            logger.error(response.text)
-            return
+        # Thumbnail hashes of analysed images, shared by every batch in the job
+        duplicates = NearDuplicateIndex() if DUPLICATE_MAX_DISTANCE > 0 else None
+        # Shots taken seconds apart at the same spot - one sample per burst goes to Vision
+        bursts = BurstShare(group_bursts(images)) if BURST_SAMPLES > 0 else None
+        if bursts:
+            logger.debug(f"Grouped {bursts.grouped_images} of {total_images} images into bursts")
+        # Images taken at the same place - landmark and web detection run on a few per cluster
+        locations = LocationShare(cluster_images(images)) if LOCATION_SAMPLES > 0 else None
+        if locations:
+            logger.debug(f"Found {locations.clusters} location clusters")
+        # Golden hour, night... from capture time and GPS, for the whole listing at once
+        lighting = album_lighting(images) if SOLAR_TAGS else None
+        if lighting:
+            logger.debug(f"Computed lighting tags for {len(lighting)} of {total_images} images")
         
-        images = response.json()['Response'].get('AlbumImage', [])
-        total_images = len(images)
+        # Transient failures wait here for their next attempt
+        retry_queue = retry.RetryQueue()
+        if retry_entries:
+            # Dead-lettered images (retry failed) start now; retries carried over
+            # a pause wait out their backoff
+            positions = {image.get('ImageKey'): i for i, image in enumerate(images)}
+            for entry in retry_entries:
+                if entry.get('imageKey') in positions:
+                    entry = dict(entry, index=positions[entry['imageKey']], attempts=entry.get('attempts', 0))
+                    retry_queue.push(entry, delay=None if entry['attempts'] else 0)
+            current_index = state['next_index']
         
-        current_index = start_index
-        threshold = 30  # Default threshold
+        # Record the album details and mark the session as processing
+        state = save_progress(
+            session_id, album_key, album_name, album_url, total_images,
+            state['processed_indices'], [], state['failed_images'],
+            current_index if total_images else -1,
+            is_processing=bool(total_images)
+        )
+        if state is None:
+            return
+        state.update({'threshold': threshold, 'last_error': None})
         
-        # Process all remaining batches
-        while current_index < total_images:
+        # Process all remaining batches, then any retries still waiting
+        while True:
             # Reload state to get any updates
             current_state = load_progress(session_id)
+            if not current_state or cancelled():
+                logger.debug(f"Session {session_id} was cleared, stopping")
+                break
             
-            # Process next batch
-            new_processed, new_failed, updated_indices, next_index = process_images_batch(
-                smugmug, vision_client, state['album_key'], images, 
-                current_index, batch_size, threshold, current_state
-            )
-            
-            # Update processed images and indices
-            processed_images = current_state['processed_images']
-            processed_images.extend(new_processed)
+            due = retry_queue.pop_due()
+            if due:
+                attempts = {entry['index']: entry['attempts'] for entry in due}
+                try:
+                    new_processed, failures, updated_indices, _ = process_images_batch(
+                        smugmug, vision_client, album_key, images,
+                        0, 0, threshold, current_state, indices=sorted(attempts),
+                        controller=controller, deadline=deadline, session_id=session_id,
+                        duplicates=duplicates, bursts=bursts, locations=locations, lighting=lighting,
+                        cancelled=cancelled
+                    )
+                except Exception:
+                    # Nothing from the batch was recorded - every retry waits again
+                    for entry in due:
+                        retry_queue.push(entry)
+                    raise
+                # Retries the batch never reached (deadline, open circuit, budget) keep
+                # their attempt count and wait again, so pausing or parking carries them
+                reached = set(updated_indices) | {failure['index'] for failure in failures}
+                already_processed = ProcessedBitmap.from_value(current_state['processed_indices'])
+                for entry in due:
+                    if entry['index'] not in reached and entry['index'] not in already_processed:
+                        retry_queue.push(entry)
+            elif current_index != -1 and current_index < total_images:
+                # Process next batch
+                attempts = {}
+                new_processed, failures, updated_indices, current_index = process_images_batch(
+                    smugmug, vision_client, album_key, images, 
+                    current_index, controller.next_batch_size(deadline.remaining()), threshold, current_state,
+                    controller=controller, deadline=deadline, session_id=session_id,
+                    duplicates=duplicates, bursts=bursts, locations=locations, lighting=lighting,
+                    cancelled=cancelled
+                )
+            elif len(retry_queue):
+                if not deadline.expired:
+                    # Nothing to do until the next retry is due
+                    remaining = deadline.remaining()
+                    time.sleep(min(retry_queue.seconds_until_next(), 30, remaining if remaining is not None else 30))
+                    continue
+                # Out of time with retries still waiting - they are parked below
+                attempts, new_processed, failures, updated_indices = {}, [], [], set()
+            else:
+                logger.debug(f"Completed processing all images for session {session_id}")
+                break
             
+            # Re-queue transient failures with backoff, dead-letter the rest
             failed_images = current_state['failed_images']
-            failed_images.extend(new_failed)
+            dead_letter = current_state.setdefault('dead_letter', [])
+            settled = {images[i].get('ImageKey') for i in updated_indices}
+            for failure in failures:
+                failure['attempts'] = attempts.get(failure['index'], 0) + 1
+                if failure['kind'] != retry.TRANSIENT or failure['attempts'] > retry.MAX_RETRIES:
+                    settled.add(failure['imageKey'])
+            # Earlier dead letters of these images are replaced by this outcome
+            settle_dead_letter(current_state, settled)
+            for failure in failures:
+                if failure['kind'] == retry.TRANSIENT and failure['attempts'] <= retry.MAX_RETRIES:
+                    logger.debug(f"Will retry {failure['filename']} (attempt {failure['attempts']}): {failure['reason']}")
+                    retry_queue.push(failure)
+                else:
+                    dead_letter.append(failure)
+                    failed_images.append(f"{failure['filename']} ({failure['reason']})")
             
-            processed_indices = current_state['processed_indices']
+            processed_indices = ProcessedBitmap.from_value(current_state['processed_indices'], total_images)
             processed_indices.update(updated_indices)
             
-            # Save updated progress
-            save_progress(
+            # Save updated progress - new_processed goes to the result log
+            current_state = save_progress(
                 session_id, 
-                state['album_key'], 
-                state['album_name'], 
-                state['album_url'], 
+                album_key, 
+                album_name, 
+                album_url, 
                 total_images, 
                 processed_indices, 
-                processed_images, 
+                new_processed, 
                 failed_images, 
-                next_index,
-                is_processing=(next_index != -1)
+                current_index,
+                is_processing=(current_index != -1 or bool(len(retry_queue)))
             )
+            if current_state is None:
+                break
+            current_state['retry_pending'] = len(retry_queue)
+            current_state['batching'] = controller.stats()
+            current_state['duplicates'] = duplicates.stats() if duplicates else None
+            current_state['bursts'] = (
+                bursts.stats(VISION_BUDGET.session_usage(session_id)['units']) if bursts else None
+            )
+            current_state['locations'] = locations.stats() if locations else None
             
-            # Update current index for next batch
-            if next_index == -1:
-                # All done
-                logger.debug(f"Completed processing all images for session {session_id}")
+            # Don't grind through failures while a dependency is down
+            open_breaker = next((b for b in (VISION_BREAKER, SMUGMUG_BREAKER) if b.is_open), None)
+            if open_breaker:
+                delay = open_breaker.retry_after()
+                pause_album_job(
+                    session_id, url, threshold, retry_queue, delay,
+                    f"{open_breaker.name} is unavailable - paused, resuming in {delay:.0f}s"
+                )
                 break
-                
-            current_index = next_index
             
-        # Clean up temp file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+            # Wait for the quota reset, or stop at the job's own cap
+            budget_error = None
+            try:
+                VISION_BUDGET.check(session_id)
+            except BudgetExceeded as e:
+                budget_error = e
+            if budget_error and budget_error.scope == budget.DAILY:
+                pause_album_job(
+                    session_id, url, threshold, retry_queue, budget_error.retry_after,
+                    f"{str(budget_error)} - paused until then"
+                )
+                break
             
-        # Remove from background tasks
-        if session_id in BACKGROUND_TASKS:
-            del BACKGROUND_TASKS[session_id]
+            if deadline.expired or budget_error:
+                if budget_error:
+                    reason = "job Vision budget used up before retry"
+                    message = "Vision budget for this job used up - submit the album again to continue"
+                else:
+                    reason = "job deadline reached before retry"
+                    message = "Job time budget used up - submit the album again to continue"
+                # Park pending retries where "retry failed" can reach them
+                parked = retry_queue.pop_due(now=float('inf'))
+                settle_dead_letter(current_state, {entry['imageKey'] for entry in parked})
+                for entry in parked:
+                    entry['reason'] = f"{entry['reason']} ({reason})"
+                    current_state.setdefault('dead_letter', []).append(entry)
+                    failed_images.append(f"{entry['filename']} ({entry['reason']})")
+                current_state.update({
+                    'is_processing': False,
+                    'retry_pending': 0,
+                    'last_error': message
+                })
+                logger.debug(f"Stopping session {session_id} at index {current_index}: {message}")
+                break
             
+    except CircuitOpenError as e:
+        pause_album_job(
+            session_id, url, threshold, retry_queue, e.retry_after,
+            f"{e.name} is unavailable - paused, resuming in {e.retry_after:.0f}s"
+        )
+    
     except Exception as e:
         logger.error(f"Error in background processing: {str(e)}")
         logger.error(traceback.format_exc())
         
-        # Mark session as not processing
+        # Mark session as not processing and keep the error for the UI
         state = load_progress(session_id)
         if state:
-            save_progress(
+            state = save_progress(
                 session_id, 
                 state['album_key'], 
                 state['album_name'], 
                 state['album_url'], 
                 state['total_images'], 
                 state['processed_indices'], 
-                state['processed_images'], 
+                [], 
                 state['failed_images'], 
                 state['next_index'],
                 is_processing=False
             )
+        if state:
+            state['last_error'] = str(e)
+    
+    finally:
+        if album_lock:
+            album_lock.release()
+        
+        # Clean up temp file
+        if temp_file_path and os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+def preview_album_job(preview_id, url, threshold, sample_size):
+    """
+    Background job that tags a stratified sample of an album without writing
+    
+    Projects tag frequencies, Vision units and cost, and the time to tag
+    the whole album from the sample, and stores them in PREVIEWS.
+    """
+    temp_file_path = None
+    preview = PREVIEWS[preview_id]
+    preview.update({'status': 'running', 'error': None})
+    try:
+        deadline = Deadline(PREVIEW_DEADLINE_SECONDS)
+        smugmug, vision_client, temp_file_path = create_clients()
+        album_key, album_name, album_url = lookup_album(smugmug, url, deadline)
+        images = list_album_images(smugmug, album_key, deadline)
+        preview.update({'albumName': album_name, 'albumUrl': album_url, 'totalImages': len(images)})
+        
+        # Only images the full run would tag
+        album_ledger = ledger.get_ledger(album_key)
+        pending = [
+            i for i, image in enumerate(images)
+            if 'AutoTagged' not in (image.get('KeywordArray') or [])
+            and not album_ledger.is_finished(image.get('ImageKey'), threshold)
+        ]
+        clusters = cluster_images(images)
+        weights = stratified_sample(images, sample_size, clusters, pending)
+        logger.debug(f"Previewing {len(weights)} of {len(pending)} untagged images in '{album_name}'")
         
-        # Remove from background tasks
-        if session_id in BACKGROUND_TASKS:
-            del BACKGROUND_TASKS[session_id]
+        # The preview ID is reused on refresh, so count only this run's usage
+        usage_before = VISION_BUDGET.session_usage(preview_id)['features']
+        started = time.time()
+        processed, failures, _, _ = process_images_batch(
+            smugmug, vision_client, album_key, images, 0, 0, threshold,
+            indices=sorted(weights), deadline=deadline, session_id=preview_id,
+            lighting=album_lighting(images) if SOLAR_TAGS else None, dry_run=True
+        )
+        elapsed = time.time() - started
+        
+        results = {entry['index']: entry['addedTags'] for entry in processed}
+        inherited, located = shared_savings(images, pending, clusters)
+        sample_features = {
+            feature: units - usage_before.get(feature, 0)
+            for feature, units in VISION_BUDGET.session_usage(preview_id)['features'].items()
+        }
+        # Failed images were charged for the calls made before they failed
+        units = estimate_units(sample_features, len(results) + len(failures), len(pending), inherited, located)
+        daily_remaining = VISION_BUDGET.remaining()[budget.DAILY]
+        preview.update({
+            'status': 'complete',
+            'pendingImages': len(pending),
+            'sampled': len(weights),
+            'analysed': len(results),
+            'failed': len(failures),
+            'elapsedSeconds': round(elapsed, 1),
+            'tags': project_tags(results, weights, len(pending)),
+            'estimate': {
+                'visionUnits': units,
+                'totalUnits': sum(units.values()),
+                'cost': VISION_BUDGET.cost(units),
+                'burstImagesShared': inherited,
+                'locationImagesShared': located,
+                # The sample runs at the pipeline's full concurrency, so its time per image carries over
+                'etaSeconds': round(elapsed / len(results) * (len(pending) - inherited)) if results else None,
+                'exceedsDailyBudget': daily_remaining is not None and sum(units.values()) > daily_remaining
+            },
+            'completed': datetime.datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in album preview: {str(e)}")
+        logger.error(traceback.format_exc())
+        preview.update({'status': 'failed', 'error': str(e)})
+    
+    finally:
+        if temp_file_path and os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
 
 @app.route('/')
 def index():
@@ -611,29 +1375,60 @@ def index():
 
 @app.route('/process', methods=['POST'])
 def process():
-    """Process the album URL and threshold from the form with robust resumability"""
+    """
+    Validate the album URL and threshold from the form and queue a processing job
+    
+    All SmugMug and Vision work happens in the background job engine; this
+    returns 202 with the job ID as soon as the job is queued.
+    """
     debug_info = []
-    temp_file_path = None
+    
+    # Get parameters from form
+    url = (request.form.get('album_url') or '').strip()
+    session_id = request.form.get('session_id')
+    
+    debug_info.append(f"Processing URL: {url}")
+    
+    if not url:
+        return jsonify({"error": "No URL provided", "debug": debug_info}), 400
+    
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        return jsonify({"error": "Album URL must be a full http(s) URL", "debug": debug_info}), 400
     
     try:
-        # Get parameters from form
-        url = request.form.get('album_url')
         threshold = float(request.form.get('threshold', 20))
         start_index = int(request.form.get('start_index', 0))
-        session_id = request.form.get('session_id')
-        
-        debug_info.append(f"Processing URL: {url}")
-        debug_info.append(f"Threshold: {threshold}")
-        debug_info.append(f"Start index: {start_index}")
-        debug_info.append(f"Session ID: {session_id}")
-        
-        if not url:
-            return jsonify({"error": "No URL provided", "debug": debug_info})
-        
-        # Generate session ID if not provided
-        if not session_id:
-            session_id = generate_session_id(url, threshold)
-            debug_info.append(f"Generated session ID: {session_id}")
+    except ValueError:
+        return jsonify({"error": "Threshold and start index must be numbers", "debug": debug_info}), 400
+    
+    if not 0 <= threshold <= 100 or start_index < 0:
+        return jsonify({"error": "Threshold must be 0-100 and start index must not be negative", "debug": debug_info}), 400
+    
+    debug_info.append(f"Threshold: {threshold}")
+    debug_info.append(f"Start index: {start_index}")
+    
+    # Check if credentials are configured
+    has_smugmug = bool(os.environ.get('SMUGMUG_TOKENS'))
+    has_vision = bool(os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON'))
+    debug_info.append(f"Has SmugMug credentials: {has_smugmug}")
+    debug_info.append(f"Has Vision credentials: {has_vision}")
+    
+    if not has_smugmug or not has_vision:
+        return jsonify({"error": "Missing API credentials", "debug": debug_info}), 503
+    
+    # Generate session ID if not provided
+    if not session_id:
+        session_id = generate_session_id(url, threshold)
+        debug_info.append(f"Generated session ID: {session_id}")
+    
+    # Check, queue and register under one lock so concurrent submissions can't race
+    with ALBUM_JOBS_LOCK:
+        # A job already running for this album absorbs the duplicate submission
+        active_session = ALBUM_JOBS.get(album_job_key(url))
+        if active_session and active_session != session_id and JOB_ENGINE.is_active(active_session):
+            debug_info.append(f"Attaching to running job {active_session} for this album")
+            session_id = active_session
         
         # Check for existing state
         existing_state = load_progress(session_id)
@@ -645,294 +1440,93 @@ def process():
                 start_index = 0  # Start over
             debug_info.append(f"Resuming from index: {start_index}")
         
-        # Check if credentials are configured
-        has_smugmug = bool(os.environ.get('SMUGMUG_TOKENS'))
-        has_vision = bool(os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON'))
-        debug_info.append(f"Has SmugMug credentials: {has_smugmug}")
-        debug_info.append(f"Has Vision credentials: {has_vision}")
-        
-        if not has_smugmug or not has_vision:
-            return jsonify({"error": "Missing API credentials", "debug": debug_info})
-        
-        # Process the album
-        try:
-            # Load SmugMug credentials from environment
-            debug_info.append("Loading SmugMug credentials...")
-            if os.environ.get('SMUGMUG_TOKENS'):
-                tokens = json.loads(os.environ.get('SMUGMUG_TOKENS'))
-                debug_info.append("Loaded SmugMug tokens from environment")
-            else:
-                # Fallback to file for local development
-                config_file = Path.home() / "Desktop" / "SmugMugTagger" / "config" / "smugmug_tokens.json"
-                with open(config_file) as f:
-                    tokens = json.load(f)
-                debug_info.append("Loaded SmugMug tokens from file")
-            
-            # Setup SmugMug client
-            debug_info.append("Setting up SmugMug client...")
-            api_key = os.environ.get('SMUGMUG_API_KEY', 'jFhhPG4GQcm7VRRqs7m3ndXjHMxgp9Dq')
-            api_secret = os.environ.get('SMUGMUG_API_SECRET', 'C2Z7nFsXBMvMpvzq5NhRp9DqsJN7kDThP744WCr34cmPk4b24NdPB3sz6gNBPzjR')
-            
-            smugmug = OAuth1Session(
-                api_key,
-                client_secret=api_secret,
-                resource_owner_key=tokens['access_token'],
-                resource_owner_secret=tokens['access_token_secret']
-            )
-            debug_info.append("SmugMug client initialized successfully")
-            
-            # Setup Google Cloud Vision client
-            debug_info.append("Setting up Google Cloud Vision client...")
-            temp_file = None
-            
-            if os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON'):
-                # Create a persistent file for the entire process
-                debug_info.append("Using Google credentials from environment")
-                credentials_json = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
-                temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w')
-                temp_file.write(credentials_json)
-                temp_file.close()
-                temp_file_path = temp_file.name
-                debug_info.append(f"Created credentials file at: {temp_file_path}")
-                os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_file_path
-            else:
-                # Fallback to file for local development
-                debug_info.append("Using Google credentials from file")
-                creds_file = Path.home() / "Desktop" / "SmugMugTagger" / "credentials" / "google_credentials.json"
-                os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = str(creds_file)
-            
-            # Create Vision client
-            vision_client = vision.ImageAnnotatorClient()
-            debug_info.append("Vision client initialized successfully")
-            
-            # Get user info
-            debug_info.append("Getting user info...")
-            response = smugmug.get(
-                'https://api.smugmug.com/api/v2!authuser',
-                headers={'Accept': 'application/json'}
-            )
-            
-            if response.status_code != 200:
-                debug_info.append(f"Error getting user info - Status code: {response.status_code}")
-                debug_info.append(f"Response: {response.text}")
-                return jsonify({"error": "Failed to authenticate with SmugMug", "debug": debug_info})
-            
-            user_data = response.json()['Response']['User']
-            auth_nickname = user_data['NickName']
-            debug_info.append(f"Authenticated as: {auth_nickname}")
-            
-# If we have existing state, we can skip the album lookup
-            album_key = None
-            album_url = None
-            album_name = None  # Initialize to None at this point
-            images = None
-            
-            if existing_state:
-                album_key = existing_state.get('album_key')
-                album_url = existing_state.get('album_url')
-                album_name = existing_state.get('album_name')
-                debug_info.append(f"Using cached album info: {album_name} ({album_key})")
-                
-                # We still need to fetch images from the API
-                # Can't cache them due to potential memory issues
-            
-            # If no cached album info, look it up
-            if not album_key:
-                # Extract album path and username from URL
-                username, album_path = extract_album_info_from_url(url)
-                
-                if not username or not album_path:
-                    debug_info.append("Failed to parse URL - Using fallback method")
-                    album_path = get_path_from_url(url)
-                    username = auth_nickname  # Fall back to authenticated user
-                
-                debug_info.append(f"Album owner: {username}")
-                debug_info.append(f"Album path: {album_path}")
-                
-                # Get album info
-                debug_info.append(f"Looking up album...")
-                response = smugmug.get(
-                    f'https://api.smugmug.com/api/v2/user/{username}!urlpathlookup',
-                    params={'urlpath': album_path},
-                    headers={'Accept': 'application/json'}
-                )
-                
-                if response.status_code != 200:
-                    debug_info.append(f"Error looking up album - Status code: {response.status_code}")
-                    debug_info.append(f"Response: {response.text}")
-                    return jsonify({"error": "Failed to find album", "debug": debug_info})
-                
-                response_data = response.json()['Response']
-                debug_info.append(f"Response keys: {list(response_data.keys())}")
-                
-                # Check if we found an album
-                if 'Album' not in response_data:
-                    debug_info.append("No album found in response")
-                    return jsonify({"error": "Album not found", "debug": debug_info})
-                
-                album_data = response_data['Album']
-                album_key = album_data['AlbumKey']
-                album_name = album_data['Name']
-                album_url = album_data['WebUri']
-                debug_info.append(f"Found album: '{album_name}' with key: {album_key}")
-            
-            # If we get here, ensure album_name is set to something in case of an error
-            if album_name is None:
-                album_name = "Unknown Album"
-                
-            # Get images
-            debug_info.append("Getting images from album...")
-            response = smugmug.get(
-                f'https://api.smugmug.com/api/v2/album/{album_key}!images',
-                params={
-                    '_filter': 'ImageKey,FileName,ThumbnailUrl,ArchivedUri,WebUri,KeywordArray'
-                },
-                headers={'Accept': 'application/json'}
-            )
-            
-            if response.status_code != 200:
-                debug_info.append(f"Error getting images - Status code: {response.status_code}")
-                debug_info.append(f"Response: {response.text}")
-                return jsonify({"error": "Failed to get album images", "debug": debug_info})
-            
-            response_data = response.json()['Response']
-            images = response_data.get('AlbumImage', [])
-            total_images = len(images)
-            debug_info.append(f"Found {total_images} images in the album")
-            
-            if not images:
-                if temp_file_path and os.path.exists(temp_file_path):
-                    try:
-                        os.unlink(temp_file_path)
-                        debug_info.append("Cleaned up temporary credentials file")
-                    except Exception as e:
-                        debug_info.append(f"Error removing temp file: {str(e)}")
-                        
-                return jsonify({
-                    "success": True,
-                    "message": "No images found in the album",
-                    "totalImages": 0,
-                    "albumUrl": album_url,
-                    "debug": debug_info
-                })
-            
-            # Process images in a small batch to avoid timeouts
-            # We will process max 2 images per batch
-            max_images_per_batch = 2
-            debug_info.append(f"Processing up to {max_images_per_batch} images per batch")
-            
-            # Initialize from existing state if available
-            processed_images = []
-            failed_images = []
-            processed_indices = set()
-            
-            if existing_state:
-                processed_images = existing_state.get('processed_images', [])
-                failed_images = existing_state.get('failed_images', [])
-                processed_indices = existing_state.get('processed_indices', [])
-                debug_info.append(f"Loaded {len(processed_images)} previously processed images from session")
-            
-            # Process batch
-            new_processed, new_failed, updated_indices, next_index = process_images_batch(
-                smugmug, vision_client, album_key, images, 
-                start_index, max_images_per_batch, threshold,
-                existing_state
-            )
-            
-            # Combine results
-            processed_images.extend(new_processed)
-            failed_images.extend(new_failed)
-            processed_indices.update(updated_indices)
-            
-            # Save progress
-            state = save_progress(
-                session_id, album_key, album_name, album_url, 
-                total_images, processed_indices, processed_images, 
-                failed_images, next_index
+        if not existing_state:
+            # Placeholder state until the job has looked the album up
+            save_progress(
+                session_id, None, "Looking up album...", url, 0,
+                ProcessedBitmap(), [], [], start_index, is_processing=True, create=True
             )
-            
-            # Start background processing for remaining images
-            if next_index != -1 and session_id not in BACKGROUND_TASKS:
-                debug_info.append("Starting background processing for remaining images")
-                
-                # Launch background thread
-                background_thread = threading.Thread(
-                    target=process_album_background,
-                    args=(session_id, next_index, 2)  # Process 2 images per batch
-                )
-                background_thread.daemon = True  # Allow thread to exit when main thread exits
-                background_thread.start()
-                
-                # Store thread reference
-                BACKGROUND_TASKS[session_id] = background_thread
-            
-            # Clean up temp file
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    debug_info.append("Cleaned up temporary credentials file")
-                except Exception as e:
-                    debug_info.append(f"Error removing temp file: {str(e)}")
-            
-            # Calculate progress information
-            remaining_images = total_images - len(processed_indices)
-            
-            # Create message
-            if next_index == -1:
-                # All images processed
-                message = f"Processing complete! {len(processed_images)} images tagged successfully, {len(failed_images)} failed."
-            else:
-                # More images to process
-                message = f"Processed {len(processed_indices)} of {total_images} images so far ({len(processed_indices) / total_images * 100:.1f}%). "
-                message += f"The remaining images are being processed automatically in the background."
-            
-            return jsonify({
-                "success": True,
-                "message": message,
-                "processedImages": new_processed,  # Only return newly processed images
-                "failedImages": new_failed,  # Only return newly failed images
-                "totalImages": total_images,
-                "processedCount": len(processed_indices),
-                "failedCount": len(failed_images),
-                "remainingCount": remaining_images,
-                "nextIndex": next_index,
-                "sessionId": session_id,
-                "albumUrl": album_url,
-                "albumName": album_name,
-                "isComplete": next_index == -1,
-                "isProcessing": session_id in BACKGROUND_TASKS,
-                "debug": debug_info
-            })
-            
-        except Exception as e:
-            error_traceback = traceback.format_exc()
-            debug_info.append(f"Processing error: {str(e)}")
-            debug_info.append(f"Error trace: {error_traceback}")
-            
-            # Clean up temp file if it exists
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    debug_info.append("Cleaned up temporary credentials file")
-                except Exception as clean_e:
-                    debug_info.append(f"Error removing temp file: {str(clean_e)}")
-                    
-            return jsonify({"error": str(e), "debug": debug_info})
-    
-    except Exception as e:
-        error_traceback = traceback.format_exc()
-        debug_info.append(f"Top-level error: {str(e)}")
-        debug_info.append(f"Error trace: {error_traceback}")
         
-        # Clean up temp file if it exists
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-                debug_info.append("Cleaned up temporary credentials file")
-            except Exception as clean_e:
-                debug_info.append(f"Error removing temp file: {str(clean_e)}")
-                
-        return jsonify({"error": str(e), "debug": debug_info})
+        # Out of Vision quota today - schedule the job for the reset
+        delay = quota_delay()
+        queued = JOB_ENGINE.submit(
+            session_id, process_album_job, args=(session_id, url, threshold, start_index), delay=delay
+        )
+        ALBUM_JOBS[album_job_key(url)] = session_id
+    debug_info.append("Queued processing job" if queued else "Attached to the job already running for this session")
+    if queued and delay:
+        debug_info.append(f"Daily Vision quota used up - job starts in {delay:.0f}s")
+    
+    state = load_progress(session_id)
+    return jsonify({
+        "success": True,
+        "message": "Album queued for processing. Images are tagged in the background.",
+        "jobId": session_id,
+        "sessionId": session_id,
+        "status": JOB_ENGINE.status(session_id),
+        "processedImages": [],
+        "failedImages": [],
+        "totalImages": state.get('total_images', 0),
+        "processedCount": len(state.get('processed_indices', [])),
+        "failedCount": len(state.get('failed_images', [])),
+        "nextIndex": start_index,
+        "albumUrl": state.get('album_url'),
+        "albumName": state.get('album_name'),
+        "isComplete": False,
+        "isProcessing": JOB_ENGINE.is_active(session_id),
+        "debug": debug_info
+    }), 202
+
+@app.route('/preview', methods=['POST'])
+def start_preview():
+    """
+    Queue a preview of an album: a stratified sample is tagged without writing
+    
+    Returns 202 with the preview ID; poll /preview/<preview_id> for the
+    projected tags, cost and ETA. A preview of the same album and threshold
+    from earlier today is returned as is unless refresh is set.
+    """
+    url = (request.form.get('album_url') or '').strip()
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        return jsonify({"error": "Album URL must be a full http(s) URL"}), 400
+    
+    try:
+        threshold = float(request.form.get('threshold', 20))
+        sample_size = int(request.form.get('sample_size', PREVIEW_SAMPLE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Threshold and sample size must be numbers"}), 400
+    
+    if not 0 <= threshold <= 100 or not 1 <= sample_size <= 500:
+        return jsonify({"error": "Threshold must be 0-100 and sample size 1-500"}), 400
+    
+    if not os.environ.get('SMUGMUG_TOKENS') or not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON'):
+        return jsonify({"error": "Missing API credentials"}), 503
+    
+    preview_id = f"preview-{generate_session_id(url, threshold)}"
+    existing = PREVIEWS.get(preview_id)
+    refresh = request.form.get('refresh', '').lower() in ('1', 'true', 'yes')
+    if existing and existing['status'] == 'complete' and not refresh:
+        return jsonify(dict(existing, previewId=preview_id)), 200
+    
+    if not JOB_ENGINE.is_active(preview_id):
+        PREVIEWS[preview_id] = {'status': 'queued', 'albumUrl': url, 'threshold': threshold, 'sampleSize': sample_size}
+        JOB_ENGINE.submit(preview_id, preview_album_job, args=(preview_id, url, threshold, sample_size))
+    
+    return jsonify({
+        "success": True,
+        "previewId": preview_id,
+        "status": PREVIEWS[preview_id]['status'],
+        "jobStatus": JOB_ENGINE.status(preview_id)
+    }), 202
+
+@app.route('/preview/<preview_id>', methods=['GET'])
+def get_preview(preview_id):
+    """Get a preview's status and, once complete, its projected tags, cost and ETA"""
+    preview = PREVIEWS.get(preview_id)
+    if not preview:
+        return jsonify({"error": "Preview not found"}), 404
+    return jsonify(dict(preview, previewId=preview_id, jobStatus=JOB_ENGINE.status(preview_id)))
 
 @app.route('/sessions', methods=['GET'])
 def list_sessions():
@@ -948,7 +1542,7 @@ def list_sessions():
             'lastUpdated': data.get('last_updated', ''),
             'nextIndex': data.get('next_index', -1),
             'isComplete': data.get('next_index', -1) == -1,
-            'isProcessing': session_id in BACKGROUND_TASKS  # Check if a thread is processing this session
+            'isProcessing': JOB_ENGINE.is_active(session_id)  # Check if a job is queued or running for this session
         })
     
     # Sort by last updated, newest first
@@ -958,11 +1552,24 @@ def list_sessions():
 
 @app.route('/session/<session_id>', methods=['GET'])
 def get_session(session_id):
-    """Get details for a specific session"""
+    """
+    Get details for a specific session
+    
+    Processed images are paged from the session's result log: pass the
+    returned nextCursor as ?cursor= to read the next page.
+    """
     session_data = load_progress(session_id)
     
     if not session_data:
         return jsonify({"error": "Session not found"}), 404
+    
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    
+    page, next_cursor = get_result_log(session_id).read(cursor, limit)
         
     return jsonify({
         'id': session_id,
@@ -970,32 +1577,80 @@ def get_session(session_id):
         'albumUrl': session_data.get('album_url', ''),
         'totalImages': session_data.get('total_images', 0),
         'processed': len(session_data.get('processed_indices', [])),
-        'processedImages': session_data.get('processed_images', []),
+        'processedCount': session_data.get('processed_count', 0),
+        'processedImages': page,
+        'nextCursor': next_cursor,
+        'recentImages': session_data.get('recent_images', []),
+        'ledger': ledger.get_ledger(session_data['album_key']).counts(session_data.get('threshold')) if session_data.get('album_key') else {},
         'failedImages': session_data.get('failed_images', []),
+        'deadLetter': session_data.get('dead_letter', []),
+        'retryPending': session_data.get('retry_pending', 0),
+        'batching': session_data.get('batching'),
+        'visionUsage': VISION_BUDGET.session_usage(session_id),
+        'duplicates': session_data.get('duplicates'),
+        'bursts': session_data.get('bursts'),
+        'locations': session_data.get('locations'),
         'lastUpdated': session_data.get('last_updated', ''),
         'nextIndex': session_data.get('next_index', -1),
         'isComplete': session_data.get('next_index', -1) == -1,
-        'isProcessing': session_id in BACKGROUND_TASKS  # Check if a thread is processing this session
+        'isProcessing': JOB_ENGINE.is_active(session_id),  # Check if a job is queued or running for this session
+        'jobStatus': JOB_ENGINE.status(session_id),
+        'lastError': session_data.get('last_error')
     })
 
 @app.route('/clear-session/<session_id>', methods=['POST'])
 def clear_session(session_id):
     """Clear a specific session"""
-    if session_id in PROCESS_STATE:
+    if load_progress(session_id) is not None:
         # Stop background processing if active
-        if session_id in BACKGROUND_TASKS:
-            # Note: We can't really "stop" a thread, but we'll remove the reference
-            # The thread will continue running but will eventually exit naturally
-            del BACKGROUND_TASKS[session_id]
-            
-        del PROCESS_STATE[session_id]
+        # Queued jobs are dropped; a running job is marked cancelled and stops
+        # before its next batch or write, and can't save its state back
+        JOB_ENGINE.cancel(session_id)
+        
+        with STATE_LOCK:
+            PROCESS_STATE.pop(session_id, None)
+            delete_result_log(session_id)
+            delete_checkpoint(session_id)
+        VISION_BUDGET.forget_session(session_id)
         return jsonify({"success": True, "message": "Session cleared"})
     
     return jsonify({"error": "Session not found"}), 404
 
+@app.route('/retry-failed/<session_id>', methods=['POST'])
+def retry_failed(session_id):
+    """Re-run only the images in a session's dead-letter list"""
+    session_data = load_progress(session_id)
+    
+    if not session_data:
+        return jsonify({"error": "Session not found"}), 404
+    
+    if JOB_ENGINE.is_active(session_id):
+        return jsonify({"error": "Session is still processing"}), 409
+    
+    entries = session_data.get('dead_letter', [])
+    if not entries:
+        return jsonify({"error": "No failed images to retry"}), 400
+    
+    # Entries stay in the dead-letter list until the job settles each one, so a
+    # job that fails, is cancelled or runs out of budget loses none of them
+    entries = [dict(entry, attempts=0) for entry in entries]
+    JOB_ENGINE.submit(
+        session_id, process_album_job,
+        args=(session_id, session_data['album_url'], session_data.get('threshold', 20), 0, entries),
+        delay=quota_delay()
+    )
+    
+    return jsonify({
+        "success": True,
+        "message": f"Retrying {len(entries)} failed images",
+        "sessionId": session_id,
+        "isProcessing": True
+    }), 202
+
 @app.route('/test-credentials')
 def test_credentials():
     """Test if credentials are working properly"""
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
     results = {
         "smugmug": {"status": "not_tested", "details": "Not tested yet"},
         "vision": {"status": "not_tested", "details": "Not tested yet"}
@@ -1026,7 +1681,8 @@ def test_credentials():
                 
                 response = smugmug.get(
                     'https://api.smugmug.com/api/v2!authuser',
-                    headers={'Accept': 'application/json'}
+                    headers={'Accept': 'application/json'},
+                    timeout=deadline.timeout(SMUGMUG_TIMEOUT)
                 )
                 
                 if response.status_code == 200:
@@ -1074,7 +1730,10 @@ def test_credentials():
                     # Test with a simple operation
                     test_image = vision.Image()
                     test_image.source.image_uri = "https://storage.googleapis.com/cloud-samples-data/vision/face/faces.jpeg"
-                    test_response = vision_client.label_detection(image=test_image)
+                    VISION_BUDGET.charge(None, 'label_detection')
+                    test_response = vision_client.label_detection(
+                        image=test_image, timeout=deadline.timeout(VISION_TIMEOUT)
+                    )
                     
                     if len(test_response.label_annotations) > 0:
                         results["vision"] = {
@@ -1114,6 +1773,20 @@ def test_credentials():
     
     return jsonify(results)
 
+@app.route('/budget')
+def vision_budget():
+    """
+    Show today's Vision usage and remaining budget
+    
+    Pass ?session_id= to include that session's usage and remaining job budget.
+    """
+    result = VISION_BUDGET.stats()
+    session_id = request.args.get('session_id')
+    if session_id:
+        result['session'] = VISION_BUDGET.session_usage(session_id)
+        result['session']['remaining'] = VISION_BUDGET.remaining(session_id)[budget.JOB]
+    return jsonify(result)
+
 @app.route('/diagnostic')
 def diagnostic():
     """Render diagnostic page"""
@@ -1124,14 +1797,21 @@ def status():
     """Show processing status for all sessions"""
     return jsonify({
         "active_sessions": len(PROCESS_STATE),
-        "background_tasks": len(BACKGROUND_TASKS),
+        "jobs": JOB_ENGINE.stats(),
+        "singleFlight": {"vision": VISION_FLIGHT.stats(), "write": WRITE_FLIGHT.stats()},
+        "visionHedging": VISION_HEDGER.stats(),
+        "visionCascade": VISION_CASCADE.stats(),
+        "gazetteer": GAZETTEER.stats(),
+        "visionBudget": VISION_BUDGET.stats(),
+        "circuitBreakers": {breaker.name: breaker.stats() for breaker in (VISION_BREAKER, SMUGMUG_BREAKER)},
+        "pipelines": get_pipeline_stats(),
         "sessions": [
             {
                 "id": session_id,
                 "album": data.get("album_name", "Unknown"),
                 "total": data.get("total_images", 0),
                 "processed": len(data.get("processed_indices", [])),
-                "status": "processing" if session_id in BACKGROUND_TASKS else 
+                "status": "processing" if JOB_ENGINE.is_active(session_id) else 
                          "complete" if data.get("next_index", -1) == -1 else "paused"
             }
             for session_id, data in PROCESS_STATE.items()
@@ -0,0 +1,128 @@
+"""Adaptive batch sizing for SmugMug Tagger."""
+import collections
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# How long one unit of work should take - progress is saved between batches
+BATCH_TARGET_SECONDS = float(os.environ.get('BATCH_TARGET_SECONDS', 60))
+MIN_BATCH_SIZE = int(os.environ.get('MIN_BATCH_SIZE', 1))
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 100))
+# Error rate above which batches shrink instead of grow
+MAX_ERROR_RATE = float(os.environ.get('MAX_ERROR_RATE', 0.2))
+# Fraction of the remaining deadline a batch may use
+DEADLINE_SAFETY = 0.7
+
+
+class LatencyWindow:
+    """Rolling window of recent latency samples"""
+
+    def __init__(self, size=50):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def mean(self):
+        return sum(self.samples) / len(self.samples) if self.samples else None
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class AdaptiveBatchController:
+    """
+    Picks how many images to process in the next batch.
+
+    The size that fits the time budget is estimated from rolling Vision
+    and SmugMug latencies and the pipeline's parallelism. Batches grow by
+    at most double while calls succeed and are halved when the error rate
+    climbs, so a slow patch shrinks the work before it runs into a timeout.
+    """
+
+    def __init__(self, vision_workers=1, write_workers=1, initial_size=2,
+                 min_size=MIN_BATCH_SIZE, max_size=MAX_BATCH_SIZE, window=50):
+        self.vision_workers = max(1, vision_workers)
+        self.write_workers = max(1, write_workers)
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = max(self.min_size, min(initial_size, self.max_size))
+        self.vision = LatencyWindow(window)
+        self.smugmug = LatencyWindow(window)
+        self.outcomes = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_vision(self, seconds):
+        with self._lock:
+            self.vision.add(seconds)
+
+    def record_smugmug(self, seconds):
+        with self._lock:
+            self.smugmug.add(seconds)
+
+    def record_result(self, ok):
+        with self._lock:
+            self.outcomes.append(bool(ok))
+
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def seconds_per_image(self):
+        """Estimated wall time per image given the pipeline's parallelism, or None"""
+        with self._lock:
+            vision_mean = self.vision.mean()
+            smugmug_mean = self.smugmug.mean()
+        if vision_mean is None and smugmug_mean is None:
+            return None
+        # The stages overlap, so the slowest one sets the pace
+        return max(
+            (vision_mean or 0) / self.vision_workers,
+            (smugmug_mean or 0) / self.write_workers
+        ) or None
+
+    def next_batch_size(self, remaining=None):
+        """
+        Return the number of images for the next batch
+
+        Args:
+            remaining: Seconds left before the job's deadline, if it has one
+        """
+        budget = BATCH_TARGET_SECONDS
+        if remaining is not None:
+            budget = min(budget, remaining * DEADLINE_SAFETY)
+
+        per_image = self.seconds_per_image()
+        fits = int(budget / per_image) if per_image else self.size
+
+        if self.error_rate() > MAX_ERROR_RATE:
+            size = self.size // 2
+        else:
+            size = min(self.size * 2, fits)
+        # Never plan more than fits in the budget, even after a shrink
+        size = min(size, fits)
+
+        self.size = max(self.min_size, min(size, self.max_size))
+        logger.debug(
+            f"Next batch size {self.size} (per image {per_image or 0:.2f}s, "
+            f"budget {budget:.0f}s, error rate {self.error_rate():.0%})"
+        )
+        return self.size
+
+    def stats(self):
+        per_image = self.seconds_per_image()
+        with self._lock:
+            return {
+                'batchSize': self.size,
+                'visionMean': round(self.vision.mean() or 0, 3),
+                'visionP95': round(self.vision.percentile(95) or 0, 3),
+                'smugmugMean': round(self.smugmug.mean() or 0, 3),
+                'secondsPerImage': round(per_image or 0, 3)
+            }
@@ -0,0 +1,247 @@
+"""Vision API quota and cost accounting for SmugMug Tagger.
+
+Every Vision feature call is charged against a daily quota and the
+session's own budget before it is made. Usage is appended to a per-day
+JSON-lines file that every worker process reads, so the daily count
+holds across gunicorn workers and restarts. Each session's usage is
+also appended to a file of its own that never rolls over, so the
+per-job cap holds for a job paused across quota days.
+"""
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where the per-day usage files live
+BUDGET_DIR = os.environ.get(
+    'BUDGET_DIR', os.path.join(tempfile.gettempdir(), 'smugmug_tagger_budget')
+)
+
+# Units per day across all jobs, and per job (session); 0 means no cap
+VISION_DAILY_UNITS = int(os.environ.get('VISION_DAILY_UNITS', 0))
+VISION_JOB_UNITS = int(os.environ.get('VISION_JOB_UNITS', 0))
+# Hour of day (UTC) at which the daily quota resets - midnight Pacific by default
+VISION_QUOTA_RESET_HOUR = int(os.environ.get('VISION_QUOTA_RESET_HOUR', 8))
+
+# Dollars per 1000 units of each feature, from the Vision price list
+FEATURE_COSTS = {
+    'label_detection': 1.50,
+    'landmark_detection': 1.50,
+    'face_detection': 1.50,
+    'text_detection': 1.50,
+    'image_properties': 1.50,
+    'object_localization': 2.25,
+    'web_detection': 3.50
+}
+FEATURE_COSTS.update(json.loads(os.environ.get('VISION_FEATURE_COSTS', '{}')))
+
+DAILY = 'daily'
+JOB = 'job'
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of making a Vision call that would go over a cap"""
+
+    def __init__(self, scope, retry_after=None):
+        if scope == DAILY:
+            message = f"Daily Vision quota used up - resets in {retry_after:.0f}s"
+        else:
+            message = "Vision budget for this job used up"
+        super().__init__(message)
+        self.scope = scope
+        # Seconds until the quota resets; None for the per-job cap
+        self.retry_after = retry_after
+
+
+class VisionBudget:
+    """
+    Per-feature, per-session and per-day Vision usage with caps.
+
+    Args:
+        daily_limit: Units allowed per quota day, or 0 for no cap
+        job_limit: Units allowed per session, or 0 for no cap
+        reset_hour: UTC hour at which the quota day starts
+        directory: Where the per-day usage files are kept
+    """
+
+    def __init__(self, daily_limit=VISION_DAILY_UNITS, job_limit=VISION_JOB_UNITS,
+                 reset_hour=VISION_QUOTA_RESET_HOUR, directory=BUDGET_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.daily_limit = daily_limit
+        self.job_limit = job_limit
+        self.reset_hour = reset_hour
+        self.directory = directory
+        self.day = None
+        # Session ID -> [bytes read, units per feature] of its cumulative usage file
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _quota_day(self, now=None):
+        now = now or datetime.datetime.utcnow()
+        return (now - datetime.timedelta(hours=self.reset_hour)).date()
+
+    def seconds_until_reset(self):
+        """Seconds until the next quota day starts"""
+        now = datetime.datetime.utcnow()
+        next_reset = datetime.datetime.combine(
+            self._quota_day(now) + datetime.timedelta(days=1), datetime.time()
+        ) + datetime.timedelta(hours=self.reset_hour)
+        return max(0.0, (next_reset - now).total_seconds())
+
+    def _sync(self):
+        # Start a fresh count when the quota day rolls over
+        day = self._quota_day().isoformat()
+        if day != self.day:
+            self.day = day
+            self.path = os.path.join(self.directory, f"{day}.jsonl")
+            self._offset = 0
+            self.total = 0
+            self.features = {}
+            self.sessions = {}
+        if not os.path.exists(self.path):
+            return
+        # Read whatever this and other processes have appended since last time
+        with open(self.path, encoding='utf-8') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # Another process is mid-write
+                self._offset += len(line.encode('utf-8'))
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                units = record.get('u', 1)
+                self.total += units
+                self.features[record['f']] = self.features.get(record['f'], 0) + units
+                session = self.sessions.setdefault(record.get('s'), {})
+                session[record['f']] = session.get(record['f'], 0) + units
+
+    def _job_path(self, session_id):
+        return os.path.join(self.directory, 'jobs', f"{session_id}.jsonl")
+
+    def _job_features(self, session_id):
+        """A session's units per feature over every quota day. Call with the lock held."""
+        if session_id is None:
+            return {}
+        job = self._jobs.setdefault(session_id, [0, {}])
+        path = self._job_path(session_id)
+        if not os.path.exists(path):
+            return job[1]
+        with open(path, encoding='utf-8') as f:
+            f.seek(job[0])
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # Another process is mid-write
+                job[0] += len(line.encode('utf-8'))
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                job[1][record['f']] = job[1].get(record['f'], 0) + record.get('u', 1)
+        return job[1]
+
+    def _check(self, session_id, units):
+        if self.daily_limit and self.total + units > self.daily_limit:
+            raise BudgetExceeded(DAILY, self.seconds_until_reset())
+        if self.job_limit and sum(self._job_features(session_id).values()) + units > self.job_limit:
+            raise BudgetExceeded(JOB)
+
+    def check(self, session_id=None, units=1):
+        """
+        Raise BudgetExceeded if the session could not make another call
+
+        Args:
+            session_id: Session to check the per-job cap for
+            units: Units the next call would use
+        """
+        with self._lock:
+            self._sync()
+            self._check(session_id, units)
+
+    def charge(self, session_id, feature, units=1):
+        """
+        Record one feature call, raising BudgetExceeded instead if it goes over a cap
+
+        Args:
+            session_id: Session making the call, or None for ad-hoc calls
+            feature: Vision feature name, e.g. 'web_detection'
+            units: Units the call uses
+        """
+        with self._lock:
+            self._sync()
+            self._check(session_id, units)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'s': session_id, 'f': feature, 'u': units}) + '\n')
+            if session_id is not None:
+                os.makedirs(os.path.dirname(self._job_path(session_id)), exist_ok=True)
+                with open(self._job_path(session_id), 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'f': feature, 'u': units}) + '\n')
+            self._sync()
+
+    def cost(self, features):
+        """Dollar cost of a feature -> units mapping"""
+        return round(sum(
+            units * FEATURE_COSTS.get(feature, 0) / 1000 for feature, units in features.items()
+        ), 4)
+
+    def remaining(self, session_id=None):
+        """
+        Return the units left today and, if session_id is given, for that job
+
+        Returns:
+            Dict with 'daily' and 'job' entries, each None where there is no cap
+        """
+        with self._lock:
+            self._sync()
+            job_used = sum(self._job_features(session_id).values())
+            return {
+                DAILY: max(0, self.daily_limit - self.total) if self.daily_limit else None,
+                JOB: max(0, self.job_limit - job_used) if self.job_limit and session_id else None
+            }
+
+    def session_usage(self, session_id):
+        """Return a session's units per feature, total and cost, over every quota day"""
+        with self._lock:
+            features = dict(self._job_features(session_id))
+        return {
+            'features': features,
+            'units': sum(features.values()),
+            'cost': self.cost(features)
+        }
+
+    def forget_session(self, session_id):
+        """Delete a session's cumulative usage, e.g. when the session is cleared"""
+        with self._lock:
+            self._jobs.pop(session_id, None)
+            path = self._job_path(session_id)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def stats(self):
+        """Return today's usage, caps and time to reset"""
+        with self._lock:
+            self._sync()
+            features = dict(self.features)
+            total = self.total
+            sessions = len(self.sessions)
+            day = self.day
+        return {
+            'day': day,
+            'units': total,
+            'cost': self.cost(features),
+            'features': features,
+            'sessions': sessions,
+            'dailyLimit': self.daily_limit or None,
+            'jobLimit': self.job_limit or None,
+            'dailyRemaining': max(0, self.daily_limit - total) if self.daily_limit else None,
+            'resetsIn': round(self.seconds_until_reset())
+        }
+
+
+VISION_BUDGET = VisionBudget()
@@ -0,0 +1,196 @@
+"""Capture-time burst grouping for SmugMug Tagger.
+
+Images shot within a few seconds of each other at the same spot are
+almost always the same scene. The album listing's DateTimeOriginal,
+Latitude and Longitude split it into sequences; only a sample of each
+sequence goes to Vision and the rest inherit the sample's tags.
+"""
+import datetime
+import logging
+import math
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Largest gap between consecutive shots in one burst, in seconds
+BURST_MAX_GAP = float(os.environ.get('BURST_MAX_GAP', 5))
+# Largest distance between consecutive shots in one burst, in metres
+BURST_MAX_DISTANCE = float(os.environ.get('BURST_MAX_DISTANCE', 50))
+# Images analysed per burst; the rest inherit their tags (0 disables grouping)
+BURST_SAMPLES = int(os.environ.get('BURST_SAMPLES', 1))
+
+EARTH_RADIUS_M = 6371000
+
+
+def parse_capture_time(value):
+    """Return a SmugMug DateTimeOriginal as epoch seconds, or None"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def image_coordinates(image):
+    """Return (latitude, longitude) from an album listing entry, or None"""
+    try:
+        lat = float(image.get('Latitude') or 0)
+        lng = float(image.get('Longitude') or 0)
+    except (TypeError, ValueError):
+        return None
+    # SmugMug reports 0, 0 for images without GPS
+    if lat == 0 and lng == 0:
+        return None
+    return lat, lng
+
+
+def distance_m(a, b):
+    """Great-circle distance between two (latitude, longitude) points, in metres"""
+    lat1, lng1 = map(math.radians, a)
+    lat2, lng2 = map(math.radians, b)
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def group_bursts(images, max_gap=BURST_MAX_GAP, max_distance=BURST_MAX_DISTANCE):
+    """
+    Split an album listing into bursts
+
+    Images are ordered by capture time and a new burst starts whenever
+    the gap to the previous shot exceeds max_gap, or both shots have GPS
+    and are more than max_distance apart. Images without a capture time
+    are bursts of their own.
+
+    Returns:
+        List of bursts, each a list of listing indices in capture order
+    """
+    timed = []
+    groups = []
+    for i, image in enumerate(images):
+        captured = parse_capture_time(image.get('DateTimeOriginal'))
+        if captured is None:
+            groups.append([i])
+        else:
+            timed.append((captured, i))
+    timed.sort()
+
+    current = []
+    previous = None
+    for captured, i in timed:
+        position = image_coordinates(images[i])
+        if previous is not None:
+            gap = captured - previous[0]
+            moved = position and previous[1] and distance_m(position, previous[1]) > max_distance
+            if gap > max_gap or moved:
+                groups.append(current)
+                current = []
+        current.append(i)
+        previous = (captured, position)
+    if current:
+        groups.append(current)
+    return groups
+
+
+class _Sample:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BurstShare:
+    """
+    Share Vision results within each burst.
+
+    The first samples images of a burst to reach analysis run it; the
+    others wait for them and inherit the combined tags. Whichever images
+    arrive first become the samples, so batches never wait on an image
+    that isn't being processed yet.
+
+    Args:
+        groups: Bursts as returned by group_bursts
+        samples: Images analysed per burst
+    """
+
+    def __init__(self, groups, samples=BURST_SAMPLES):
+        self.samples = max(1, samples)
+        self.group_of = {}
+        for number, group in enumerate(groups):
+            if len(group) > 1:
+                for i in group:
+                    self.group_of[i] = number
+        self.groups = len(groups)
+        self.grouped_images = len(self.group_of)
+        self.analysed = 0
+        self.inherited = 0
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def do(self, index, func, *args, **kwargs):
+        """
+        Return the (tags, confidence_scores) for the image at index
+
+        func(*args, **kwargs) is called if the image is a sample, or is not
+        in a burst, or every sample of its burst failed.
+        """
+        group = self.group_of.get(index)
+        with self._lock:
+            self.analysed += 1
+            if group is None:
+                leader = None
+            else:
+                samples = self._samples.setdefault(group, [])
+                if len(samples) < self.samples:
+                    leader = _Sample()
+                    samples.append(leader)
+                else:
+                    leader = False
+                    samples = list(samples)
+
+        if leader is None:
+            return func(*args, **kwargs)
+        if leader:
+            try:
+                leader.result = func(*args, **kwargs)
+                return leader.result
+            except Exception as e:
+                leader.error = e
+                raise
+            finally:
+                leader.event.set()
+
+        for sample in samples:
+            sample.event.wait()
+        results = [sample.result for sample in samples if sample.error is None]
+        if not results:
+            return func(*args, **kwargs)
+        with self._lock:
+            self.analysed -= 1
+            self.inherited += 1
+        tags = list(dict.fromkeys(tag for result in results for tag in result[0]))
+        confidence_scores = {}
+        for result in results:
+            confidence_scores.update(result[1])
+        return tags, confidence_scores
+
+    def stats(self, vision_units=None):
+        """
+        Return burst counts and how many images inherited their tags
+
+        Args:
+            vision_units: Vision units the analysed images used, to estimate
+                the calls saved at the same rate per image
+        """
+        with self._lock:
+            calls_saved = None
+            if vision_units is not None and self.analysed:
+                calls_saved = round(self.inherited * vision_units / self.analysed)
+            return {
+                'groups': self.groups,
+                'groupedImages': self.grouped_images,
+                'analysed': self.analysed,
+                'inherited': self.inherited,
+                'visionCallsSaved': calls_saved
+            }
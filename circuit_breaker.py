@@ -0,0 +1,121 @@
+"""Circuit breakers for SmugMug Tagger's external dependencies.
+
+After enough consecutive failures a breaker opens and calls fail fast
+with CircuitOpenError. Once the reset timeout has passed it lets a probe
+call through (half-open): success closes it again, failure re-opens it.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open - retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker.
+
+    Args:
+        name: Dependency name used in errors and stats
+        failure_threshold: Consecutive failures that open the breaker
+        reset_timeout: Seconds to stay open before probing
+        is_failure: Optional predicate deciding whether an exception counts
+            as a dependency failure (rather than, say, a bad request)
+        is_failure_result: Optional predicate deciding whether a returned
+            value, such as an HTTP response, counts as a failure
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60,
+                 is_failure=None, is_failure_result=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda error: True)
+        self.is_failure_result = is_failure_result or (lambda result: False)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """Seconds until the breaker will allow a probe, or 0 if calls are allowed"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.time())
+
+    @property
+    def is_open(self):
+        """True while calls would be rejected without a probe"""
+        return self.retry_after() > 0
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == OPEN:
+                wait = self.opened_at + self.reset_timeout - time.time()
+                if wait > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, wait)
+                self.state = HALF_OPEN
+                logger.info(f"{self.name} circuit half-open, sending a probe")
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def _record(self, failed, probe):
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            if not failed:
+                if self.state != CLOSED:
+                    logger.info(f"{self.name} circuit closed")
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"{self.name} circuit opened after {self.consecutive_failures} failures")
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def call(self, func, *args, **kwargs):
+        """Call func through the breaker"""
+        probe = self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._record(self.is_failure(e), probe)
+            raise
+        self._record(self.is_failure_result(result), probe)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutiveFailures': self.consecutive_failures,
+                'timesOpened': self.times_opened,
+                'rejected': self.rejected
+            }
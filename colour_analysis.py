@@ -0,0 +1,193 @@
+"""Local dominant-colour and sky/foliage analysis for SmugMug Tagger.
+
+Replaces Vision's image_properties. Works on small RGB arrays, and on
+batches of them at once: the pixels of every image in a batch are binned
+and classified together, so each image costs a few vectorized passes
+rather than a remote call and a Python loop over colours.
+"""
+import numpy as np
+
+# Colour levels per channel when binning pixels for dominant colours
+COLOR_LEVELS = 8
+# Top fraction of the frame treated as sky
+SKY_REGION = 1 / 3
+
+# Fraction of the sky region / whole frame needed for each scene tag
+BLUE_SKY_FRACTION = 0.25
+GREY_SKY_FRACTION = 0.4
+FOLIAGE_FRACTION = 0.25
+AUTUMN_FRACTION = 0.15
+# Fraction of the frame in bright or dark colours for a lighting tag
+BRIGHTNESS_FRACTION = 0.5
+
+# Tags added for each scene feature
+SCENE_TAGS = {
+    'blueSky': ['blue sky', 'clear sky'],
+    'greySky': ['grey sky', 'overcast'],
+    'foliage': ['green foliage', 'verdant', 'greenery'],
+    'autumn': ['autumn colors', 'autumn']
+}
+SCENE_THRESHOLDS = {
+    'blueSky': BLUE_SKY_FRACTION,
+    'greySky': GREY_SKY_FRACTION,
+    'foliage': FOLIAGE_FRACTION,
+    'autumn': AUTUMN_FRACTION
+}
+
+
+def _stack(images):
+    """Flatten a list of (h, w, 3) arrays to one pixel array plus each pixel's image index"""
+    sizes = [image.shape[0] * image.shape[1] for image in images]
+    pixels = np.concatenate([image.reshape(-1, 3) for image in images])
+    owner = np.repeat(np.arange(len(images)), sizes)
+    return pixels, owner, np.array(sizes)
+
+
+def _hsv(pixels):
+    """Vectorized RGB (uint8) to hue in degrees, saturation and value (0-1)"""
+    rgb = pixels.astype(np.float32) / 255
+    high = rgb.max(axis=1)
+    low = rgb.min(axis=1)
+    spread = high - low
+    saturation = np.where(high > 0, spread / np.maximum(high, 1e-6), 0)
+    safe = np.maximum(spread, 1e-6)
+    red, green, blue = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    hue = np.select(
+        [spread == 0, high == red, high == green],
+        [0, ((green - blue) / safe) % 6, (blue - red) / safe + 2],
+        (red - green) / safe + 4
+    ) * 60
+    return hue, saturation, high
+
+
+def dominant_colors_batch(images, count=5):
+    """
+    Return the most common colours of each image
+
+    Args:
+        images: List of uint8 arrays of shape (height, width, 3), any sizes
+        count: Colours to return per image
+
+    Returns:
+        One list per image of dicts with red, green and blue (mean of the
+        bin's pixels, 0-255) and pixel_fraction, most common first
+    """
+    if not images:
+        return []
+    pixels, owner, sizes = _stack(images)
+    bins_per_image = COLOR_LEVELS ** 3
+    quantized = (pixels // (256 // COLOR_LEVELS)).astype(np.int64)
+    bins = owner * bins_per_image + (quantized[:, 0] * COLOR_LEVELS + quantized[:, 1]) * COLOR_LEVELS + quantized[:, 2]
+    total = len(images) * bins_per_image
+    counts = np.bincount(bins, minlength=total).reshape(len(images), bins_per_image)
+    sums = np.stack([
+        np.bincount(bins, weights=pixels[:, channel], minlength=total).reshape(len(images), bins_per_image)
+        for channel in range(3)
+    ], axis=-1)
+    top = np.argsort(-counts, axis=1, kind='stable')[:, :count]
+    top_counts = np.take_along_axis(counts, top, axis=1)
+    top_means = np.take_along_axis(sums, top[..., None], axis=1) / np.maximum(top_counts, 1)[..., None]
+    fractions = top_counts / sizes[:, None]
+
+    results = []
+    for image_counts, means, image_fractions in zip(top_counts, top_means, fractions):
+        results.append([
+            {
+                'red': int(mean[0]),
+                'green': int(mean[1]),
+                'blue': int(mean[2]),
+                'pixel_fraction': float(fraction)
+            }
+            for n, mean, fraction in zip(image_counts, means, image_fractions) if n
+        ])
+    return results
+
+
+def scene_fractions_batch(images):
+    """
+    Measure sky, foliage and autumn colour coverage for each image
+
+    Blue and grey sky are measured over the top of the frame; foliage and
+    autumn colours over the whole frame.
+
+    Returns:
+        One dict per image with blueSky, greySky, foliage and autumn fractions
+    """
+    if not images:
+        return []
+    pixels, owner, sizes = _stack(images)
+    hue, saturation, value = _hsv(pixels)
+    # Row-in-frame test for every pixel, built per image since heights differ
+    in_sky = np.concatenate([
+        np.repeat(np.arange(image.shape[0]) < image.shape[0] * SKY_REGION, image.shape[1])
+        for image in images
+    ])
+    sky_sizes = np.bincount(owner, weights=in_sky, minlength=len(images))
+
+    masks = {
+        'blueSky': in_sky & (hue >= 190) & (hue <= 250) & (saturation > 0.2) & (value > 0.45),
+        'greySky': in_sky & (saturation < 0.12) & (value > 0.5) & (value < 0.9),
+        'foliage': (hue >= 70) & (hue <= 170) & (saturation > 0.25) & (value > 0.2),
+        'autumn': (hue >= 10) & (hue <= 50) & (saturation > 0.5) & (value > 0.3)
+    }
+    fractions = {}
+    for name, mask in masks.items():
+        hits = np.bincount(owner, weights=mask, minlength=len(images))
+        region = sky_sizes if name in ('blueSky', 'greySky') else sizes
+        fractions[name] = hits / np.maximum(region, 1)
+    return [
+        {name: round(float(values[i]), 3) for name, values in fractions.items()}
+        for i in range(len(images))
+    ]
+
+
+def color_tags(colors, fractions=None):
+    """
+    Derive lighting and scene tags from an image's dominant colours and scene fractions
+
+    Returns:
+        Tuple of (tags, confidence_scores)
+    """
+    tags = set()
+    confidence_scores = {}
+    # Share of the frame covered by bright and by dark dominant colours
+    bright = sum(c['pixel_fraction'] for c in colors if c['red'] + c['green'] + c['blue'] > 600)
+    dark = sum(c['pixel_fraction'] for c in colors if c['red'] + c['green'] + c['blue'] < 300)
+    if bright >= BRIGHTNESS_FRACTION:
+        tags.update(['bright', 'well lit'])
+    elif dark >= BRIGHTNESS_FRACTION:
+        tags.update(['dark', 'low light'])
+
+    for name, fraction in (fractions or {}).items():
+        if fraction >= SCENE_THRESHOLDS[name]:
+            tags.update(SCENE_TAGS[name])
+            confidence_scores[SCENE_TAGS[name][0]] = f"{fraction * 100:.1f}%"
+    return tags, confidence_scores
+
+
+def analyze_batch(images, count=5):
+    """
+    Dominant colours, scene fractions and tags for a batch of images
+
+    Args:
+        images: List of uint8 arrays of shape (height, width, 3)
+        count: Dominant colours to return per image
+
+    Returns:
+        One dict per image with colors, fractions, tags and confidence_scores
+    """
+    results = []
+    for colors, fractions in zip(dominant_colors_batch(images, count), scene_fractions_batch(images)):
+        tags, confidence_scores = color_tags(colors, fractions)
+        results.append({
+            'colors': colors,
+            'fractions': fractions,
+            'tags': tags,
+            'confidence_scores': confidence_scores
+        })
+    return results
+
+
+def analyze(pixels, count=5):
+    """Dominant colours, scene fractions and tags for one image"""
+    return analyze_batch([pixels], count)[0]
@@ -0,0 +1,65 @@
+"""Deadline propagation for SmugMug Tagger.
+
+A Deadline is created once per job or web request and passed down to
+every SmugMug and Vision call, which takes its timeout from whatever is
+left of the budget.
+"""
+import os
+import time
+
+# Default per-call caps, in seconds
+SMUGMUG_TIMEOUT = float(os.environ.get('SMUGMUG_TIMEOUT', 30))
+VISION_TIMEOUT = float(os.environ.get('VISION_TIMEOUT', 30))
+# A call is not started with less than this much time left
+MIN_CALL_TIMEOUT = 1.0
+
+
+class DeadlineExpired(Exception):
+    """Raised when there is not enough time left to start another call"""
+
+
+class Deadline:
+    """A point in time after which work should be abandoned"""
+
+    def __init__(self, seconds=None):
+        self.expires_at = time.time() + seconds if seconds else None
+
+    def remaining(self):
+        """Seconds left, or None if there is no deadline"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def check(self):
+        """Raise DeadlineExpired if the deadline has passed"""
+        if self.expired:
+            raise DeadlineExpired("Deadline expired")
+
+    def timeout(self, cap):
+        """
+        Return the timeout for one call: the cap, or the time left if that is shorter
+
+        Raises:
+            DeadlineExpired: If less than MIN_CALL_TIMEOUT is left
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        if remaining < MIN_CALL_TIMEOUT:
+            raise DeadlineExpired(f"Only {remaining:.1f}s left, not starting another call")
+        return min(cap, remaining)
+
+    def child(self, seconds):
+        """Return a deadline that ends after seconds or with this one, whichever is first"""
+        child = Deadline(seconds)
+        if self.expires_at is not None and (child.expires_at is None or self.expires_at < child.expires_at):
+            child.expires_at = self.expires_at
+        return child
+
+
+# A deadline that never expires, for callers that don't set one
+NO_DEADLINE = Deadline()
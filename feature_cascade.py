@@ -0,0 +1,206 @@
+"""Adaptive Vision feature cascade for SmugMug Tagger.
+
+Label detection runs first. Each of the more expensive features then
+runs only if a rule says it is likely to add tags: the labels match its
+trigger list, the image has few tags so far, or the feature has been
+adding tags to most recent images. A small fraction of skipped calls is
+made anyway, so the hit rate of skipped calls - the tags the cascade
+loses - stays measurable.
+"""
+import collections
+import json
+import logging
+import os
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Rules per feature:
+#   when: labels that mean the feature is worth running
+#   unless: labels that mean it isn't, when no "when" label matched
+#   few_tags: run if the image has fewer tags than this so far
+#   min_hit_rate: run if at least this fraction of recent calls added tags
+#       (None to ignore the hit rate)
+DEFAULT_RULES = {
+    'landmark_detection': {
+        'when': [
+            'landscape', 'mountain', 'hill', 'highland', 'loch', 'lake', 'castle', 'building',
+            'architecture', 'monument', 'tower', 'bridge', 'church', 'coast', 'cliff', 'island',
+            'bay', 'glen', 'valley', 'waterfall', 'ruins', 'historic site', 'tourist attraction',
+            'landmark', 'mountain range', 'summit', 'moorland', 'fell', 'city', 'town'
+        ],
+        'unless': [
+            'face', 'portrait', 'selfie', 'close-up', 'macro photography', 'food', 'dish',
+            'cuisine', 'insect', 'flower', 'petal', 'pet', 'dog', 'cat', 'text', 'document'
+        ],
+        'min_hit_rate': 0.4
+    },
+    'web_detection': {
+        'when': [
+            'landscape', 'mountain', 'castle', 'building', 'architecture', 'monument', 'tower',
+            'bridge', 'church', 'island', 'loch', 'lake', 'waterfall', 'ruins', 'historic site',
+            'tourist attraction', 'landmark', 'mountain range', 'summit', 'city', 'town'
+        ],
+        'unless': [
+            'face', 'portrait', 'selfie', 'close-up', 'macro photography', 'food', 'dish',
+            'cuisine', 'insect', 'flower', 'petal', 'pet', 'dog', 'cat'
+        ],
+        'min_hit_rate': 0.4
+    },
+    'face_detection': {
+        'when': [
+            'person', 'people', 'face', 'smile', 'fun', 'crowd', 'team', 'event', 'tourism',
+            'recreation', 'leisure', 'adventure', 'backpacking', 'hiking', 'trekking', 'walking',
+            'climbing', 'kayak', 'canoe', 'paddle', 'cycling', 'gesture', 'happy', 'standing'
+        ],
+        'unless': [],
+        'min_hit_rate': 0.3
+    },
+    'object_localization': {
+        'when': [],
+        'unless': [],
+        'few_tags': 5,
+        'min_hit_rate': None
+    }
+}
+
+# Calls a feature needs before its hit rate is trusted - until then it always runs
+CASCADE_MIN_SAMPLES = int(os.environ.get('VISION_CASCADE_MIN_SAMPLES', 20))
+# Fraction of skipped calls made anyway to measure what skipping loses
+CASCADE_EXPLORE = float(os.environ.get('VISION_CASCADE_EXPLORE', 0.05))
+
+
+def load_rules(value=None):
+    """
+    Return the cascade rules, with overrides merged over DEFAULT_RULES
+
+    Args:
+        value: JSON object, or a path to a JSON file, mapping feature names
+            to rule fields to override
+    """
+    rules = {feature: dict(rule) for feature, rule in DEFAULT_RULES.items()}
+    if not value:
+        return rules
+    if os.path.exists(value):
+        with open(value, encoding='utf-8') as f:
+            overrides = json.load(f)
+    else:
+        overrides = json.loads(value)
+    for feature, rule in overrides.items():
+        rules.setdefault(feature, {}).update(rule)
+    return rules
+
+
+class FeatureCascade:
+    """
+    Decides which Vision features to run on an image and tracks how often each adds tags.
+
+    Args:
+        enabled: If False every feature always runs
+        rules: Rules per feature, as in DEFAULT_RULES
+        min_samples: Calls needed before a feature's hit rate is used
+        explore: Fraction of skipped calls that are made anyway
+        window: Number of recent calls the hit rate is taken over
+    """
+
+    def __init__(self, enabled=True, rules=None, min_samples=CASCADE_MIN_SAMPLES,
+                 explore=CASCADE_EXPLORE, window=200):
+        self.enabled = enabled
+        self.rules = rules if rules is not None else load_rules()
+        self.min_samples = min_samples
+        self.explore = explore
+        self.window = window
+        self._hits = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        # Rules are matched against label sets, so keep the lists as sets
+        self._when = {feature: set(rule.get('when', [])) for feature, rule in self.rules.items()}
+        self._unless = {feature: set(rule.get('unless', [])) for feature, rule in self.rules.items()}
+
+    def _count(self, feature, key, amount=1):
+        counts = self._counts.setdefault(feature, collections.Counter())
+        counts[key] += amount
+
+    def hit_rate(self, feature):
+        """Fraction of recent calls of the feature that added tags, or None if too few"""
+        with self._lock:
+            hits = self._hits.get(feature)
+            if not hits or len(hits) < self.min_samples:
+                return None
+            return sum(hits) / len(hits)
+
+    def decide(self, feature, labels, tag_count):
+        """
+        Decide whether to run a feature
+
+        Args:
+            feature: Vision feature name
+            labels: Set of lower-case labels from label detection, or None
+                if label detection failed
+            tag_count: Number of tags found for the image so far
+
+        Returns:
+            Tuple of (run, reason)
+        """
+        rule = self.rules.get(feature)
+        if not self.enabled or rule is None:
+            run, reason = True, 'no rule'
+        elif labels is None:
+            run, reason = True, 'no labels'
+        elif labels & self._when[feature]:
+            run, reason = True, 'labels'
+        elif labels & self._unless[feature]:
+            run, reason = False, 'unless labels'
+        elif tag_count < rule.get('few_tags', 0):
+            run, reason = True, 'few tags'
+        elif rule.get('min_hit_rate') is None:
+            run, reason = False, 'no signal'
+        else:
+            rate = self.hit_rate(feature)
+            if rate is None:
+                run, reason = True, 'warm-up'
+            elif rate >= rule['min_hit_rate']:
+                run, reason = True, 'hit rate'
+            else:
+                run, reason = False, 'no signal'
+        if not run and random.random() < self.explore:
+            run, reason = True, 'explore'
+        with self._lock:
+            self._count(feature, reason if run else 'skipped')
+        return run, reason
+
+    def record(self, feature, new_tags, reason):
+        """
+        Record how many tags a feature call added
+
+        Args:
+            feature: Vision feature name
+            new_tags: Number of tags the call added that weren't already found
+            reason: The reason decide() gave for running it
+        """
+        hit = new_tags > 0
+        with self._lock:
+            self._hits.setdefault(feature, collections.deque(maxlen=self.window)).append(hit)
+            self._count(feature, 'hits' if hit else 'misses')
+            if reason == 'explore':
+                # Explored calls would have been skipped, so these are what skipping loses
+                self._count(feature, 'exploreHits' if hit else 'exploreMisses')
+
+    def stats(self):
+        """Return per-feature decisions, hit rates and the hit rate of skipped calls"""
+        result = {'enabled': self.enabled, 'features': {}}
+        for feature in self.rules:
+            rate = self.hit_rate(feature)
+            with self._lock:
+                counts = dict(self._counts.get(feature, {}))
+            explored = counts.get('exploreHits', 0) + counts.get('exploreMisses', 0)
+            runs = counts.get('hits', 0) + counts.get('misses', 0)
+            result['features'][feature] = {
+                'decisions': counts,
+                'runs': runs,
+                'skipped': counts.get('skipped', 0),
+                'hitRate': round(rate, 3) if rate is not None else None,
+                'skippedHitRate': round(counts.get('exploreHits', 0) / explored, 3) if explored else None
+            }
+        return result
@@ -0,0 +1,208 @@
+"""Offline reverse geocoding for SmugMug Tagger.
+
+Names the glens, lochs, munros and villages near an image's GPS position
+from a local gazetteer, rather than relying on landmark detection for
+place names. Places are held in a k-d tree over unit vectors on the
+sphere, so a lookup costs tens of microseconds however large the
+gazetteer. A gazetteer is a CSV file (name, kind, latitude, longitude)
+or a GeoNames country dump such as GB.txt.
+"""
+import csv
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from bursts import EARTH_RADIUS_M
+from kdtree import KDTree
+
+logger = logging.getLogger(__name__)
+
+# Gazetteer file loaded at startup
+GAZETTEER_PATH = os.environ.get(
+    'GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv')
+)
+# Skip landmark and web detection when the gazetteer names the spot
+GAZETTEER_SKIPS_LOCATION = os.environ.get('GAZETTEER_SKIPS_LOCATION', 'true').lower() in ('1', 'true', 'yes')
+
+# Distance in metres within which a place of each kind names a position
+PLACE_RADIUS_M = {
+    'castle': 500,
+    'munro': 1500,
+    'mountain': 1500,
+    'village': 1500,
+    'island': 2000,
+    'loch': 2500,
+    'glen': 3000,
+    'town': 3000,
+    'city': 8000
+}
+DEFAULT_RADIUS_M = 1000
+# Kinds covering too wide an area to say what the image shows
+AREA_KINDS = frozenset(['town', 'city'])
+
+# GeoNames feature codes kept from a country dump, and their kinds
+GEONAMES_KINDS = {
+    'MT': 'mountain', 'PK': 'mountain', 'HLL': 'mountain',
+    'LK': 'loch', 'LKS': 'loch', 'RSV': 'loch',
+    'VAL': 'glen',
+    'ISL': 'island',
+    'CSTL': 'castle',
+    'PPL': 'village', 'PPLA3': 'village', 'PPLA4': 'village',
+    'PPLA2': 'town',
+    'PPLA': 'city', 'PPLC': 'city'
+}
+# Population above which a GeoNames populated place counts as a town or city
+TOWN_POPULATION = 5000
+CITY_POPULATION = 100000
+
+
+def _unit_vectors(lat, lng):
+    """Points on the unit sphere, so straight-line distance orders like great-circle distance"""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lng = np.radians(np.asarray(lng, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)])
+
+
+def _chord(metres):
+    """Straight-line distance through the unit sphere for a great-circle distance"""
+    return 2 * math.sin(min(math.pi, metres / EARTH_RADIUS_M) / 2)
+
+
+def _metres(chord):
+    """Great-circle distance for a straight-line distance through the unit sphere"""
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, chord / 2))
+
+
+def _geonames_kind(code, population):
+    kind = GEONAMES_KINDS.get(code)
+    if kind == 'village' or kind == 'town':
+        if population >= CITY_POPULATION:
+            return 'city'
+        if population >= TOWN_POPULATION:
+            return 'town'
+    return kind
+
+
+def read_places(path):
+    """
+    Read a gazetteer file
+
+    Args:
+        path: CSV file with name, kind, latitude and longitude columns, or a
+            tab-separated GeoNames dump (.txt)
+
+    Returns:
+        List of place dicts with name, kind, latitude and longitude
+    """
+    places = []
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.txt'):
+            for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                if len(row) < 15:
+                    continue
+                kind = _geonames_kind(row[7], int(row[14] or 0))
+                if kind:
+                    places.append({
+                        'name': row[1], 'kind': kind,
+                        'latitude': float(row[4]), 'longitude': float(row[5])
+                    })
+        else:
+            for row in csv.DictReader(f):
+                try:
+                    places.append({
+                        'name': row['name'].strip(), 'kind': row['kind'].strip().lower(),
+                        'latitude': float(row['latitude']), 'longitude': float(row['longitude'])
+                    })
+                except (KeyError, TypeError, ValueError):
+                    logger.debug(f"Skipping malformed gazetteer row: {row}")
+    return places
+
+
+class Gazetteer:
+    """
+    Nearest named places for a position.
+
+    Args:
+        places: Place dicts with name, kind, latitude and longitude
+        radii: Dict of kind to the distance in metres within which a place names a position
+    """
+
+    def __init__(self, places=(), radii=PLACE_RADIUS_M):
+        self.places = list(places)
+        self.radii = radii
+        self._tree = None
+        if self.places:
+            self._tree = KDTree(_unit_vectors(
+                [place['latitude'] for place in self.places],
+                [place['longitude'] for place in self.places]
+            ))
+        self._search = _chord(max(list(radii.values()) + [DEFAULT_RADIUS_M]))
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matched = 0
+        self.lookup_time = 0.0
+
+    def lookup(self, lat, lng):
+        """
+        Return the places naming a position - the nearest place of each kind
+        within that kind's radius - nearest first
+
+        Returns:
+            List of dicts with name, kind and distance (metres)
+        """
+        if self._tree is None:
+            return []
+        started = time.perf_counter()
+        found = []
+        kinds = set()
+        for n, chord in self._tree.within(_unit_vectors([lat], [lng])[0], self._search):
+            place = self.places[n]
+            distance = _metres(chord)
+            if place['kind'] in kinds or distance > self.radii.get(place['kind'], DEFAULT_RADIUS_M):
+                continue
+            kinds.add(place['kind'])
+            found.append({'name': place['name'], 'kind': place['kind'], 'distance': round(distance)})
+        with self._lock:
+            self.lookups += 1
+            self.matched += bool(found)
+            self.lookup_time += time.perf_counter() - started
+        return found
+
+    def place_tags(self, lat, lng):
+        """Return the names of the places naming a position, as tags"""
+        return [place['name'].lower() for place in self.lookup(lat, lng)]
+
+    def names_spot(self, places):
+        """True if the places pin down what an image shows - a glen, loch, summit or village, not just a town"""
+        return any(place['kind'] not in AREA_KINDS for place in places)
+
+    def stats(self):
+        """Return the gazetteer size and lookup counts"""
+        with self._lock:
+            return {
+                'places': len(self.places),
+                'lookups': self.lookups,
+                'matched': self.matched,
+                'meanLookupMicros': round(self.lookup_time / self.lookups * 1e6, 1) if self.lookups else None
+            }
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Load a Gazetteer from a file, or an empty one if it can't be read"""
+    if not path or not os.path.exists(path):
+        logger.warning(f"No gazetteer at {path}, place names come from landmark detection only")
+        return Gazetteer()
+    try:
+        places = read_places(path)
+    except (OSError, UnicodeDecodeError, csv.Error, ValueError) as e:
+        logger.warning(f"Could not read gazetteer {path}: {str(e)}")
+        return Gazetteer()
+    logger.info(f"Loaded {len(places)} places from {path}")
+    return Gazetteer(places)
+
+
+GAZETTEER = load_gazetteer()
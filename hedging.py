@@ -0,0 +1,112 @@
+"""Request hedging for SmugMug Tagger.
+
+If a call hasn't returned by a high percentile of recent latency for the
+same kind of call, a duplicate is sent and whichever finishes first wins.
+Hedges are capped as a fraction of all calls so they can't eat the quota.
+"""
+import concurrent.futures
+import logging
+import threading
+import time
+
+from batch_controller import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+
+class Hedger:
+    """Sends a backup request for calls that run past the latency percentile"""
+
+    def __init__(self, name, enabled=True, percentile=95, max_fraction=0.05,
+                 min_samples=20, max_workers=16, window=200):
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.min_samples = min_samples
+        self.window = window
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"hedge-{name}"
+        )
+
+    def _record(self, key, seconds):
+        with self._lock:
+            if key not in self._latencies:
+                self._latencies[key] = LatencyWindow(self.window)
+            self._latencies[key].add(seconds)
+
+    def hedge_delay(self, key):
+        """Seconds to wait before hedging a call of this kind, or None if too few samples"""
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if not latencies or len(latencies.samples) < self.min_samples:
+                return None
+            return latencies.percentile(self.percentile)
+
+    def _take_hedge_budget(self):
+        with self._lock:
+            if self.hedges + 1 > self.calls * self.max_fraction:
+                return False
+            self.hedges += 1
+            return True
+
+    def _submit(self, key, func, args, kwargs):
+        started = time.time()
+
+        def timed():
+            result = func(*args, **kwargs)
+            self._record(key, time.time() - started)
+            return result
+
+        return self._executor.submit(timed)
+
+    def call(self, key, func, *args, **kwargs):
+        """Call func(*args, **kwargs), hedging it if it is slow; key groups similar calls"""
+        with self._lock:
+            self.calls += 1
+
+        delay = self.hedge_delay(key) if self.enabled else None
+        if delay is None:
+            started = time.time()
+            result = func(*args, **kwargs)
+            self._record(key, time.time() - started)
+            return result
+
+        primary = self._submit(key, func, args, kwargs)
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        if done or not self._take_hedge_budget():
+            return primary.result()
+
+        logger.debug(f"Hedging {self.name} {key} call after {delay:.2f}s")
+        hedge = self._submit(key, func, args, kwargs)
+        pending = {primary, hedge}
+        while True:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+            # Both failed - raise the last error
+            if not pending:
+                return done.pop().result()
+
+    def stats(self):
+        """Return call, hedge and latency figures"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'calls': self.calls,
+                'hedges': self.hedges,
+                'hedgeWins': self.hedge_wins,
+                'hedgeDelays': {
+                    key: round(window.percentile(self.percentile) or 0, 3)
+                    for key, window in self._latencies.items()
+                }
+            }
@@ -0,0 +1,166 @@
+"""Background job engine for SmugMug Tagger.
+
+Jobs are queued by ID and run on a small pool of worker threads, so web
+requests only validate input and enqueue work. Jobs can be scheduled to
+start after a delay, which is how paused jobs are re-queued.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SCHEDULED = 'scheduled'
+RUNNING = 'running'
+
+
+class JobEngine:
+    """A delay-aware job queue with a fixed pool of worker threads"""
+
+    def __init__(self, workers=2):
+        self.workers = max(1, int(workers))
+        self.jobs = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self.completed = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        # Threads are started lazily so importing the app never spawns them
+        if self._threads:
+            return
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{n}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job_id, func, args=(), delay=0, requeue=False):
+        """
+        Queue a job.
+
+        Args:
+            job_id: Unique job ID - a job that is already queued or running is not queued twice
+            func: Callable run on a worker thread
+            args: Positional arguments for func
+            delay: Seconds to wait before the job may start
+            requeue: Let a running job queue its own continuation, which
+                is scheduled once the current run returns
+
+        Returns:
+            True if the job was queued, False if it was already active
+        """
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job and requeue and job['status'] == RUNNING:
+                job['requeue'] = (delay, func, args)
+                logger.debug(f"Job {job_id} will be re-queued with delay {delay:.0f}s")
+                return True
+            if job:
+                return False
+            self._ensure_started()
+            self._schedule(job_id, func, args, delay)
+        logger.debug(f"Queued job {job_id} (delay {delay:.0f}s)")
+        return True
+
+    def _schedule(self, job_id, func, args, delay):
+        # The heap entry carries the submission's token; entries whose token no
+        # longer matches the job's (cancelled, then submitted again) are stale
+        run_at = time.time() + max(0, delay)
+        token = next(self._sequence)
+        self.jobs[job_id] = {
+            'status': SCHEDULED if delay > 0 else QUEUED,
+            'runAt': run_at,
+            'submitted': time.time(),
+            'token': token
+        }
+        heapq.heappush(self._heap, (run_at, token, job_id, func, args))
+        self._condition.notify()
+
+    def _stale(self, entry):
+        job = self.jobs.get(entry[2])
+        return job is None or job['token'] != entry[1]
+
+    def cancel(self, job_id):
+        """Forget a job that has not started yet; running jobs must check is_active"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job and job['status'] != RUNNING:
+                del self.jobs[job_id]
+                return True
+            if job:
+                job['cancelled'] = True
+            return False
+
+    def is_active(self, job_id):
+        """Return True if the job is queued, scheduled or running"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            return bool(job) and not job.get('cancelled')
+
+    def status(self, job_id):
+        """Return the job's status, or None if it is not active"""
+        with self._condition:
+            job = self.jobs.get(job_id)
+            return job['status'] if job else None
+
+    def stats(self):
+        """Return queue and worker counts"""
+        with self._condition:
+            statuses = [job['status'] for job in self.jobs.values()]
+            return {
+                'workers': self.workers,
+                'queued': statuses.count(QUEUED),
+                'scheduled': statuses.count(SCHEDULED),
+                'running': statuses.count(RUNNING),
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                # Drop entries for jobs cancelled or resubmitted while waiting
+                while self._heap and self._stale(self._heap[0]):
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    wait = self._heap[0][0] - time.time()
+                    if wait <= 0:
+                        _, _, job_id, func, args = heapq.heappop(self._heap)
+                        self.jobs[job_id]['status'] = RUNNING
+                        return job_id, func, args
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def _worker(self):
+        while True:
+            job_id, func, args = self._next_job()
+            logger.debug(f"Starting job {job_id}")
+            ok = True
+            try:
+                func(*args)
+            except Exception as e:
+                ok = False
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                logger.error(traceback.format_exc())
+            finally:
+                with self._condition:
+                    job = self.jobs.pop(job_id, None)
+                    if job and job.get('requeue') and not job.get('cancelled'):
+                        delay, func, args = job['requeue']
+                        self._schedule(job_id, func, args, delay)
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+
+JOB_ENGINE = JobEngine(workers=os.environ.get('JOB_WORKERS', 2))
@@ -0,0 +1,115 @@
+"""k-d tree nearest-neighbour search for SmugMug Tagger.
+
+Points are stored in one array, reordered so every subtree is a
+contiguous slice and each node is the median of its slice - no node
+objects, so a tree over a national gazetteer stays compact. Queries walk
+the tree over plain Python tuples, which is faster than NumPy for the
+handful of nodes a single query visits.
+"""
+import math
+
+import numpy as np
+
+# Points in a slice small enough to scan instead of splitting further
+LEAF_SIZE = 8
+
+
+class KDTree:
+    """
+    A static k-d tree over points in k dimensions.
+
+    Args:
+        points: Array-like of shape (n, k)
+    """
+
+    def __init__(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2:
+            points = points.reshape(len(points), -1)
+        order = np.arange(len(points))
+        # Split axis of each node, stored at the node's median position
+        axes = np.zeros(len(points), dtype=np.int64)
+        stack = [(0, len(points))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            members = order[lo:hi]
+            axis = int(np.ptp(points[members], axis=0).argmax())
+            mid = (lo + hi) // 2
+            order[lo:hi] = members[np.argpartition(points[members, axis], mid - lo)]
+            axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+        self.order = order
+        self._points = [tuple(point) for point in points[order].tolist()]
+        self._axes = axes.tolist()
+
+    def __len__(self):
+        return len(self._points)
+
+    def nearest(self, point):
+        """
+        Return (index, distance) of the point nearest to point, or (None, inf) if empty
+
+        index is the position in the array the tree was built from.
+        """
+        point = tuple(point)
+        points, axes = self._points, self._axes
+        dist = math.dist
+        best, best_distance = None, float('inf')
+        # Slices still to search, with a lower bound on their distance
+        stack = [(0, len(points), 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if bound > best_distance:
+                continue
+            if hi - lo <= LEAF_SIZE:
+                for n in range(lo, hi):
+                    distance = dist(points[n], point)
+                    if distance < best_distance:
+                        best, best_distance = n, distance
+                continue
+            mid = (lo + hi) // 2
+            distance = dist(points[mid], point)
+            if distance < best_distance:
+                best, best_distance = mid, distance
+            axis = axes[mid]
+            offset = point[axis] - points[mid][axis]
+            near, far = ((lo, mid), (mid + 1, hi)) if offset < 0 else ((mid + 1, hi), (lo, mid))
+            # Far side first, so the near side is searched next
+            stack.append((far[0], far[1], abs(offset)))
+            stack.append((near[0], near[1], 0.0))
+        if best is None:
+            return None, float('inf')
+        return int(self.order[best]), best_distance
+
+    def within(self, point, radius):
+        """
+        Return [(index, distance)] of every point within radius of point, nearest first
+        """
+        point = tuple(point)
+        points, axes = self._points, self._axes
+        dist = math.dist
+        found = []
+        stack = [(0, len(points))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                for n in range(lo, hi):
+                    distance = dist(points[n], point)
+                    if distance <= radius:
+                        found.append((distance, n))
+                continue
+            mid = (lo + hi) // 2
+            distance = dist(points[mid], point)
+            if distance <= radius:
+                found.append((distance, mid))
+            axis = axes[mid]
+            offset = point[axis] - points[mid][axis]
+            if offset <= radius:
+                stack.append((lo, mid))
+            if offset >= -radius:
+                stack.append((mid + 1, hi))
+        found.sort()
+        return [(int(self.order[n]), distance) for distance, n in found]
@@ -0,0 +1,152 @@
+"""Per-album ImageKey progress ledger for SmugMug Tagger."""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where the per-album ledgers live
+LEDGER_DIR = os.environ.get(
+    'LEDGER_DIR', os.path.join(tempfile.gettempdir(), 'smugmug_tagger_ledger')
+)
+
+TAGGED = 'tagged'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# Outcomes that mean an image needs no more work
+FINISHED_OUTCOMES = (TAGGED, SKIPPED)
+
+_LEDGERS = {}
+_LEDGERS_LOCK = threading.Lock()
+
+
+def keywords_hash(keywords):
+    """Return a stable hash of a keyword list"""
+    return hashlib.md5('\n'.join(sorted(keywords or [])).encode()).hexdigest()
+
+
+class AlbumLedger:
+    """
+    ImageKey -> outcome record for one album.
+
+    The ledger is keyed by album rather than by session, so any session
+    for the album - including one started on a later day with a new
+    session ID - can skip images that are already finished without
+    making a network call. Records are appended to a JSON-lines file and
+    the latest record for each image and threshold wins.
+    
+    Other processes (gunicorn workers) append to the same file, so every
+    lookup first reads any lines added since the last one, from the byte
+    offset where that read stopped.
+    """
+
+    def __init__(self, album_key, directory=LEDGER_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.album_key = album_key
+        self.path = os.path.join(directory, f"{album_key}.jsonl")
+        # (ImageKey, threshold) -> latest record
+        self.entries = {}
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+        with self._lock:
+            lines = self._refresh()
+        # Rewrite the file if superseded records make up most of it
+        if lines > 2 * len(self.entries) + 100:
+            self.compact()
+
+    def _refresh(self):
+        """Apply records appended since the last read; returns the lines read. Call with the lock held."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # Compacted by another process - start again from the top
+            self.entries = {}
+            self._offset = 0
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return 0
+        lines = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A write is still in progress - read it next time
+                    break
+                self._offset += len(line)
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Ignore a partial line left by an interrupted write
+                    continue
+                self.entries[(record['imageKey'], record.get('threshold'))] = record
+        return lines
+
+    def get(self, image_key, threshold=None):
+        """Return the latest record for an image at a threshold, or None"""
+        with self._lock:
+            self._refresh()
+            return self.entries.get((image_key, threshold))
+
+    def is_finished(self, image_key, threshold=None):
+        """Return True if the image was tagged or skipped at this threshold by any earlier session"""
+        record = self.get(image_key, threshold)
+        return bool(record) and record['outcome'] in FINISHED_OUTCOMES
+
+    def record(self, image_key, outcome, keywords=None, reason=None, threshold=None):
+        """Record the outcome for an image at a threshold"""
+        if not image_key:
+            return
+        record = {
+            'imageKey': image_key,
+            'outcome': outcome,
+            'threshold': threshold,
+            'keywordsHash': keywords_hash(keywords) if keywords is not None else None,
+            'updated': datetime.datetime.now().isoformat()
+        }
+        if reason:
+            record['reason'] = reason
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            # Reads back this record along with any other process's
+            self._refresh()
+
+    def counts(self, threshold=None):
+        """Return the number of images with each outcome, at one threshold or all of them"""
+        counts = {TAGGED: 0, FAILED: 0, SKIPPED: 0}
+        with self._lock:
+            self._refresh()
+            records = list(self.entries.items())
+        for (_, record_threshold), record in records:
+            if threshold is None or record_threshold == threshold:
+                counts[record['outcome']] = counts.get(record['outcome'], 0) + 1
+        return counts
+
+    def compact(self):
+        """Rewrite the ledger file with only the latest record for each image and threshold"""
+        with self._lock:
+            self._refresh()
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for record in self.entries.values():
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            os.replace(temp_path, self.path)
+            stat = os.stat(self.path)
+            self._inode, self._offset = stat.st_ino, stat.st_size
+
+
+def get_ledger(album_key):
+    """Return the shared AlbumLedger for an album"""
+    with _LEDGERS_LOCK:
+        if album_key not in _LEDGERS:
+            _LEDGERS[album_key] = AlbumLedger(album_key)
+        return _LEDGERS[album_key]
@@ -0,0 +1,157 @@
+"""Local image analysis for SmugMug Tagger.
+
+Cheap checks on a small decode of the image: edge density (is there
+likely to be text?), skin-tone coverage (are there likely to be faces?)
+and dominant colours (see colour_analysis). They decide whether the
+remote text and face features are worth calling and replace the
+image_properties call.
+"""
+import concurrent.futures
+import io
+import logging
+import os
+
+import numpy as np
+import requests
+from PIL import Image
+
+import colour_analysis
+
+logger = logging.getLogger(__name__)
+
+# Longest side of the decode the checks run on, in pixels
+ANALYSIS_SIZE = int(os.environ.get('LOCAL_ANALYSIS_SIZE', 256))
+# Fraction of strong-edge pixels above which text is worth looking for
+TEXT_EDGE_DENSITY = float(os.environ.get('TEXT_EDGE_DENSITY', 0.08))
+# Fraction of skin-tone pixels above which faces are worth looking for
+FACE_SKIN_FRACTION = float(os.environ.get('FACE_SKIN_FRACTION', 0.02))
+# Brightness step between neighbouring pixels (0-255) that counts as an edge
+EDGE_STRENGTH = 48
+# Images decoded and analysed together by analyze_batch
+BATCH_SIZE = 32
+
+# Luma weights (ITU-R BT.601)
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def load_image(source, size=ANALYSIS_SIZE, timeout=10):
+    """
+    Decode an image to a small RGB array
+
+    Args:
+        source: Image URL, encoded image bytes or a PIL image
+        size: Longest side of the result, in pixels
+        timeout: Download timeout in seconds, for URLs
+
+    Returns:
+        uint8 array of shape (height, width, 3)
+    """
+    if isinstance(source, str):
+        response = requests.get(source, timeout=timeout)
+        response.raise_for_status()
+        source = response.content
+    image = source if isinstance(source, Image.Image) else Image.open(io.BytesIO(source))
+    # Let the JPEG decoder scale down while decoding - much cheaper than a full decode
+    image.draft('RGB', (size, size))
+    image = image.convert('RGB')
+    image.thumbnail((size, size))
+    return np.asarray(image, dtype=np.uint8)
+
+
+def edge_density(pixels):
+    """Fraction of pixels on a strong brightness edge - high for text, signs and fine detail"""
+    gray = pixels.astype(np.float32) @ LUMA
+    horizontal = np.abs(np.diff(gray, axis=1))[:-1, :] > EDGE_STRENGTH
+    vertical = np.abs(np.diff(gray, axis=0))[:, :-1] > EDGE_STRENGTH
+    return float((horizontal | vertical).mean())
+
+
+def skin_fraction(pixels):
+    """Fraction of pixels in the YCbCr skin-tone range"""
+    rgb = pixels.astype(np.float32)
+    red, green, blue = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    luma = rgb @ LUMA
+    cb = 128 - 0.168736 * red - 0.331264 * green + 0.5 * blue
+    cr = 128 + 0.5 * red - 0.418688 * green - 0.081312 * blue
+    skin = (luma > 40) & (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173)
+    return float(skin.mean())
+
+
+def _load(source):
+    if source is None or (isinstance(source, str) and not source):
+        return None
+    try:
+        return load_image(source)
+    except Exception as e:
+        logger.debug(f"Local analysis unavailable: {str(e)}")
+        return None
+
+
+def _results(images):
+    decoded = [pixels for pixels in images if pixels is not None]
+    colours = iter(colour_analysis.analyze_batch(decoded))
+    results = []
+    for pixels in images:
+        if pixels is None:
+            results.append(None)
+            continue
+        colour = next(colours)
+        results.append({
+            'text_likelihood': edge_density(pixels),
+            'face_likelihood': skin_fraction(pixels),
+            'colors': colour['colors'],
+            'fractions': colour['fractions'],
+            'color_tags': colour['tags'],
+            'color_scores': colour['confidence_scores']
+        })
+    return results
+
+
+def analyze(source):
+    """
+    Run every local check on an image
+
+    Args:
+        source: Image URL, encoded image bytes or a PIL image
+
+    Returns:
+        Dict with text_likelihood (edge density), face_likelihood (skin
+        fraction), colors, fractions, color_tags and color_scores, or None
+        if the image could not be decoded
+    """
+    return _results([_load(source)])[0]
+
+
+def analyze_batch(sources, workers=8):
+    """
+    Run every local check on many images
+
+    Images are downloaded in parallel and analysed BATCH_SIZE at a time, so
+    the colour analysis is vectorized across each batch while only one
+    batch of pixels is held in memory.
+
+    Returns:
+        One result per source, as from analyze
+    """
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(sources), BATCH_SIZE):
+            images = list(executor.map(_load, sources[start:start + BATCH_SIZE]))
+            results.extend(_results(images))
+    return results
+
+
+def worth_calling(analysis, feature):
+    """
+    Decide whether a remote Vision feature is worth calling
+
+    Features without a local check, and every feature when the local
+    analysis failed, are always worth calling.
+    """
+    if analysis is None:
+        return True
+    if feature == 'text_detection':
+        return analysis['text_likelihood'] >= TEXT_EDGE_DENSITY
+    if feature == 'face_detection':
+        return analysis['face_likelihood'] >= FACE_SKIN_FRACTION
+    return True
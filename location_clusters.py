@@ -0,0 +1,214 @@
+"""GPS location clustering for SmugMug Tagger.
+
+Landmark and web detection return the same landmark for every photo
+taken at one spot. Images are clustered by GPS position (DBSCAN, with
+the distance work vectorized in NumPy); the location features then run
+on a few images per cluster and their landmark and region tags are
+applied to the rest. Label and face detection still run on every image.
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+
+from bursts import image_coordinates, EARTH_RADIUS_M
+
+logger = logging.getLogger(__name__)
+
+# Images within this many metres of each other are neighbours
+LOCATION_CLUSTER_RADIUS = float(os.environ.get('LOCATION_CLUSTER_RADIUS', 200))
+# Neighbours (including itself) an image needs to seed a cluster
+LOCATION_CLUSTER_MIN_IMAGES = int(os.environ.get('LOCATION_CLUSTER_MIN_IMAGES', 3))
+# Images per cluster that run landmark and web detection (0 disables sharing)
+LOCATION_SAMPLES = int(os.environ.get('LOCATION_SAMPLES', 2))
+# Rows of the distance matrix computed at a time
+CHUNK_SIZE = 512
+
+NOISE = -1
+
+
+def _project(lat, lng):
+    """Equirectangular projection to metres - accurate at cluster scale"""
+    lat0 = np.radians(np.mean(lat))
+    x = EARTH_RADIUS_M * np.radians(lng) * np.cos(lat0)
+    y = EARTH_RADIUS_M * np.radians(lat)
+    return np.column_stack([x, y])
+
+
+def dbscan(lat, lng, radius=LOCATION_CLUSTER_RADIUS, min_images=LOCATION_CLUSTER_MIN_IMAGES):
+    """
+    Cluster points with DBSCAN
+
+    Neighbour counts are taken over the distance matrix CHUNK_SIZE rows at
+    a time, and clusters are grown from core points one vectorized
+    distance row at a time, so memory stays linear in the number of points.
+
+    Args:
+        lat: Array of latitudes in degrees
+        lng: Array of longitudes in degrees
+        radius: Neighbourhood radius in metres
+        min_images: Neighbours (including the point) that make a core point
+
+    Returns:
+        Array of cluster numbers per point, NOISE for points in no cluster
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    labels = np.full(len(lat), NOISE, dtype=np.int64)
+    if not len(lat):
+        return labels
+    points = _project(lat, lng)
+    radius_sq = radius * radius
+
+    def neighbours(rows):
+        diff = points[rows, None, :] - points[None, :, :]
+        return (diff ** 2).sum(axis=-1) <= radius_sq
+
+    counts = np.concatenate([
+        neighbours(slice(start, start + CHUNK_SIZE)).sum(axis=1)
+        for start in range(0, len(points), CHUNK_SIZE)
+    ])
+    core = counts >= min_images
+
+    cluster = 0
+    for seed in np.flatnonzero(core):
+        if labels[seed] != NOISE:
+            continue
+        labels[seed] = cluster
+        frontier = [seed]
+        while frontier:
+            point = frontier.pop()
+            found = np.flatnonzero(neighbours([point])[0] & (labels == NOISE))
+            labels[found] = cluster
+            # Only core points extend the cluster; border points just join it
+            frontier.extend(found[core[found]])
+        cluster += 1
+    return labels
+
+
+def cluster_images(images, radius=LOCATION_CLUSTER_RADIUS, min_images=LOCATION_CLUSTER_MIN_IMAGES):
+    """
+    Cluster an album listing by GPS position
+
+    Returns:
+        Dict mapping listing index to cluster number, for clustered images only
+    """
+    located = [(i, image_coordinates(image)) for i, image in enumerate(images)]
+    located = [(i, position) for i, position in located if position]
+    if not located:
+        return {}
+    indices = [i for i, _ in located]
+    lat, lng = zip(*(position for _, position in located))
+    labels = dbscan(lat, lng, radius, min_images)
+    return {i: int(label) for i, label in zip(indices, labels) if label != NOISE}
+
+
+class LocationClaim:
+    """
+    One image's share of its cluster's location tags.
+
+    get_vision_tags asks for shared() before running the location features.
+    A tags tuple means they can be skipped; None means this image is one of
+    the cluster's samples and must call resolve() with the tags they added,
+    or release() if it didn't run them.
+    """
+
+    def __init__(self, share, cluster, leader):
+        self._share = share
+        self._cluster = cluster
+        self.leader = leader
+
+    def shared(self):
+        """Return the cluster's (tags, confidence_scores), or None if this image should run the features"""
+        if self.leader:
+            return None
+        result = self._share._wait(self._cluster)
+        if result is None:
+            self.leader = True
+        return result
+
+    def resolve(self, tags, confidence_scores, calls):
+        """Publish the tags this sample's location features added"""
+        if self.leader:
+            self.leader = False
+            self._share._resolve(self._cluster, (set(tags), dict(confidence_scores), calls))
+
+    def release(self):
+        """Give up the sample slot without a result, e.g. when the features failed"""
+        if self.leader:
+            self.leader = False
+            self._share._resolve(self._cluster, None)
+
+
+class LocationShare:
+    """
+    Share landmark and web detection results within each GPS cluster.
+
+    The first samples images of a cluster to be analysed run the location
+    features; later images wait for them and take their combined tags.
+
+    Args:
+        clusters: Dict of listing index to cluster number, from cluster_images
+        samples: Images per cluster that run the location features
+    """
+
+    def __init__(self, clusters, samples=LOCATION_SAMPLES):
+        self.cluster_of = clusters
+        self.samples = max(1, samples)
+        self.clusters = len(set(clusters.values()))
+        self.shared_images = 0
+        self.calls_saved = 0
+        self._results = {}
+        self._pending = {}
+        self._condition = threading.Condition()
+
+    def claim(self, index):
+        """Return a LocationClaim for the image at index, or None if it is in no cluster"""
+        cluster = self.cluster_of.get(index)
+        if cluster is None:
+            return None
+        with self._condition:
+            results = self._results.setdefault(cluster, [])
+            pending = self._pending.get(cluster, 0)
+            leader = len(results) + pending < self.samples
+            if leader:
+                self._pending[cluster] = pending + 1
+        return LocationClaim(self, cluster, leader)
+
+    def _wait(self, cluster):
+        with self._condition:
+            while True:
+                results = self._results[cluster]
+                pending = self._pending.get(cluster, 0)
+                if len(results) >= self.samples:
+                    break
+                if len(results) + pending < self.samples:
+                    # A sample gave up - this image takes its place
+                    self._pending[cluster] = pending + 1
+                    return None
+                self._condition.wait()
+            self.shared_images += 1
+            self.calls_saved += max(calls for _, _, calls in results)
+            tags = set().union(*(result[0] for result in results))
+            confidence_scores = {}
+            for result in results:
+                confidence_scores.update(result[1])
+            return tags, confidence_scores
+
+    def _resolve(self, cluster, result):
+        with self._condition:
+            self._pending[cluster] -= 1
+            if result is not None:
+                self._results[cluster].append(result)
+            self._condition.notify_all()
+
+    def stats(self):
+        """Return cluster counts and how many images reused a cluster's location tags"""
+        with self._condition:
+            return {
+                'clusters': self.clusters,
+                'clusteredImages': len(self.cluster_of),
+                'sharedImages': self.shared_images,
+                'visionCallsSaved': self.calls_saved
+            }
@@ -0,0 +1,169 @@
+"""Perceptual-hash near-duplicate detection for SmugMug Tagger.
+
+Each thumbnail gets a 64-bit difference hash (dHash). Hashes go into a
+BK-tree so finding every analysed image within a Hamming distance takes
+a handful of comparisons instead of a scan of the album. Burst and
+bracketed frames then reuse one image's Vision annotations.
+"""
+import io
+import logging
+import os
+import threading
+
+import numpy as np
+import requests
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Largest Hamming distance (of 64 bits) at which two thumbnails count as the same shot; 0 disables
+DUPLICATE_MAX_DISTANCE = int(os.environ.get('DUPLICATE_MAX_DISTANCE', 6))
+# Hash grid size - the hash has HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+
+
+def dhash(image, size=HASH_SIZE):
+    """
+    Return the difference hash of a PIL image as an int
+
+    The image is shrunk to (size + 1) x size greyscale pixels and each bit
+    records whether a pixel is brighter than its right-hand neighbour, so
+    the hash survives rescaling, recompression and small exposure changes.
+    """
+    small = image.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hash_url(url, timeout=10):
+    """Download an image (normally a thumbnail) and return its dHash"""
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    image = Image.open(io.BytesIO(response.content))
+    image.draft('L', (64, 64))
+    return dhash(image)
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over hashes with Hamming distance.
+
+    Each child edge is labelled with its distance from the parent, so a
+    search for everything within max_distance of a hash only descends
+    edges within max_distance of the distance to the current node.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        """Index item under hash value"""
+        self.size += 1
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return (distance, item) for every item within max_distance, closest first"""
+        if self.root is None:
+            return []
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in items)
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def __len__(self):
+        return self.size
+
+
+class _Entry:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class NearDuplicateIndex:
+    """
+    Share one analysis between images whose hashes are within max_distance.
+
+    Like SingleFlight, but keyed by similarity: the first image of a burst
+    runs the analysis and later frames - including ones arriving while it
+    is still running - receive its result.
+    """
+
+    def __init__(self, max_distance=DUPLICATE_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.lookups = 0
+        self.reused = 0
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def do(self, value, func, *args, **kwargs):
+        """Return the result for a near-duplicate of hash value, or run func(*args, **kwargs) and index it"""
+        with self._lock:
+            self.lookups += 1
+            matches = [
+                entry for _, entry in self._tree.search(value, self.max_distance)
+                if entry.error is None
+            ]
+            leader = not matches
+            if leader:
+                entry = _Entry()
+                self._tree.add(value, entry)
+            else:
+                entry = matches[0]
+
+        if not leader:
+            entry.event.wait()
+            if entry.error is None:
+                with self._lock:
+                    self.reused += 1
+                return entry.result
+            # The matching image failed - analyse this one on its own
+            return func(*args, **kwargs)
+
+        try:
+            entry.result = func(*args, **kwargs)
+            return entry.result
+        except Exception as e:
+            entry.error = e
+            raise
+        finally:
+            entry.event.set()
+
+    def stats(self):
+        """Return lookup and reuse counts"""
+        with self._lock:
+            return {
+                'maxDistance': self.max_distance,
+                'indexed': len(self._tree),
+                'lookups': self.lookups,
+                'reused': self.reused
+            }
@@ -0,0 +1,170 @@
+"""Staged producer/consumer pipeline for SmugMug Tagger.
+
+Each stage runs its own pool of worker threads and reads from a bounded
+queue, so a slow stage applies backpressure to the ones before it while
+network waits in one stage overlap with work in the others.
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Marker passed down the queues to tell workers there is no more input
+_DONE = object()
+
+# Stats for running and recently finished pipelines, keyed by pipeline name
+PIPELINE_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+
+class Stage:
+    """A single pipeline stage: a function, a worker pool and an input queue"""
+
+    def __init__(self, name, func, workers=1, queue_size=4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.inbox = queue.Queue(maxsize=self.queue_size)
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._finished_workers = 0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, ok):
+        """Record the service time of one item"""
+        with self._lock:
+            self.processed += 1
+            if not ok:
+                self.errors += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    def stats(self):
+        """Return queue depth and service time figures for this stage"""
+        with self._lock:
+            avg_time = self.total_time / self.processed if self.processed else 0.0
+            return {
+                'workers': self.workers,
+                'queueDepth': self.inbox.qsize(),
+                'queueSize': self.queue_size,
+                'busy': self.busy,
+                'processed': self.processed,
+                'errors': self.errors,
+                'avgServiceTime': round(avg_time, 3),
+                'maxServiceTime': round(self.max_time, 3)
+            }
+
+
+class Pipeline:
+    """
+    A chain of stages joined by bounded queues.
+
+    Stage functions take an item and return the item to pass to the next
+    stage, or None to drop it. Exceptions are logged, counted against the
+    stage and passed to on_error so the caller can record the failure.
+    """
+
+    def __init__(self, name, stages, on_error=None):
+        self.name = name
+        self.stages = stages
+        self.on_error = on_error
+        self.started = None
+        self.finished = None
+
+    def run(self, items):
+        """Feed items through every stage and block until all are done"""
+        self.started = time.time()
+        with _STATS_LOCK:
+            PIPELINE_STATS[self.name] = self
+
+        threads = []
+        for position, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(position,),
+                    name=f"{self.name}-{stage.name}-{n}"
+                )
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+        # Producer - put() blocks while the first queue is full
+        first = self.stages[0]
+        try:
+            for item in items:
+                first.inbox.put(item)
+        finally:
+            for _ in range(first.workers):
+                first.inbox.put(_DONE)
+
+        for thread in threads:
+            thread.join()
+
+        self.finished = time.time()
+        logger.debug(f"Pipeline {self.name} finished in {self.finished - self.started:.2f}s")
+
+    def _worker(self, position):
+        stage = self.stages[position]
+        downstream = self.stages[position + 1] if position + 1 < len(self.stages) else None
+
+        while True:
+            item = stage.inbox.get()
+            if item is _DONE:
+                break
+
+            with stage._lock:
+                stage.busy += 1
+            started = time.time()
+            ok = True
+            result = None
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                ok = False
+                logger.error(f"Pipeline stage {stage.name} failed: {str(e)}")
+                if self.on_error:
+                    try:
+                        self.on_error(stage.name, item, e)
+                    except Exception as handler_error:
+                        logger.error(f"Error handler for stage {stage.name} failed: {str(handler_error)}")
+            finally:
+                with stage._lock:
+                    stage.busy -= 1
+                stage.record(time.time() - started, ok)
+
+            if result is not None and downstream:
+                downstream.inbox.put(result)
+
+        # The last worker out tells the next stage there is no more input
+        with stage._lock:
+            stage._finished_workers += 1
+            last_out = stage._finished_workers == stage.workers
+        if last_out and downstream:
+            for _ in range(downstream.workers):
+                downstream.inbox.put(_DONE)
+
+    def stats(self):
+        """Return per-stage stats for this pipeline"""
+        elapsed = (self.finished or time.time()) - self.started if self.started else 0.0
+        return {
+            'running': self.started is not None and self.finished is None,
+            'elapsed': round(elapsed, 2),
+            'stages': {stage.name: stage.stats() for stage in self.stages}
+        }
+
+
+def get_pipeline_stats(max_age=3600):
+    """Return stats for running pipelines and those finished within max_age seconds"""
+    now = time.time()
+    with _STATS_LOCK:
+        for name in [name for name, p in PIPELINE_STATS.items()
+                     if p.finished and now - p.finished > max_age]:
+            del PIPELINE_STATS[name]
+        return {name: p.stats() for name, p in PIPELINE_STATS.items()}
@@ -0,0 +1,180 @@
+"""Album tagging previews for SmugMug Tagger.
+
+A preview tags a small stratified sample of an album without writing
+anything, then projects the tag frequencies, Vision cost and run time of
+the full album from it. Strata combine capture-time period, GPS cluster
+and filename series, so a sample of a few dozen images still covers each
+day, place and camera in the album.
+"""
+import collections
+import logging
+import os
+import re
+
+from bursts import group_bursts, parse_capture_time, BURST_SAMPLES
+from location_clusters import LOCATION_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+# Images tagged by a preview
+PREVIEW_SAMPLE_SIZE = int(os.environ.get('PREVIEW_SAMPLE_SIZE', 40))
+# Time budget for a preview, in seconds
+PREVIEW_DEADLINE_SECONDS = float(os.environ.get('PREVIEW_DEADLINE_SECONDS', 60))
+# Capture-time periods the album is split into
+TIME_STRATA = 4
+# Tags returned in a preview's projection
+TOP_TAGS = 50
+
+# Features whose calls are shared across a GPS cluster
+LOCATION_FEATURES = ('landmark_detection', 'web_detection')
+
+
+def filename_series(filename):
+    """Return the camera naming series of a filename, e.g. 'dsc_' for DSC_1234.JPG"""
+    match = re.match(r'\D*', os.path.splitext(filename or '')[0])
+    return match.group(0).lower()
+
+
+def _time_strata(images, strata=TIME_STRATA):
+    """Capture-time period of each image - equal-count bins, None without a capture time"""
+    times = {i: parse_capture_time(image.get('DateTimeOriginal')) for i, image in enumerate(images)}
+    timed = sorted((t, i) for i, t in times.items() if t is not None)
+    periods = {i: None for i in range(len(images))}
+    for position, (_, i) in enumerate(timed):
+        periods[i] = position * strata // len(timed)
+    return periods, times
+
+
+def stratified_sample(images, size=PREVIEW_SAMPLE_SIZE, clusters=None, candidates=None):
+    """
+    Pick a sample covering every capture-time period, GPS cluster and filename series
+
+    Samples are shared out between strata in proportion to their size, with
+    at least one per stratum while the sample allows (largest strata first).
+    Within a stratum images are picked evenly along the capture sequence.
+
+    Args:
+        images: Album listing
+        size: Images to sample
+        clusters: Optional dict of listing index to GPS cluster number
+        candidates: Optional listing indices to sample from, default all
+
+    Returns:
+        Dict mapping each sampled listing index to its weight - the number
+        of candidate images it stands for
+    """
+    clusters = clusters or {}
+    candidates = list(range(len(images))) if candidates is None else list(candidates)
+    periods, times = _time_strata(images)
+
+    strata = collections.defaultdict(list)
+    for i in candidates:
+        key = (periods[i], clusters.get(i, -1), filename_series(images[i].get('FileName')))
+        strata[key].append(i)
+
+    # At least one per stratum, largest first, then the rest by largest remainder
+    ordered = sorted(strata.values(), key=len, reverse=True)
+    size = min(size, len(candidates))
+    allocation = [1 if n < size else 0 for n in range(len(ordered))]
+    spare = size - sum(allocation)
+    if spare > 0:
+        shares = [spare * len(members) / len(candidates) for members in ordered]
+        extra = [min(int(share), len(members) - allocation[n]) for n, (share, members) in enumerate(zip(shares, ordered))]
+        spare -= sum(extra)
+        by_remainder = sorted(range(len(ordered)), key=lambda n: shares[n] - int(shares[n]), reverse=True)
+        for n in by_remainder:
+            if spare <= 0:
+                break
+            if allocation[n] + extra[n] < len(ordered[n]):
+                extra[n] += 1
+                spare -= 1
+        allocation = [a + e for a, e in zip(allocation, extra)]
+
+    sample = {}
+    for members, count in zip(ordered, allocation):
+        if not count:
+            continue
+        members.sort(key=lambda i: (times[i] is None, times[i] or 0, images[i].get('FileName') or ''))
+        step = len(members) / count
+        for k in range(count):
+            sample[members[int(k * step + step / 2)]] = len(members) / count
+    return sample
+
+
+def project_tags(results, weights, total, top=TOP_TAGS):
+    """
+    Project how many images of the full run each tag would be added to
+
+    Args:
+        results: Dict of sampled listing index to its tag list
+        weights: Dict of listing index to weight, from stratified_sample
+        total: Images the full run would tag
+        top: Tags to return
+
+    Returns:
+        List of dicts with tag, sampleCount, fraction and projectedImages,
+        most frequent first
+    """
+    covered = sum(weights[i] for i in results)
+    if not covered:
+        return []
+    weighted = collections.Counter()
+    counts = collections.Counter()
+    for i, tags in results.items():
+        for tag in set(tags):
+            if tag == 'AutoTagged':
+                continue
+            weighted[tag] += weights[i]
+            counts[tag] += 1
+    return [
+        {
+            'tag': tag,
+            'sampleCount': counts[tag],
+            'fraction': round(weight / covered, 3),
+            'projectedImages': round(total * weight / covered)
+        }
+        for tag, weight in weighted.most_common(top)
+    ]
+
+
+def shared_savings(images, pending, clusters):
+    """
+    Count the pending images whose Vision calls the full run would share
+
+    Returns:
+        Tuple of (burst images that inherit all their tags, clustered images
+        that skip the location features)
+    """
+    inherited = 0
+    if BURST_SAMPLES > 0:
+        pending_images = [images[i] for i in pending]
+        inherited = sum(max(0, len(group) - BURST_SAMPLES) for group in group_bursts(pending_images))
+    located = 0
+    if LOCATION_SAMPLES > 0:
+        sizes = collections.Counter(clusters[i] for i in pending if i in clusters)
+        located = sum(max(0, size - LOCATION_SAMPLES) for size in sizes.values())
+    return inherited, located
+
+
+def estimate_units(sample_features, analysed, pending_count, inherited, located):
+    """
+    Scale the sample's Vision units per feature up to the full run
+
+    Args:
+        sample_features: Dict of feature to units used by the preview
+        analysed: Images the preview sent to Vision, including those that failed
+        pending_count: Images the full run would tag
+        inherited: Images that would inherit a burst sample's tags
+        located: Images that would reuse their cluster's location tags
+
+    Returns:
+        Dict of feature to projected units
+    """
+    if not analysed:
+        return {}
+    analysed_images = max(0, pending_count - inherited)
+    located_images = max(0, min(analysed_images, pending_count - located))
+    return {
+        feature: round(units / analysed * (located_images if feature in LOCATION_FEATURES else analysed_images))
+        for feature, units in sample_features.items()
+    }
@@ -0,0 +1,277 @@
+"""Region lookup for SmugMug Tagger.
+
+Maps coordinates to hierarchical region tags (scotland -> scottish
+highlands -> northwest highlands...) using simplified border polygons.
+A grid over each polygon marks the cells wholly inside it, so most
+points are classified by a cell lookup and only points near a border
+need a point-in-polygon test. Both are vectorized, so classify() handles
+thousands of points at once.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Grid cell size, in degrees
+CELL_SIZE = 0.25
+
+# Shared borders, so neighbouring polygons neither overlap nor leave gaps.
+# Points are (latitude, longitude).
+SCOTLAND_ENGLAND = [
+    (54.90, -3.40), (54.98, -3.06), (55.10, -2.85), (55.28, -2.62), (55.35, -2.48),
+    (55.55, -2.25), (55.81, -2.03), (55.90, -1.60)
+]
+ENGLAND_WALES = [
+    (53.45, -3.30), (53.33, -3.20), (53.22, -3.00), (53.15, -2.93), (52.98, -2.72),
+    (52.85, -3.05), (52.55, -3.05), (52.07, -3.13), (51.95, -2.95), (51.85, -2.70),
+    (51.62, -2.65), (51.55, -2.75), (51.45, -3.00), (51.33, -3.50), (51.35, -4.40),
+    (51.45, -5.80)
+]
+IRISH_BORDER = [
+    (55.20, -6.95), (55.10, -7.20), (55.04, -7.40), (54.83, -7.47), (54.60, -7.75),
+    (54.48, -8.15), (54.30, -7.85), (54.15, -7.35), (54.20, -7.00), (54.10, -6.65),
+    (54.03, -6.27), (54.00, -6.00)
+]
+# Highland Boundary Fault and Southern Uplands Fault, west to east
+HIGHLAND_BOUNDARY = [
+    (55.00, -6.20), (55.50, -5.35), (55.85, -5.00), (56.00, -4.75), (56.18, -4.38),
+    (56.24, -4.22), (56.37, -3.99), (56.56, -3.59), (56.80, -2.65), (56.96, -2.20),
+    (57.00, 0.00)
+]
+# Pentland Firth, between Caithness (and Stroma) and Orkney; the Northern
+# Isles lie north of it and east of Sule Skerry
+NORTHERN_ISLES = [(58.71, -4.60), (58.71, 0.00)]
+SOUTHERN_UPLANDS = [
+    (55.00, -6.20), (55.10, -5.60), (55.24, -4.86), (55.50, -4.00), (55.75, -3.20), (55.99, -2.52),
+    (56.10, -1.50)
+]
+
+# Regions, parents before children. A child is only tested against points
+# inside its parent, so child polygons may run out to sea freely.
+REGIONS = [
+    {
+        'name': 'scotland', 'parent': None, 'tags': ['scotland'],
+        'polygon': [
+            (54.50, -5.10), (54.90, -5.25), (55.25, -5.75), (55.40, -6.05), (55.50, -6.60),
+            (56.00, -6.60), (56.80, -7.80), (57.80, -8.80), (58.70, -6.60), (59.25, -6.30),
+            (59.50, -3.60), (61.00, -1.50),
+            (60.90, -0.60), (60.00, -0.80), (59.50, -1.40), (59.30, -2.20), (57.80, -1.30),
+            (56.00, -1.80)
+        ] + list(reversed(SCOTLAND_ENGLAND)) + [(54.50, -3.85)]
+    },
+    {
+        'name': 'england', 'parent': None, 'tags': ['england'],
+        'polygon': ENGLAND_WALES + [
+            (50.00, -6.70), (49.80, -6.50), (49.80, -5.00), (50.40, -2.00), (50.50, 0.00),
+            (50.80, 1.20), (51.20, 1.70), (52.00, 2.00), (52.90, 2.00), (53.60, 0.30),
+            (54.60, -0.50), (55.50, -1.40)
+        ] + list(reversed(SCOTLAND_ENGLAND)) + [(54.50, -3.85), (53.90, -3.40)]
+    },
+    {
+        'name': 'wales', 'parent': None, 'tags': ['wales'],
+        'polygon': ENGLAND_WALES + [
+            (51.70, -5.70), (52.10, -5.30), (52.75, -5.00), (53.30, -4.80), (53.45, -4.75)
+        ]
+    },
+    {
+        'name': 'northern ireland', 'parent': None, 'tags': ['northern ireland'],
+        'polygon': [
+            (55.35, -6.45), (55.35, -6.05), (55.25, -5.95), (55.00, -5.60), (54.60, -5.30),
+            (54.20, -5.40)
+        ] + list(reversed(IRISH_BORDER))
+    },
+    {
+        'name': 'republic of ireland', 'parent': None, 'tags': ['ireland', 'republic of ireland'],
+        'polygon': IRISH_BORDER + [
+            (53.00, -5.80), (52.00, -6.10), (51.30, -8.50), (51.30, -10.00), (52.00, -10.80),
+            (53.50, -10.50), (54.30, -10.30), (55.00, -8.60), (55.50, -7.40)
+        ]
+    },
+    {
+        'name': 'scottish highlands', 'parent': 'scotland', 'tags': ['scottish highlands'],
+        'polygon': HIGHLAND_BOUNDARY + list(reversed(NORTHERN_ISLES)) + [
+            (61.50, -4.60), (61.50, -9.50), (55.00, -9.50)
+        ]
+    },
+    {
+        'name': 'northern isles', 'parent': 'scotland', 'tags': ['northern isles', 'northern scotland'],
+        'polygon': NORTHERN_ISLES + [(61.50, 0.00), (61.50, -4.60)]
+    },
+    {
+        'name': 'central scotland', 'parent': 'scotland', 'tags': ['central scotland'],
+        'polygon': SOUTHERN_UPLANDS + list(reversed(HIGHLAND_BOUNDARY[1:]))
+    },
+    {
+        'name': 'southern scotland', 'parent': 'scotland', 'tags': ['southern scotland'],
+        'polygon': [(54.40, -6.20)] + SOUTHERN_UPLANDS + [(54.40, -1.50)]
+    },
+    {
+        'name': 'west highlands', 'parent': 'scottish highlands', 'tags': ['west highlands'],
+        'polygon': [(55.00, -9.50), (61.50, -9.50), (61.50, -4.00), (55.00, -4.00)]
+    },
+    {
+        'name': 'east highlands', 'parent': 'scottish highlands', 'tags': ['east highlands'],
+        'polygon': [(55.00, -4.00), (61.50, -4.00), (61.50, 0.00), (55.00, 0.00)]
+    },
+    {
+        'name': 'northwest highlands', 'parent': 'west highlands', 'tags': ['northwest highlands', 'northwest scotland'],
+        'polygon': [(57.00, -9.50), (61.50, -9.50), (61.50, -4.00), (57.00, -4.00)]
+    },
+    {
+        'name': 'northeast scotland', 'parent': 'east highlands', 'tags': ['northeast scotland'],
+        'polygon': [(57.00, -4.00), (61.50, -4.00), (61.50, 0.00), (57.00, 0.00)]
+    },
+    {
+        'name': 'northern scotland', 'parent': 'scottish highlands', 'tags': ['northern scotland'],
+        'polygon': [(58.00, -9.50), (61.50, -9.50), (61.50, 0.00), (58.00, 0.00)]
+    },
+    {
+        'name': 'orkney', 'parent': 'northern isles', 'tags': ['orkney'],
+        'polygon': [(58.00, -4.60), (59.45, -4.60), (59.45, 0.00), (58.00, 0.00)]
+    },
+    {
+        'name': 'shetland', 'parent': 'northern isles', 'tags': ['shetland'],
+        'polygon': [(59.45, -4.60), (61.50, -4.60), (61.50, 0.00), (59.45, 0.00)]
+    },
+    {
+        'name': 'southwest scotland', 'parent': 'southern scotland', 'tags': ['southwest scotland'],
+        'polygon': [(54.40, -6.00), (56.20, -6.00), (56.20, -4.00), (54.40, -4.00)]
+    },
+    {
+        'name': 'southeast scotland', 'parent': 'southern scotland', 'tags': ['southeast scotland'],
+        'polygon': [(54.40, -4.00), (56.20, -4.00), (56.20, -1.00), (54.40, -1.00)]
+    },
+    {
+        'name': 'northern england', 'parent': 'england', 'tags': ['northern england'],
+        'polygon': [(53.50, -4.00), (56.00, -4.00), (56.00, 1.00), (53.50, 1.00)]
+    },
+    {
+        'name': 'central england', 'parent': 'england', 'tags': ['central england'],
+        'polygon': [(52.00, -4.00), (53.50, -4.00), (53.50, 2.50), (52.00, 2.50)]
+    },
+    {
+        'name': 'southern england', 'parent': 'england', 'tags': ['southern england'],
+        'polygon': [(49.50, -7.00), (52.00, -7.00), (52.00, 2.50), (49.50, 2.50)]
+    }
+]
+
+
+def _contains(polygon, lat, lng):
+    """Vectorized even-odd point-in-polygon test for arrays of points"""
+    inside = np.zeros(len(lat), dtype=bool)
+    previous = polygon[-1]
+    for vertex in polygon:
+        crosses = (vertex[0] > lat) != (previous[0] > lat)
+        if crosses.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                edge_lng = (previous[1] - vertex[1]) * (lat - vertex[0]) / (previous[0] - vertex[0]) + vertex[1]
+            inside ^= crosses & (lng < edge_lng)
+        previous = vertex
+    return inside
+
+
+def _cells(lat, lng):
+    """Grid cell key of each point"""
+    return np.floor(lat / CELL_SIZE).astype(np.int64) * 100000 + np.floor(lng / CELL_SIZE).astype(np.int64)
+
+
+class RegionIndex:
+    """
+    Hierarchical region polygons with a grid index.
+
+    For each region, grid cells crossed by its border (or next to one) are
+    boundary cells; the other cells over its bounding box are wholly inside
+    or outside it, decided once from the cell's centre.
+
+    Args:
+        regions: Region definitions as in REGIONS, parents first
+    """
+
+    def __init__(self, regions=REGIONS):
+        self.regions = regions
+        self._position = {region['name']: n for n, region in enumerate(regions)}
+        self._parents = [self._position.get(region['parent']) for region in regions]
+        self._polygons = [np.array(region['polygon'], dtype=np.float64) for region in regions]
+        self._interior = []
+        self._boundary = []
+        for polygon in self._polygons:
+            interior, boundary = self._index(polygon)
+            self._interior.append(interior)
+            self._boundary.append(boundary)
+
+    def _index(self, polygon):
+        # Sample every edge finely; the cells hit, and their neighbours, are boundary cells
+        points = []
+        for start, end in zip(polygon, np.roll(polygon, -1, axis=0)):
+            steps = max(2, int(np.abs(end - start).max() / (CELL_SIZE / 8)) + 1)
+            points.append(start + (end - start) * np.linspace(0, 1, steps)[:, None])
+        points = np.concatenate(points)
+        rows = np.floor(points[:, 0] / CELL_SIZE).astype(np.int64)
+        cols = np.floor(points[:, 1] / CELL_SIZE).astype(np.int64)
+        boundary = np.unique(np.concatenate([
+            (rows + d_row) * 100000 + cols + d_col
+            for d_row in (-1, 0, 1) for d_col in (-1, 0, 1)
+        ]))
+
+        # Every other cell over the bounding box is wholly in or out - test its centre
+        low = np.floor(polygon.min(axis=0) / CELL_SIZE).astype(np.int64)
+        high = np.floor(polygon.max(axis=0) / CELL_SIZE).astype(np.int64)
+        grid_rows, grid_cols = np.meshgrid(
+            np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1), indexing='ij'
+        )
+        grid_rows, grid_cols = grid_rows.ravel(), grid_cols.ravel()
+        keys = grid_rows * 100000 + grid_cols
+        centres = _contains(polygon, (grid_rows + 0.5) * CELL_SIZE, (grid_cols + 0.5) * CELL_SIZE)
+        interior = np.setdiff1d(keys[centres], boundary)
+        return interior, boundary
+
+    def classify_regions(self, lat, lng):
+        """
+        Test every point against every region
+
+        Args:
+            lat: Array of latitudes
+            lng: Array of longitudes
+
+        Returns:
+            Boolean array of shape (regions, points)
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        cells = _cells(lat, lng)
+        result = np.zeros((len(self.regions), len(lat)), dtype=bool)
+        for n, polygon in enumerate(self._polygons):
+            parent = self._parents[n]
+            candidates = result[parent] if parent is not None else np.ones(len(lat), dtype=bool)
+            inside = candidates & np.isin(cells, self._interior[n])
+            border = candidates & np.isin(cells, self._boundary[n])
+            if border.any():
+                inside[border] = _contains(polygon, lat[border], lng[border])
+            result[n] = inside
+        return result
+
+    def classify(self, lat, lng):
+        """
+        Return the region tags for many points at once
+
+        Args:
+            lat: Array of latitudes
+            lng: Array of longitudes
+
+        Returns:
+            One list of tags per point, broadest region first
+        """
+        memberships = self.classify_regions(lat, lng)
+        tags = [[] for _ in range(memberships.shape[1])]
+        for n, region in enumerate(self.regions):
+            for point in np.flatnonzero(memberships[n]):
+                tags[point].extend(region['tags'])
+        return tags
+
+    def region_tags(self, lat, lng):
+        """Return the region tags for one point"""
+        return self.classify([lat], [lng])[0]
+
+
+REGION_INDEX = RegionIndex()
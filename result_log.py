@@ -0,0 +1,125 @@
+"""Append-only on-disk log of processed images for SmugMug Tagger."""
+import collections
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where the per-session logs live
+RESULTS_DIR = os.environ.get(
+    'RESULTS_DIR', os.path.join(tempfile.gettempdir(), 'smugmug_tagger_results')
+)
+# How many recent results each session keeps in memory
+RECENT_RESULTS = int(os.environ.get('RECENT_RESULTS', 10))
+# Largest page a single read may return
+MAX_PAGE_SIZE = 200
+
+_LOGS = {}
+_LOGS_LOCK = threading.Lock()
+
+
+class ResultLog:
+    """
+    Results for one session, stored as JSON lines.
+
+    Only a small ring of recent items and the item count are held in
+    memory. Reads are paginated with a cursor that is the byte offset of
+    the next line, so each page costs one seek however large the log is.
+    """
+
+    def __init__(self, session_id, directory=RESULTS_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{session_id}.jsonl")
+        self.recent = collections.deque(maxlen=RECENT_RESULTS)
+        self.count = 0
+        self._lock = threading.Lock()
+
+        # Pick up where a previous process left off
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    self.count += 1
+                    self.recent.append(line)
+            self.recent = collections.deque(
+                (json.loads(line) for line in self.recent), maxlen=RECENT_RESULTS
+            )
+
+    def append(self, item):
+        """Append one result to the log"""
+        line = json.dumps(item, separators=(',', ':')) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.recent.append(item)
+            self.count += 1
+
+    def extend(self, items):
+        """Append several results with a single write"""
+        items = list(items)
+        if not items:
+            return
+        lines = ''.join(json.dumps(item, separators=(',', ':')) + '\n' for item in items)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+            self.recent.extend(items)
+            self.count += len(items)
+
+    def read(self, cursor=0, limit=50):
+        """
+        Read a page of results.
+
+        Args:
+            cursor: Byte offset returned by the previous read, or 0 to start
+            limit: Maximum number of items to return
+
+        Returns:
+            Tuple of (items, next_cursor), where next_cursor is None at the end of the log
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        items = []
+        if not os.path.exists(self.path):
+            return items, None
+
+        with open(self.path, 'rb') as f:
+            f.seek(max(0, int(cursor)))
+            while len(items) < limit:
+                line = f.readline()
+                if not line:
+                    return items, None
+                if not line.endswith(b'\n'):
+                    # A write is still in progress - stop before it
+                    return items, f.tell() - len(line)
+                items.append(json.loads(line))
+            next_cursor = f.tell()
+            if not f.readline():
+                next_cursor = None
+        return items, next_cursor
+
+    def delete(self):
+        """Remove the log file"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.recent.clear()
+            self.count = 0
+
+
+def get_result_log(session_id):
+    """Return the shared ResultLog for a session"""
+    with _LOGS_LOCK:
+        if session_id not in _LOGS:
+            _LOGS[session_id] = ResultLog(session_id)
+        return _LOGS[session_id]
+
+
+def delete_result_log(session_id):
+    """Delete a session's log and forget it"""
+    with _LOGS_LOCK:
+        log = _LOGS.pop(session_id, None)
+    if log is None:
+        log = ResultLog(session_id)
+    log.delete()
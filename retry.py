@@ -0,0 +1,83 @@
+"""Failure classification and retry scheduling for SmugMug Tagger."""
+import heapq
+import itertools
+import os
+import random
+import time
+
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# How many times a transient failure is retried before it is dead-lettered
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 4))
+# Base and cap for the exponential backoff, in seconds
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 2))
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 120))
+
+# HTTP statuses worth retrying: timeouts, rate limiting and server errors
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Exception class names that mean a network or quota problem. Matched by
+# name so we don't need to import requests and google.api_core here.
+TRANSIENT_ERROR_NAMES = {
+    'ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout', 'ChunkedEncodingError',
+    'ServiceUnavailable', 'ResourceExhausted', 'TooManyRequests', 'DeadlineExceeded',
+    'InternalServerError', 'GatewayTimeout', 'BadGateway', 'RetryError', 'TimeoutError',
+    'ConnectionResetError'
+}
+
+
+def classify_failure(error=None, status_code=None):
+    """
+    Decide whether a failure is worth retrying
+
+    Args:
+        error: Exception raised by the failed call, if any
+        status_code: HTTP status of the failed response, if any
+
+    Returns:
+        TRANSIENT or PERMANENT
+    """
+    if status_code is not None:
+        return TRANSIENT if status_code in TRANSIENT_STATUS_CODES else PERMANENT
+    if error is not None:
+        for cls in type(error).__mro__:
+            if cls.__name__ in TRANSIENT_ERROR_NAMES:
+                return TRANSIENT
+    return PERMANENT
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Return the delay before retry number attempt (1-based), with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** max(0, attempt - 1))))
+
+
+class RetryQueue:
+    """Failed images waiting for their next attempt, ordered by due time"""
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def push(self, entry, delay=None):
+        """Schedule an entry; its attempt count picks the backoff unless delay is given"""
+        if delay is None:
+            delay = backoff_delay(entry.get('attempts', 1))
+        heapq.heappush(self._heap, (time.time() + delay, next(self._sequence), entry))
+
+    def pop_due(self, now=None):
+        """Remove and return every entry whose retry time has come"""
+        now = now or time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def seconds_until_next(self):
+        """Seconds until the next entry is due, or None if the queue is empty"""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.time())
+
+    def __len__(self):
+        return len(self._heap)
@@ -0,0 +1,125 @@
+"""Single-flight coordination for SmugMug Tagger.
+
+SingleFlight makes concurrent calls with the same key share one
+execution, and FileLock extends exclusive ownership of a key across
+gunicorn worker processes.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows - fall back to in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Where cross-process lock files live
+LOCK_DIR = os.environ.get(
+    'LOCK_DIR', os.path.join(tempfile.gettempdir(), 'smugmug_tagger_locks')
+)
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Share one in-flight call between concurrent callers with the same key.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait and receive the same result or exception.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Run func(*args, **kwargs) unless a call for key is already in flight"""
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+            else:
+                self.shared += 1
+
+        if not leader:
+            logger.debug(f"Sharing in-flight {self.name} call for {key}")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.event.set()
+
+    def stats(self):
+        """Return call and sharing counts"""
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'inFlight': len(self._in_flight)}
+
+
+class FileLock:
+    """
+    Exclusive lock on a name, held across threads and processes.
+
+    Each FileLock opens its own file description, so two holders conflict
+    even when they are threads in the same process.
+    """
+
+    def __init__(self, name, directory=LOCK_DIR):
+        os.makedirs(directory, exist_ok=True)
+        safe_name = hashlib.md5(name.encode()).hexdigest()
+        self.path = os.path.join(directory, f"{safe_name}.lock")
+        self._file = None
+
+    def acquire(self, blocking=False):
+        """Take the lock, returning False if another holder has it and blocking is False"""
+        self._file = open(self.path, 'a')
+        if fcntl is None:
+            return True
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._file.fileno(), flags)
+            return True
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+
+    def release(self):
+        """Release the lock"""
+        if self._file is not None:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire(blocking=True)
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
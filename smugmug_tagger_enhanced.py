@@ -6,6 +6,11 @@ from google.cloud import vision
 import os
 from urllib.parse import urlparse
 
+from gazetteer import GAZETTEER
+import local_analysis
+from regions import REGION_INDEX
+from tag_rules import TAG_RULES
+
 def get_path_from_url(url):
     """Extract path from SmugMug URL"""
     parsed = urlparse(url)
@@ -14,8 +19,14 @@ def get_path_from_url(url):
         path = path.replace('/app/organize', '', 1)
     return path.rstrip('/')
 
-def get_vision_tags(vision_client, image_url):
-    """Get comprehensive tags using multiple Vision API features"""
+def get_vision_tags(vision_client, image_url, thumbnail_url=None):
+    """
+    Get comprehensive tags using multiple Vision API features
+    
+    A small local decode of the image (the thumbnail, if given) decides
+    whether text and face detection are worth calling and supplies the
+    dominant colours, so image_properties is never called.
+    """
     vision_image = vision.Image()
     vision_image.source.image_uri = image_url
     
@@ -23,6 +34,9 @@ def get_vision_tags(vision_client, image_url):
     confidence_scores = {}
     
     try:
+        # 0. Local analysis (edges, skin tones, colours) - no API call
+        local = local_analysis.analyze(thumbnail_url or image_url)
+        
         # 1. Label Detection (general objects, scenes, activities)
         print("Analyzing general content...")
         label_response = vision_client.label_detection(image=vision_image)
@@ -54,44 +68,28 @@ def get_vision_tags(vision_client, image_url):
                 # Add location data if available
                 for location in landmark.locations:
                     if location.lat_lng:
-                        lat = location.lat_lng.latitude
-                        lng = location.lat_lng.longitude
-                        
-                        # Add Scotland-specific location tags
-                        if 56 < lat < 59:  # Scotland
-                            all_tags.add('scotland')
-                            if lat > 58:  # Northern Scotland
-                                all_tags.add('northern scotland')
-                                if lng < -4:  # Northwest
-                                    all_tags.add('northwest highlands')
-                                    all_tags.add('west coast')
-                                elif lng > -3:  # Northeast
-                                    all_tags.add('northeast scotland')
-                                    all_tags.add('east coast')
-                            elif 57 < lat < 58:  # Central Scotland
-                                all_tags.add('central scotland')
-                            if lng < -5:  # Western Scotland
-                                all_tags.add('western scotland')
-                            elif lng > -3:  # Eastern Scotland
-                                all_tags.add('eastern scotland')
+                        lat_lng = (location.lat_lng.latitude, location.lat_lng.longitude)
+                        all_tags.update(REGION_INDEX.region_tags(*lat_lng))
+                        all_tags.update(GAZETTEER.place_tags(*lat_lng))
         
         # 4. Text Detection (OCR for signs and plaques)
-        print("Reading text and signs...")
-        text_response = vision_client.text_detection(image=vision_image)
-        if text_response.text_annotations:
-            # Get all detected text
-            full_text = text_response.text_annotations[0].description.lower()
-            
-            # Add individual words/phrases as tags if they appear meaningful
-            words = set(full_text.split())
-            for word in words:
-                if len(word) > 2:  # Ignore very short words
-                    all_tags.add(word)
-            
-            # Store the full text for context
-            if full_text:
-                all_tags.add('text_present')
-                confidence_scores['detected_text'] = full_text
+        if local_analysis.worth_calling(local, 'text_detection'):
+            print("Reading text and signs...")
+            text_response = vision_client.text_detection(image=vision_image)
+            if text_response.text_annotations:
+                # Get all detected text
+                full_text = text_response.text_annotations[0].description.lower()
+                
+                # Add individual words/phrases as tags if they appear meaningful
+                words = set(full_text.split())
+                for word in words:
+                    if len(word) > 2:  # Ignore very short words
+                        all_tags.add(word)
+                
+                # Store the full text for context
+                if full_text:
+                    all_tags.add('text_present')
+                    confidence_scores['detected_text'] = full_text
 # 5. Web Detection (similar images and metadata)
         print("Analyzing web context...")
         web_response = vision_client.web_detection(image=vision_image)
@@ -115,79 +113,34 @@ def get_vision_tags(vision_client, image_url):
             for page in web_detection.pages_with_matching_images:
                 if page.page_title:
                     # Extract meaningful keywords from page titles
-                    title_words = page.page_title.lower().split()
-                    for word in title_words:
-                        if len(word) > 3:  # Ignore very short words
-                            all_tags.add(word)
+                    all_tags.update(TAG_RULES.words(page.page_title.lower(), min_length=4))
         
-        # 6. Image Properties Detection (colors, brightness)
-        print("Analyzing image properties...")
-        property_response = vision_client.image_properties(image=vision_image)
-        if property_response.image_properties_annotation:
-            colors = property_response.image_properties_annotation.dominant_colors.colors
-            
-            # Analyze overall brightness and colors
-            bright_colors = 0
-            dark_colors = 0
-            blue_sky = False
-            green_nature = False
-            
-            for color in colors[:3]:  # Look at top 3 dominant colors
-                rgb_sum = color.color.red + color.color.green + color.color.blue
-                
-                # Brightness analysis
-                if rgb_sum > 600:  # Bright color
-                    bright_colors += 1
-                elif rgb_sum < 300:  # Dark color
-                    dark_colors += 1
-                
-                # Sky detection
-                if (color.color.blue > 200 and 
-                    color.color.blue > color.color.red and 
-                    color.color.blue > color.color.green):
-                    blue_sky = True
-                
-                # Nature/vegetation detection
-                if (color.color.green > 150 and 
-                    color.color.green > color.color.red and 
-                    color.color.green > color.color.blue):
-                    green_nature = True
-            
-            # Add lighting condition tags
-            if bright_colors >= 2:
-                all_tags.add('bright')
-                all_tags.add('well lit')
-            elif dark_colors >= 2:
-                all_tags.add('dark')
-                all_tags.add('low light')
-            
-            # Add color-based environment tags
-            if blue_sky:
-                all_tags.add('blue sky')
-                all_tags.add('clear sky')
-            if green_nature:
-                all_tags.add('verdant')
-                all_tags.add('greenery')
+        # 6. Image Properties - dominant colours computed locally
+        if local:
+            print("Analyzing image colours locally...")
+            all_tags.update(local['color_tags'])
+            confidence_scores.update(local['color_scores'])
         
         # 7. Face Detection
-        print("Analyzing people and expressions...")
-        face_response = vision_client.face_detection(image=vision_image)
-        if face_response.face_annotations:
-            all_tags.add('people')
-            confidence_scores['people'] = '100%'
-            
-            face_count = len(face_response.face_annotations)
-            if face_count > 1:
-                all_tags.add('group photo')
-                if face_count > 4:
-                    all_tags.add('group activity')
-            
-            for face in face_response.face_annotations:
-                # Expression detection
-                if face.joy_likelihood >= vision.Likelihood.LIKELY:
-                    all_tags.add('smiling')
-                if face.headwear_likelihood >= vision.Likelihood.LIKELY:
-                    all_tags.add('headwear')
+        if local_analysis.worth_calling(local, 'face_detection'):
+            print("Analyzing people and expressions...")
+            face_response = vision_client.face_detection(image=vision_image)
+            if face_response.face_annotations:
+                all_tags.add('people')
+                confidence_scores['people'] = '100%'
+                
+                face_count = len(face_response.face_annotations)
+                if face_count > 1:
+                    all_tags.add('group photo')
+                    if face_count > 4:
+                        all_tags.add('group activity')
+                
+                for face in face_response.face_annotations:
+                    # Expression detection
+                    if face.joy_likelihood >= vision.Likelihood.LIKELY:
+                        all_tags.add('smiling')
+                    if face.headwear_likelihood >= vision.Likelihood.LIKELY:
+                        all_tags.add('headwear')
         
         # Clean up and normalize tags
         cleaned_tags = set()
@@ -331,7 +284,9 @@ def test_album_tag_writing():
                 
                 # Get Vision AI tags
                 print("\nAnalyzing image with Vision AI...")
-                vision_tags, confidence_scores = get_vision_tags(vision_client, image_url)
+                vision_tags, confidence_scores = get_vision_tags(
+                    vision_client, image_url, image.get('ThumbnailUrl')
+                )
                 
                 if vision_tags:
                     print("\nVision AI suggested tags:")
@@ -8,6 +8,17 @@ from urllib.parse import urlparse
 import sys
 import logging
 
+from gazetteer import GAZETTEER
+import local_analysis
+from regions import REGION_INDEX
+from tag_rules import TagRules
+
+# This script's own context rules - the app's TAG_RULES add different tags
+CONTEXT_RULES = TagRules({'context': [
+    {'requires': ['people'], 'when': ['outdoor', 'nature'], 'add': ['people outdoors']},
+    {'requires': ['group photo'], 'when': ['outdoor', 'nature'], 'add': ['group outdoors']}
+]})
+
 # Configure logging
 logging.basicConfig(filename='smugmug_debug.log', level=logging.DEBUG)
 
@@ -19,8 +30,15 @@ def get_path_from_url(url):
         path = path.replace('/app/organize', '', 1)
     return path.rstrip('/')
 
-def get_vision_tags(vision_client, image_url):
-    """Get comprehensive tags using multiple Vision API features"""
+def get_vision_tags(vision_client, image_url, thumbnail_url=None, local=None):
+    """
+    Get comprehensive tags using multiple Vision API features
+    
+    A small local decode of the image (the thumbnail, if given) decides
+    whether text and face detection are worth calling and supplies the
+    dominant colours, so image_properties is never called. Pass local to
+    reuse a result from local_analysis.analyze_batch.
+    """
     vision_image = vision.Image()
     vision_image.source.image_uri = image_url
     
@@ -28,6 +46,10 @@ def get_vision_tags(vision_client, image_url):
     confidence_scores = {}
     
     try:
+        # 0. Local analysis (edges, skin tones, colours) - no API call
+        if local is None:
+            local = local_analysis.analyze(thumbnail_url or image_url)
+        
         # 1. Label Detection (general objects, scenes, activities)
         logging.debug("Analyzing general content...")
         label_response = vision_client.label_detection(image=vision_image)
@@ -58,41 +80,26 @@ def get_vision_tags(vision_client, image_url):
                 # Add location data if available
                 for location in landmark.locations:
                     if location.lat_lng:
-                        lat = location.lat_lng.latitude
-                        lng = location.lat_lng.longitude
-                        # Add Scotland-specific location tags
-                        if 56 < lat < 59:  # Scotland
-                            all_tags.add('scotland')
-                            if lat > 58:  # Northern Scotland
-                                all_tags.add('northern scotland')
-                                if lng < -4:  # Northwest
-                                    all_tags.add('northwest highlands')
-                                    all_tags.add('west coast')
-                                elif lng > -3:  # Northeast
-                                    all_tags.add('northeast scotland')
-                                    all_tags.add('east coast')
-                            elif 57 < lat < 58:  # Central Scotland
-                                all_tags.add('central scotland')
-                            if lng < -5:  # Western Scotland
-                                all_tags.add('western scotland')
-                            elif lng > -3:  # Eastern Scotland
-                                all_tags.add('eastern scotland')
+                        lat_lng = (location.lat_lng.latitude, location.lat_lng.longitude)
+                        all_tags.update(REGION_INDEX.region_tags(*lat_lng))
+                        all_tags.update(GAZETTEER.place_tags(*lat_lng))
         
         # 4. Text Detection (OCR)
-        logging.debug("Reading text and signs...")
-        text_response = vision_client.text_detection(image=vision_image)
-        if text_response.text_annotations:
-            full_text = text_response.text_annotations[0].description.lower()
-            words = set(full_text.split())
-            for word in words:
-                if len(word) > 2:  # Skip very short words
-                    if hasattr(text_response.text_annotations[0], 'confidence'):
-                        confidence = text_response.text_annotations[0].confidence * 100
-                        if confidence >= 45:  # 45% threshold for text
-                            all_tags.add(word)
-                            confidence_scores[f"text_{word}"] = f"{confidence:.1f}%"
-            if words:
-                all_tags.add('text_present')
+        if local_analysis.worth_calling(local, 'text_detection'):
+            logging.debug("Reading text and signs...")
+            text_response = vision_client.text_detection(image=vision_image)
+            if text_response.text_annotations:
+                full_text = text_response.text_annotations[0].description.lower()
+                words = set(full_text.split())
+                for word in words:
+                    if len(word) > 2:  # Skip very short words
+                        if hasattr(text_response.text_annotations[0], 'confidence'):
+                            confidence = text_response.text_annotations[0].confidence * 100
+                            if confidence >= 45:  # 45% threshold for text
+                                all_tags.add(word)
+                                confidence_scores[f"text_{word}"] = f"{confidence:.1f}%"
+                if words:
+                    all_tags.add('text_present')
 
         # 5. Web Detection
         logging.debug("Analyzing web context...")
@@ -111,78 +118,37 @@ def get_vision_tags(vision_client, image_url):
                     all_tags.add(entity_lower)
                     confidence_scores[f"web_{entity_lower}"] = f"{entity.score * 100:.1f}%"
 
-        # 6. Image Properties
-        logging.debug("Analyzing image properties...")
-        property_response = vision_client.image_properties(image=vision_image)
-        if property_response.image_properties_annotation:
-            colors = property_response.image_properties_annotation.dominant_colors.colors
-            
-            # Analyze colors if they make up at least 60% of the image
-            bright_colors = 0
-            dark_colors = 0
-            nature_colors = 0
-            
-            for color in colors[:3]:  # Look at top 3 dominant colors
-                if color.score >= 0.6:  # 60% threshold
-                    rgb_sum = color.color.red + color.color.green + color.color.blue
-                    
-                    # Brightness analysis
-                    if rgb_sum > 600:
-                        bright_colors += 1
-                    elif rgb_sum < 300:
-                        dark_colors += 1
-                    
-                    # Color-based environment detection
-                    if (color.color.blue > 200 and 
-                        color.color.blue > color.color.red and 
-                        color.color.blue > color.color.green):
-                        all_tags.add('blue sky')
-                        confidence_scores['blue sky'] = f"{color.score * 100:.1f}%"
-                    
-                    elif (color.color.green > 150 and 
-                          color.color.green > color.color.red and 
-                          color.color.green > color.color.blue):
-                        nature_colors += 1
-            
-            # Add summary color tags
-            if bright_colors >= 2:
-                all_tags.add('bright')
-                all_tags.add('well lit')
-            elif dark_colors >= 2:
-                all_tags.add('dark')
-                all_tags.add('low light')
-            
-            if nature_colors >= 2:
-                all_tags.add('verdant')
-                all_tags.add('greenery')
-
+        # 6. Image Properties - dominant colours computed locally
+        if local:
+            logging.debug("Analyzing image colours locally...")
+            all_tags.update(local['color_tags'])
+            confidence_scores.update(local['color_scores'])
+        
         # 7. Face Detection
-        logging.debug("Analyzing people and expressions...")
-        face_response = vision_client.face_detection(image=vision_image)
-        if face_response.face_annotations:
-            faces = face_response.face_annotations
-            if len(faces) > 0:  # If any faces detected with 30% confidence
-                face_confidence = min(face.detection_confidence for face in faces)
-                if face_confidence >= 0.3:
-                    all_tags.add('people')
-                    confidence_scores['people'] = f"{face_confidence * 100:.1f}%"
-                    
-                    if len(faces) > 1:
-                        all_tags.add('group photo')
-                        if len(faces) > 4:
-                            all_tags.add('group activity')
-                    
-                    # Expression detection
-                    joy_detected = any(face.joy_likelihood >= vision.Likelihood.LIKELY for face in faces)
-                    if joy_detected:
-                        all_tags.add('smiling')
-                        all_tags.add('happy')
-                    
-                    # Check for outdoor/activity context
-                    if 'outdoor' in all_tags or 'nature' in all_tags:
-                        all_tags.add('people outdoors')
+        if local_analysis.worth_calling(local, 'face_detection'):
+            logging.debug("Analyzing people and expressions...")
+            face_response = vision_client.face_detection(image=vision_image)
+            if face_response.face_annotations:
+                faces = face_response.face_annotations
+                if len(faces) > 0:  # If any faces detected with 30% confidence
+                    face_confidence = min(face.detection_confidence for face in faces)
+                    if face_confidence >= 0.3:
+                        all_tags.add('people')
+                        confidence_scores['people'] = f"{face_confidence * 100:.1f}%"
+                        
                         if len(faces) > 1:
-                            all_tags.add('group outdoors')
+                            all_tags.add('group photo')
+                            if len(faces) > 4:
+                                all_tags.add('group activity')
+                        
+                        # Expression detection
+                        joy_detected = any(face.joy_likelihood >= vision.Likelihood.LIKELY for face in faces)
+                        if joy_detected:
+                            all_tags.add('smiling')
+                            all_tags.add('happy')
+        
+        # Outdoor context for people (people outdoors, group outdoors)
+        all_tags |= CONTEXT_RULES.context_tags(all_tags)
         
         return list(all_tags), confidence_scores
         
@@ -281,10 +247,17 @@ def test_album_tag_writing(url, threshold=30):
         processed_images = []
         failed_images = []
         
-        for image in images:
+        # Local checks and colours for every untagged thumbnail, vectorized a batch at a time
+        local_results = local_analysis.analyze_batch([
+            None if 'AutoTagged' in (image.get('KeywordArray') or []) else
+            image.get('ThumbnailUrl') or image.get('ArchivedUri') or image.get('WebUri')
+            for image in images
+        ])
+        
+        for image, local in zip(images, local_results):
             try:
                 # Check if already processed
-                current_keywords = image.get('KeywordArray', [])
+                current_keywords = image.get('KeywordArray') or []
                 if 'AutoTagged' in current_keywords:
                     continue
                 
@@ -297,7 +270,7 @@ def test_album_tag_writing(url, threshold=30):
                     continue
                 
                 # Get Vision AI tags with expanded detection
-                vision_tags, confidence_scores = get_vision_tags(vision_client, image_url)
+                vision_tags, confidence_scores = get_vision_tags(vision_client, image_url, thumbnail_url, local)
                 if not vision_tags:
                     failed_images.append(image['FileName'])
                     continue
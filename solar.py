@@ -0,0 +1,203 @@
+"""Sun position and lighting tags for SmugMug Tagger.
+
+The sun's elevation at each image's capture time and GPS position is
+computed locally with the NOAA solar position equations, vectorized in
+NumPy, and mapped to lighting tags - golden hour, blue hour, sunrise,
+sunset, night, midday. No Vision call is involved, so the tags are free
+and a whole album's take a few milliseconds.
+"""
+import datetime
+import logging
+import os
+
+import numpy as np
+
+from bursts import image_coordinates
+
+logger = logging.getLogger(__name__)
+
+# Add lighting tags from capture time and GPS
+SOLAR_TAGS = os.environ.get('SOLAR_TAGS', 'true').lower() in ('1', 'true', 'yes')
+# Zone of the camera clock. EXIF capture times carry no zone, and SmugMug
+# reports them with a +00:00 offset, so those are read as local wall-clock time.
+CAPTURE_TIMEZONE = os.environ.get('CAPTURE_TIMEZONE', 'Europe/London')
+
+# Lighting tags by solar elevation in degrees: (tag, lowest, highest, part of day)
+# Bounds are lowest <= elevation < highest, None is open; part of day is
+# 'morning', 'evening' or None for either
+LIGHTING_RULES = [
+    ('night', None, -6.0, None),
+    ('blue hour', -6.0, -4.0, None),
+    ('dawn', -6.0, -0.833, 'morning'),
+    ('dusk', -6.0, -0.833, 'evening'),
+    ('golden hour', -4.0, 6.0, None),
+    ('sunrise', -0.833, 2.0, 'morning'),
+    ('sunset', -0.833, 2.0, 'evening')
+]
+# 'midday' within this many degrees of hour angle of solar noon (15 per hour)
+MIDDAY_HOUR_ANGLE = 15.0
+# ...with the sun at least this high
+MIDDAY_MIN_ELEVATION = 6.0
+
+
+def _refraction(elevation):
+    """NOAA approximation of atmospheric refraction, in degrees"""
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        tan = np.tan(np.radians(elevation))
+        seconds = np.select(
+            [elevation > 85, elevation > 5, elevation > -0.575],
+            [
+                0.0,
+                58.1 / tan - 0.07 / tan ** 3 + 0.000086 / tan ** 5,
+                1735 + elevation * (-518.2 + elevation * (103.4 + elevation * (-12.79 + elevation * 0.711)))
+            ],
+            -20.772 / tan
+        )
+    return seconds / 3600
+
+
+def solar_position(timestamps, lat, lng):
+    """
+    Compute the sun's elevation and hour angle for many points at once
+
+    Args:
+        timestamps: Array of UTC epoch seconds
+        lat: Array of latitudes in degrees
+        lng: Array of longitudes in degrees (east positive)
+
+    Returns:
+        Tuple of (elevation, hour_angle) arrays in degrees. Elevation
+        includes refraction; hour angle is negative before solar noon.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+
+    # Julian century, then the sun's ecliptic position
+    century = (timestamps / 86400 + 2440587.5 - 2451545.0) / 36525
+    mean_longitude = (280.46646 + century * (36000.76983 + century * 0.0003032)) % 360
+    mean_anomaly = np.radians(357.52911 + century * (35999.05029 - 0.0001537 * century))
+    eccentricity = 0.016708634 - century * (0.000042037 + 0.0000001267 * century)
+    centre = (
+        np.sin(mean_anomaly) * (1.914602 - century * (0.004817 + 0.000014 * century))
+        + np.sin(2 * mean_anomaly) * (0.019993 - 0.000101 * century)
+        + np.sin(3 * mean_anomaly) * 0.000289
+    )
+    omega = np.radians(125.04 - 1934.136 * century)
+    apparent_longitude = np.radians(mean_longitude + centre - 0.00569 - 0.00478 * np.sin(omega))
+    obliquity = np.radians(
+        23 + (26 + (21.448 - century * (46.815 + century * (0.00059 - century * 0.001813))) / 60) / 60
+        + 0.00256 * np.cos(omega)
+    )
+    declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_longitude))
+
+    # Equation of time, in minutes
+    y = np.tan(obliquity / 2) ** 2
+    mean_longitude = np.radians(mean_longitude)
+    equation_of_time = 4 * np.degrees(
+        y * np.sin(2 * mean_longitude)
+        - 2 * eccentricity * np.sin(mean_anomaly)
+        + 4 * eccentricity * y * np.sin(mean_anomaly) * np.cos(2 * mean_longitude)
+        - 0.5 * y * y * np.sin(4 * mean_longitude)
+        - 1.25 * eccentricity * eccentricity * np.sin(2 * mean_anomaly)
+    )
+
+    true_solar_minutes = ((timestamps % 86400) / 60 + equation_of_time + 4 * lng) % 1440
+    hour_angle = true_solar_minutes / 4 - 180
+    lat = np.radians(lat)
+    cos_zenith = (
+        np.sin(lat) * np.sin(declination)
+        + np.cos(lat) * np.cos(declination) * np.cos(np.radians(hour_angle))
+    )
+    elevation = 90 - np.degrees(np.arccos(np.clip(cos_zenith, -1, 1)))
+    return elevation + _refraction(elevation), hour_angle
+
+
+def lighting_tags(timestamps, lat, lng):
+    """
+    Return the lighting tags for many points at once
+
+    Args:
+        timestamps: Array of UTC epoch seconds
+        lat: Array of latitudes
+        lng: Array of longitudes
+
+    Returns:
+        One list of tags per point, in LIGHTING_RULES order with midday last
+    """
+    elevation, hour_angle = solar_position(timestamps, lat, lng)
+    morning = hour_angle < 0
+    masks = []
+    for tag, lowest, highest, part in LIGHTING_RULES:
+        mask = np.ones(len(elevation), dtype=bool)
+        if lowest is not None:
+            mask &= elevation >= lowest
+        if highest is not None:
+            mask &= elevation < highest
+        if part == 'morning':
+            mask &= morning
+        elif part == 'evening':
+            mask &= ~morning
+        masks.append((tag, mask))
+    masks.append(('midday', (np.abs(hour_angle) < MIDDAY_HOUR_ANGLE) & (elevation >= MIDDAY_MIN_ELEVATION)))
+
+    tags = [[] for _ in range(len(elevation))]
+    for tag, mask in masks:
+        for point in np.flatnonzero(mask):
+            tags[point].append(tag)
+    return tags
+
+
+def _capture_zone():
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(CAPTURE_TIMEZONE)
+    except Exception as e:
+        logger.warning(f"Unknown CAPTURE_TIMEZONE {CAPTURE_TIMEZONE} ({str(e)}), reading capture times as UTC")
+        return datetime.timezone.utc
+
+
+_CAPTURE_ZONE = _capture_zone()
+
+
+def capture_timestamp(value):
+    """
+    Return a SmugMug DateTimeOriginal as UTC epoch seconds, or None
+
+    Times without an offset, or with SmugMug's +00:00, are camera
+    wall-clock times in CAPTURE_TIMEZONE; any other offset is trusted.
+    """
+    if not value:
+        return None
+    try:
+        captured = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if captured.utcoffset() is None or captured.utcoffset() == datetime.timedelta(0):
+        captured = captured.replace(tzinfo=_CAPTURE_ZONE)
+    return captured.timestamp()
+
+
+def album_lighting(images):
+    """
+    Compute the lighting tags of an album listing
+
+    Returns:
+        Dict mapping listing index to its lighting tags, for images with
+        both a capture time and GPS
+    """
+    located = []
+    for i, image in enumerate(images):
+        position = image_coordinates(image)
+        captured = capture_timestamp(image.get('DateTimeOriginal')) if position else None
+        if captured is not None:
+            located.append((i, captured, position))
+    if not located:
+        return {}
+    indices, timestamps, positions = zip(*located)
+    lat, lng = zip(*positions)
+    return {
+        i: tags
+        for i, tags in zip(indices, lighting_tags(timestamps, lat, lng))
+        if tags
+    }
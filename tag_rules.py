@@ -0,0 +1,183 @@
+"""Declarative tag rules for SmugMug Tagger.
+
+The tags implied by Vision labels, by combinations of tags and by
+keywords in web page titles are kept in one rule table. It is compiled
+once into hash lookups, frozensets, precompiled patterns and a keyword
+automaton, so applying it to an image's annotations is a few dictionary
+and set operations rather than chains of list scans and inline regexes.
+Shared by app.py and the command-line taggers.
+"""
+import json
+import logging
+import os
+import re
+
+from aho_corasick import Automaton
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES = {
+    # Labels that imply more general tags
+    'labels': [
+        {'when': ['mountain', 'hill', 'valley', 'landscape'], 'add': ['landscape', 'nature', 'outdoors']},
+        {'when': ['tree', 'forest', 'woodland'], 'add': ['forest', 'trees', 'nature']},
+        {'when': ['sea', 'ocean', 'coast', 'beach', 'shore'], 'add': ['coastal', 'seascape']},
+        {'when': ['snow', 'winter', 'ice'], 'add': ['winter', 'snow']},
+        {'when': ['hiking', 'trekking', 'walking', 'trail'], 'add': ['hiking', 'trekking', 'outdoor activity']}
+    ],
+    # Tags added when all "requires" tags and any "when" tag are present
+    'context': [
+        {'requires': ['people'], 'when': ['kayak', 'boat', 'canoe'], 'add': ['kayaking', 'water activity']},
+        {'requires': ['people'], 'when': ['mountain', 'hill', 'hiking', 'trail'], 'add': ['hiking', 'trekking']},
+        {'requires': [], 'when': ['scotland'], 'add': ['wilderness scotland', 'scottish highlands']}
+    ],
+    # Keywords looked for in the titles of web pages showing the image, per region
+    'title_keywords': {
+        'scotland': [
+            'scotland', 'scottish', 'highland', 'hebrides', 'isle', 'skye',
+            'glen', 'loch', 'ben', 'munro', 'cairn', 'cuillin', 'torridon',
+            'glencoe', 'nevis', 'cairngorm', 'edinburgh', 'glasgow', 'inverness'
+        ]
+    },
+    # Characters either side of a title keyword searched for related words
+    'title_context': 15,
+    # Related words kept per title keyword
+    'title_context_words': 3,
+    # Words never used as tags when splitting labels and titles
+    'stopwords': ['and', 'the', 'with', 'from', 'this', 'that'],
+    # Shortest word kept when splitting labels and titles
+    'min_word_length': 3
+}
+
+
+def load_rules(value=None):
+    """
+    Return the tag rules, with overrides merged over DEFAULT_RULES
+
+    Args:
+        value: JSON object, or a path to a JSON file. List entries (labels,
+            context, stopwords) are appended to the defaults,
+            title_keywords regions are added or replaced, and other keys
+            replace the default.
+    """
+    rules = {
+        key: list(rule) if isinstance(rule, list) else dict(rule) if isinstance(rule, dict) else rule
+        for key, rule in DEFAULT_RULES.items()
+    }
+    if not value:
+        return rules
+    if os.path.exists(value):
+        with open(value, encoding='utf-8') as f:
+            overrides = json.load(f)
+    else:
+        overrides = json.loads(value)
+    for key, rule in overrides.items():
+        if isinstance(rule, list) and isinstance(rules.get(key), list):
+            rules[key].extend(rule)
+        elif isinstance(rule, dict) and isinstance(rules.get(key), dict):
+            rules[key].update(rule)
+        else:
+            rules[key] = rule
+    return rules
+
+
+class TagRules:
+    """
+    A compiled tag rule table.
+
+    Args:
+        rules: Rule table as in DEFAULT_RULES
+    """
+
+    def __init__(self, rules=None):
+        rules = rules if rules is not None else load_rules()
+        # label -> every tag it implies, merged across rules
+        self._implied = {}
+        for rule in rules.get('labels', []):
+            for label in rule['when']:
+                self._implied[label] = self._implied.get(label, frozenset()) | frozenset(rule['add'])
+        self._context = [
+            (frozenset(rule.get('requires', [])), frozenset(rule['when']), frozenset(rule['add']))
+            for rule in rules.get('context', [])
+        ]
+        self.stopwords = frozenset(rules.get('stopwords', []))
+        self._word = re.compile(rf"\b[a-zA-Z]{{{int(rules.get('min_word_length', 3))},}}\b")
+        # Every region's title keywords in one automaton
+        self._titles = Automaton(
+            keyword.lower()
+            for keywords in rules.get('title_keywords', {}).values()
+            for keyword in keywords
+        )
+        self._title_context = rules.get('title_context', 15)
+        self._title_context_words = rules.get('title_context_words', 3)
+
+    def label_tags(self, labels):
+        """Return the tags implied by a collection of labels"""
+        implied = self._implied
+        tags = set()
+        for label in labels:
+            extra = implied.get(label)
+            if extra:
+                tags |= extra
+        return tags
+
+    def context_tags(self, tags):
+        """Return the tags added by context rules to a set of tags"""
+        added = set()
+        for requires, when, add in self._context:
+            if requires <= tags and not when.isdisjoint(tags):
+                added |= add
+        return added
+
+    def words(self, text, min_length=None):
+        """
+        Return the words of text worth using as tags, in order, without stopwords
+
+        min_length raises the table's shortest word for one caller.
+        """
+        return [
+            word for word in self._word.findall(text)
+            if word not in self.stopwords and (min_length is None or len(word) >= min_length)
+        ]
+
+    def title_tags(self, title):
+        """
+        Return tags from a web page title: each keyword it contains, plus the
+        words around the keyword's first occurrence, alone and paired with it
+
+        Every keyword is found in a single pass over the title.
+        """
+        title = title.lower()
+        tags = set()
+        seen = set()
+        for start, end, keyword in self._titles.finditer(title):
+            if keyword in seen:
+                continue
+            seen.add(keyword)
+            tags.add(keyword)
+            context = title[max(0, start - self._title_context):end + self._title_context]
+            # Stopwords still take up places in the context, as they always have
+            words = self._word.findall(context)
+            if len(words) >= 2:
+                if keyword in words:
+                    words.remove(keyword)
+                for word in words[:self._title_context_words]:
+                    if word not in self.stopwords:
+                        tags.add(word)
+                        tags.add(f"{keyword} {word}")
+        return tags
+
+    def expand(self, tags):
+        """
+        Apply the label and context rules to an image's tags
+
+        Returns:
+            The tags plus everything they imply
+        """
+        tags = set(tags)
+        tags |= self.label_tags(tags)
+        tags |= self.context_tags(tags)
+        return tags
+
+
+TAG_RULES = TagRules(load_rules(os.environ.get('TAG_RULES')))
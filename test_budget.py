@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Simple test of the Vision budget's daily and per-job caps
+"""
+import tempfile
+
+from budget import VisionBudget, BudgetExceeded, DAILY, JOB
+
+def test_daily_cap():
+    """Check that the daily cap is shared by every session"""
+    print("Testing daily cap")
+    budget = VisionBudget(daily_limit=3, directory=tempfile.mkdtemp())
+    budget.charge('a', 'label_detection')
+    budget.charge('b', 'label_detection')
+    budget.charge(None, 'web_detection')
+    try:
+        budget.charge('c', 'label_detection')
+        print("❌ Fourth call went over the daily cap")
+        return False
+    except BudgetExceeded as e:
+        if e.scope == DAILY and e.retry_after is not None:
+            print(f"✅ Fourth call refused: {e}")
+        else:
+            print(f"❌ Wrong cap reported: {e.scope}")
+            return False
+
+    stats = budget.stats()
+    if stats['units'] == 3 and stats['dailyRemaining'] == 0:
+        print(f"✅ Stats show 3 units used, costing ${stats['cost']}")
+    else:
+        print(f"❌ Unexpected stats: {stats}")
+        return False
+    return True
+
+def test_job_cap():
+    """Check the per-job cap, including across a quota-day rollover"""
+    print("\nTesting per-job cap")
+    directory = tempfile.mkdtemp()
+    budget = VisionBudget(job_limit=2, directory=directory)
+    budget.charge('job', 'label_detection')
+    budget.charge('other', 'label_detection')
+    if budget.remaining('job')[JOB] == 1:
+        print("✅ Other sessions don't use up this job's budget")
+    else:
+        print(f"❌ Unexpected remaining budget: {budget.remaining('job')}")
+        return False
+
+    # Start a new quota day; the job's earlier usage must still count
+    budget.day = '2000-01-01'
+    budget.charge('job', 'web_detection')
+    restarted = VisionBudget(job_limit=2, directory=directory)
+    try:
+        restarted.check('job')
+        print("❌ Job got a fresh allowance on a new day or after a restart")
+        return False
+    except BudgetExceeded as e:
+        if e.scope == JOB:
+            print("✅ Job cap holds across quota days and restarts")
+        else:
+            print(f"❌ Wrong cap reported: {e.scope}")
+            return False
+
+    usage = restarted.session_usage('job')
+    if usage['features'] == {'label_detection': 1, 'web_detection': 1}:
+        print(f"✅ Job usage: {usage['units']} units, ${usage['cost']}")
+    else:
+        print(f"❌ Unexpected job usage: {usage}")
+        return False
+
+    restarted.forget_session('job')
+    if restarted.session_usage('job')['units'] == 0:
+        print("✅ Forgotten session starts again from zero")
+    else:
+        print("❌ Session usage survived forget_session")
+        return False
+    return True
+
+if __name__ == "__main__":
+    ok = test_daily_cap() and test_job_cap()
+    print("\nBudget test " + ("passed" if ok else "failed"))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Simple ordering test for the background job engine
+"""
+import threading
+
+from job_engine import JobEngine
+
+def test_job_engine():
+    """Check that jobs run by start time and that cancelled jobs never run"""
+    print("Testing JobEngine ordering")
+    engine = JobEngine(workers=1)
+    order = []
+    done = threading.Event()
+
+    def record(name):
+        order.append(name)
+        if name == 'last':
+            done.set()
+
+    engine.submit('last', record, ('last',), delay=0.4)
+    engine.submit('second', record, ('second',), delay=0.2)
+    engine.submit('first', record, ('first',))
+    engine.submit('cancelled', record, ('cancelled',), delay=0.1)
+    engine.cancel('cancelled')
+
+    # Cancelled and submitted again: only the second submission may run
+    engine.submit('resubmitted', record, ('stale',), delay=0.1)
+    engine.cancel('resubmitted')
+    engine.submit('resubmitted', record, ('resubmitted',), delay=0.3)
+
+    if not engine.submit('last', record, ('last',)):
+        print("✅ Duplicate job ID not queued twice")
+    else:
+        print("❌ Duplicate job ID was queued")
+        return False
+
+    if not done.wait(5):
+        print(f"❌ Jobs did not finish, ran {order}")
+        return False
+    expected = ['first', 'second', 'resubmitted', 'last']
+    if order == expected:
+        print(f"✅ Jobs ran in order: {', '.join(order)}")
+    else:
+        print(f"❌ Expected {expected}, got {order}")
+        return False
+
+    stats = engine.stats()
+    if stats['completed'] == 4 and stats['queued'] == stats['scheduled'] == 0:
+        print("✅ Engine stats show 4 completed jobs and an empty queue")
+    else:
+        print(f"❌ Unexpected engine stats: {stats}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    ok = test_job_engine()
+    print("\nJob engine test " + ("passed" if ok else "failed"))
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Simple test of the preview's Vision unit estimates
+"""
+from preview import estimate_units
+
+def test_estimate_units():
+    """Check the sample's units are scaled up to the full run"""
+    print("Testing estimate_units")
+    sample = {'label_detection': 10, 'web_detection': 10}
+    # 10 images analysed of 100 pending; 20 would inherit burst tags, 50 reuse location tags
+    units = estimate_units(sample, 10, 100, 20, 50)
+    if units == {'label_detection': 80, 'web_detection': 50}:
+        print(f"✅ Estimated units: {units}")
+    else:
+        print(f"❌ Unexpected estimate: {units}")
+        return False
+
+    if estimate_units(sample, 0, 100, 0, 0) == {}:
+        print("✅ No estimate when nothing was analysed")
+    else:
+        print("❌ Estimated units from an empty sample")
+        return False
+    return True
+
+if __name__ == "__main__":
+    ok = test_estimate_units()
+    print("\nPreview test " + ("passed" if ok else "failed"))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Simple ordering test for the queue of images waiting to be retried
+"""
+import time
+
+from retry import RetryQueue
+
+def test_retry_queue():
+    """Check that retries come out in due order and only once due"""
+    print("Testing RetryQueue ordering")
+    queue = RetryQueue()
+    queue.push({'index': 2}, delay=0.2)
+    queue.push({'index': 0}, delay=0)
+    queue.push({'index': 1}, delay=0)
+    queue.push({'index': 3}, delay=60)
+
+    due = [entry['index'] for entry in queue.pop_due()]
+    if due == [0, 1]:
+        print("✅ Due entries returned in push order")
+    else:
+        print(f"❌ Expected [0, 1], got {due}")
+        return False
+
+    time.sleep(0.25)
+    due = [entry['index'] for entry in queue.pop_due()]
+    if due == [2] and len(queue) == 1:
+        print("✅ Delayed entry returned once due, later entry still waiting")
+    else:
+        print(f"❌ Expected [2] with one left, got {due} with {len(queue)} left")
+        return False
+
+    wait = queue.seconds_until_next()
+    if wait is not None and 55 < wait <= 60:
+        print(f"✅ Next retry due in {wait:.0f}s")
+    else:
+        print(f"❌ Unexpected wait until next retry: {wait}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    ok = test_retry_queue()
+    print("\nRetry queue test " + ("passed" if ok else "failed"))
@@ -1,4 +1,15 @@
-"""UK landscape tag enhancement module for SmugMug Tagger."""
+"""UK landscape tag enhancement module for SmugMug Tagger.
+
+The region, feature and weather tables are compiled at import into an
+inverted index of exact terms and a substring automaton, so each image
+costs one pass over its tags rather than a scan per table entry. Located
+images are placed in a country and sub-region by the polygon index in
+regions.py.
+"""
+import collections
+
+from aho_corasick import Automaton
+from regions import REGION_INDEX
 
 # UK regions and their characteristic features
 UK_REGIONS = {
@@ -44,140 +55,156 @@ WEATHER_CONDITIONS = [
     "blue hour", "night", "dark", "light", "shadow"
 ]
 
-def enhance_uk_landscape_tags(location_data, vision_tags):
-    """
-    Enhance vision tags with UK-specific landscape tags based on location data.
+# Tag substrings that add Scottish landscape tags, for images located in Scotland
+SCOTTISH_FEATURES = [
+    ("loch", "scottish loch"),
+    ("mountain", "scottish mountains"),
+    ("hill", "scottish mountains"),
+    ("castle", "scottish castle"),
+    ("beach", "scottish coast"),
+    ("coast", "scottish coast")
+]
+
+# Region terms in table order, and an automaton finding any of them inside a tag
+_REGION_TERMS = [
+    (country, region.lower())
+    for country, regions in UK_REGIONS.items()
+    for region_list in regions.values()
+    for region in region_list
+]
+_REGION_AUTOMATON = Automaton((term, n) for n, (_, term) in enumerate(_REGION_TERMS))
+_SCOTTISH_AUTOMATON = Automaton((term, n) for n, (term, _) in enumerate(SCOTTISH_FEATURES))
+
+# Inverted index: exact tag -> position in the feature / weather tables
+_FEATURE_INDEX = {feature: n for n, feature in enumerate(LANDSCAPE_FEATURES)}
+_WEATHER_INDEX = {condition: n for n, condition in enumerate(WEATHER_CONDITIONS)}
+
+
+def _matches(automaton, tags):
+    """Return the values of every automaton pattern found inside any of the tags"""
+    return {value for tag in tags for _, _, value in automaton.finditer(tag)}
+
+
+def _inferred_region_tags(lowercase_tags, tag_set):
+    """Country and region tags inferred from the tags of an image with no location"""
+    by_country = collections.defaultdict(list)
+    for n in sorted(_matches(_REGION_AUTOMATON, lowercase_tags)):
+        country, region = _REGION_TERMS[n]
+        by_country[country].append(region)
     
-    Args:
-        location_data: Dictionary containing lat/lng data
-        vision_tags: List of tags generated by Vision API
-        
-    Returns:
-        Enhanced list of tags with UK-specific landscape information
+    tags = []
+    for country in UK_REGIONS:
+        country_detected = country.lower() in tag_set
+        if country_detected:
+            tags.append(country.lower())
+        for region in by_country.get(country, []):
+            if country_detected:
+                tags.append(f"{country.lower()} {region}")
+            tags.append(region)
+    return tags
+
+
+def _indexed_tags(index, tag_set):
+    """Return the tags present in an inverted index, in table order"""
+    return sorted((tag for tag in tag_set if tag in index), key=index.get)
+
+
+# Feature tags added for images located in each region, keyed on a region tag
+REGION_FEATURES = {
+    "northern england": [(("lake", "mountain"), "lake district")],
+    "central england": [(("peak", "hill"), "peak district")],
+    "southern england": [(("coast",), "english coast")],
+    "wales": [
+        (("mountain",), "welsh mountains"),
+        (("snowdon", "snowdonia"), "snowdonia"),
+        (("coast", "beach"), "welsh coast")
+    ],
+    "northern ireland": [(("coast",), "irish coast"), (("mountain",), "irish mountains")],
+    "ireland": [(("coast",), "irish coast"), (("mountain",), "irish mountains")]
+}
+
+
+def _located(location_data):
+    """Return (lat, lng) from location data, or None without a usable position"""
+    if not location_data or not (location_data.get('lat') and location_data.get('lng')):
+        return None
+    return location_data.get('lat', 0), location_data.get('lng', 0)
+
+
+def _enhance(region_tags, vision_tags):
+    """
+    Enhance one image's tags, given its region tags from the region index,
+    or None if the image has no location
     """
     enhanced_tags = list(vision_tags)  # Make a copy of the original tags
     
     # Convert all tags to lowercase for easier comparison
     lowercase_tags = [tag.lower() for tag in vision_tags]
+    tag_set = set(lowercase_tags)
     
     # If no location data, use vision tags to infer location
-    if not location_data or not (location_data.get('lat') and location_data.get('lng')):
+    if region_tags is None:
         # Check for region names in tags
-        for country, regions in UK_REGIONS.items():
-            country_detected = False
-            if country.lower() in lowercase_tags:
-                enhanced_tags.append(f"{country.lower()}")
-                country_detected = True
-            
-            # Check for regions and features
-            for region_type, region_list in regions.items():
-                for region in region_list:
-                    if any(region.lower() in tag for tag in lowercase_tags):
-                        if country_detected:
-                            enhanced_tags.append(f"{country.lower()} {region.lower()}")
-                        enhanced_tags.append(region.lower())
+        enhanced_tags.extend(_inferred_region_tags(lowercase_tags, tag_set))
     else:
-        # Use latitude and longitude to determine region
-        lat, lng = location_data.get('lat', 0), location_data.get('lng', 0)
+        # Country and sub-regions from the border polygons, broadest first
+        enhanced_tags.extend(region_tags)
         
-        # Scotland: roughly 55.0° to 59.5° N, -6.0° to -1.0° W
-        if 55.0 <= lat <= 59.5 and -6.0 <= lng <= -1.0:
-            enhanced_tags.append("scotland")
-            
-            # Highland Scotland
-            if lat >= 57.0:
-                enhanced_tags.append("scottish highlands")
-                if lng < -4.0:
-                    enhanced_tags.append("west highlands")
-                    enhanced_tags.append("northwest scotland")
-                else:
-                    enhanced_tags.append("east highlands")
-                    enhanced_tags.append("northeast scotland")
-            
-            # Central Scotland
-            elif 56.0 <= lat < 57.0:
-                enhanced_tags.append("central scotland")
-                
-            # Southern Scotland
-            else:
-                enhanced_tags.append("southern scotland")
-                if lng < -4.0:
-                    enhanced_tags.append("southwest scotland")
-                else:
-                    enhanced_tags.append("southeast scotland")
-                    
-            # Check for specific landscape features in Scotland
-            for tag in lowercase_tags:
-                if "loch" in tag:
-                    enhanced_tags.append("scottish loch")
-                if "mountain" in tag or "hill" in tag:
-                    enhanced_tags.append("scottish mountains")
-                if "castle" in tag:
-                    enhanced_tags.append("scottish castle")
-                if "beach" in tag or "coast" in tag:
-                    enhanced_tags.append("scottish coast")
+        for region in region_tags:
+            for triggers, tag in REGION_FEATURES.get(region, []):
+                if not tag_set.isdisjoint(triggers):
+                    enhanced_tags.append(tag)
         
-        # England: roughly 50.0° to 55.0° N, -6.0° to 2.0° E
-        elif 50.0 <= lat <= 55.0 and -6.0 <= lng <= 2.0:
-            enhanced_tags.append("england")
-            
-            # Northern England
-            if lat >= 53.5:
-                enhanced_tags.append("northern england")
-                if "lake" in lowercase_tags or "mountain" in lowercase_tags:
-                    enhanced_tags.append("lake district")
-            
-            # Central England
-            elif 52.0 <= lat < 53.5:
-                enhanced_tags.append("central england")
-                if "peak" in lowercase_tags or "hill" in lowercase_tags:
-                    enhanced_tags.append("peak district")
-            
-            # Southern England
-            else:
-                enhanced_tags.append("southern england")
-                if "coast" in lowercase_tags:
-                    enhanced_tags.append("english coast")
-            
-        # Wales: roughly 51.3° to 53.4° N, -5.5° to -2.8° W
-        elif 51.3 <= lat <= 53.4 and -5.5 <= lng <= -2.8:
-            enhanced_tags.append("wales")
-            if "mountain" in lowercase_tags:
-                enhanced_tags.append("welsh mountains")
-            if "snowdon" in lowercase_tags or "snowdonia" in lowercase_tags:
-                enhanced_tags.append("snowdonia")
-            if "coast" in lowercase_tags or "beach" in lowercase_tags:
-                enhanced_tags.append("welsh coast")
-                
-        # Ireland: roughly 51.4° to 55.4° N, -10.5° to -6.0° W
-        elif 51.4 <= lat <= 55.4 and -10.5 <= lng <= -6.0:
-            # Northern Ireland
-            if lat >= 54.0:
-                enhanced_tags.append("northern ireland")
-            # Republic of Ireland
-            else:
-                enhanced_tags.append("ireland")
-                enhanced_tags.append("republic of ireland")
-            
-            if "coast" in lowercase_tags:
-                enhanced_tags.append("irish coast")
-            if "mountain" in lowercase_tags:
-                enhanced_tags.append("irish mountains")
-    
-    # Add landscape features based on detected tags
-    for feature in LANDSCAPE_FEATURES:
-        if feature in lowercase_tags:
-            # Don't add duplicates
-            if feature not in enhanced_tags:
-                enhanced_tags.append(feature)
+        # Check for specific landscape features in Scotland
+        if "scotland" in region_tags:
+            for tag in lowercase_tags:
+                for n in sorted(_matches(_SCOTTISH_AUTOMATON, [tag])):
+                    enhanced_tags.append(SCOTTISH_FEATURES[n][1])
     
-    # Add weather conditions
-    for condition in WEATHER_CONDITIONS:
-        if condition in lowercase_tags:
-            # Don't add duplicates
-            if condition not in enhanced_tags:
-                enhanced_tags.append(condition)
+    # Add landscape features and weather conditions based on detected tags
+    enhanced_tags.extend(_indexed_tags(_FEATURE_INDEX, tag_set))
+    enhanced_tags.extend(_indexed_tags(_WEATHER_INDEX, tag_set))
     
     # Remove duplicates while preserving order
     seen = set()
     return [tag for tag in enhanced_tags if not (tag in seen or seen.add(tag))]
+
+
+def enhance_uk_landscape_tags(location_data, vision_tags):
+    """
+    Enhance vision tags with UK-specific landscape tags based on location data.
+    
+    Args:
+        location_data: Dictionary containing lat/lng data
+        vision_tags: List of tags generated by Vision API
+        
+    Returns:
+        Enhanced list of tags with UK-specific landscape information
+    """
+    position = _located(location_data)
+    region_tags = REGION_INDEX.region_tags(*position) if position else None
+    return _enhance(region_tags, vision_tags)
+
+
+def enhance_uk_landscape_tags_batch(location_data_list, vision_tags_list):
+    """
+    Enhance the tags of many images in one call
+    
+    Every located image is classified by the region index in one
+    vectorized lookup.
+    
+    Args:
+        location_data_list: One location dict (or None) per image
+        vision_tags_list: One list of Vision tags per image
+        
+    Returns:
+        One enhanced tag list per image, as from enhance_uk_landscape_tags
+    """
+    positions = [_located(location_data) for location_data in location_data_list]
+    located = [n for n, position in enumerate(positions) if position]
+    region_tags = [None] * len(positions)
+    if located:
+        lat, lng = zip(*(positions[n] for n in located))
+        for n, tags in zip(located, REGION_INDEX.classify(lat, lng)):
+            region_tags[n] = tags
+    return [_enhance(tags, vision_tags) for tags, vision_tags in zip(region_tags, vision_tags_list)]
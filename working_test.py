@@ -9,11 +9,24 @@ import requests
 from io import BytesIO
 from urllib.parse import urlparse
 
-def get_image_exif(image_url):
-    """Extract EXIF data from image"""
+import colour_analysis
+import local_analysis
+
+def load_image(image_url):
+    """Download and open an image, or return None if that fails"""
     try:
         response = requests.get(image_url)
-        img = Image.open(BytesIO(response.content))
+        return Image.open(BytesIO(response.content))
+    except Exception as e:
+        print(f"Error downloading image: {str(e)}")
+        return None
+
+def get_image_exif(image_url):
+    """Extract EXIF data from an image URL or an already opened image"""
+    try:
+        img = image_url if isinstance(image_url, Image.Image) else load_image(image_url)
+        if img is None:
+            return {}
         
         exif_data = {}
         if hasattr(img, '_getexif'):
@@ -37,8 +50,9 @@ def get_vision_tags(vision_client, image_url):
     confidence_scores = {}
     
     try:
-        # Get EXIF data
-        exif_data = get_image_exif(image_url)
+        # Download once - used for EXIF and the local colour analysis
+        img = load_image(image_url)
+        exif_data = get_image_exif(img) if img else {}
         
         # Extract GPS coordinates if available
         lat = None
@@ -112,26 +126,18 @@ def get_vision_tags(vision_client, image_url):
             if logo.score * 100 >= 30:
                 all_tags.add(f"{logo.description} logo")
         
-        # Weather & season detection from properties
-        property_response = vision_client.image_properties(image=vision_image)
-        if property_response.image_properties_annotation:
-            colors = property_response.image_properties_annotation.dominant_colors.colors
-            
-            # Detect weather conditions
-            blue_sky = any(c.color.blue > 200 and c.color.blue > c.color.red for c in colors)
-            grey_sky = any(all(160 < x < 190 for x in [c.color.red, c.color.green, c.color.blue]) for c in colors)
-            if blue_sky:
+        # Weather & season detection from colours, computed locally
+        if img:
+            colours = colour_analysis.analyze(local_analysis.load_image(img))
+            if 'clear sky' in colours['tags']:
                 all_tags.add("clear sky")
-            if grey_sky:
+            if 'overcast' in colours['tags']:
                 all_tags.add("overcast")
-                
-            # Detect seasons
-            green_foliage = any(c.color.green > 150 and c.color.green > c.color.red and c.color.green > c.color.blue for c in colors)
-            autumn_colors = any(c.color.red > 180 and c.color.red > c.color.blue for c in colors)
-            if green_foliage:
+            if 'green foliage' in colours['tags']:
                 all_tags.add("summer")
-            if autumn_colors:
+            if 'autumn' in colours['tags']:
                 all_tags.add("autumn")
+            confidence_scores.update(colours['confidence_scores'])
         
         # Safe search annotations
         safe_response = vision_client.safe_search_detection(image=vision_image)